@@ -85,7 +85,19 @@ def create_app():
     from models import User
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        from session_principal import load_principal, load_full_user, store_principal
+        use_snapshot = app.config.get('SESSION_PRINCIPAL_CACHE')
+
+        if use_snapshot:
+            principal = load_principal(user_id)
+            if principal is not None:
+                return principal
+
+        # Roles and company in the same query so permission checks stay in memory
+        user = load_full_user(user_id)
+        if user is not None and use_snapshot:
+            store_principal(user)
+        return user
 
     @app.context_processor
     def inject_user_preferences():
@@ -127,6 +139,8 @@ def create_app():
     from routes.cashflow_routes import cashflow_bp
     from routes.drive_routes import drive_bp
     from routes.voucher_routes import voucher_bp
+    from routes.export_routes import exports_bp
+    from routes.search_routes import search_bp
 
     # Register blueprints in the app
     app.register_blueprint(public_bp)
@@ -147,6 +161,8 @@ def create_app():
     app.register_blueprint(cashflow_bp)
     app.register_blueprint(drive_bp)
     app.register_blueprint(voucher_bp)
+    app.register_blueprint(exports_bp)
+    app.register_blueprint(search_bp)
 
     # Redirect users to dashboard if logged in
     @app.before_request
@@ -214,6 +230,11 @@ def create_app():
     # Register the CLI command
     app.cli.add_command(create_superuser)
     app.cli.add_command(seed_roles)
+    app.cli.add_command(cashbook_sync)
+    app.cli.add_command(ledger_rebuild)
+    app.cli.add_command(kpi_rollup)
+    app.cli.add_command(par_snapshot)
+    app.cli.add_command(export_worker)
 
     from flask import jsonify
     from sqlalchemy import text
@@ -281,6 +302,118 @@ def seed_roles():
     db.session.commit()
     click.echo(f"✅ Seeded {created_count} new role(s).")
 
+# CLI Command for the nightly cashbook catch-up
+@click.command("cashbook-sync")
+@click.option("--company-id", type=int, default=None, help="Only reconcile this company.")
+@click.option("--user-id", type=int, default=None,
+              help="Attribute inserted rows to this user (default: the company's first user).")
+@with_appcontext
+def cashbook_sync(company_id, user_id):
+    from models import Company
+    from cashbook_helpers import reconcile_cashbook
+
+    companies = Company.query.order_by(Company.id)
+    if company_id:
+        companies = companies.filter_by(id=company_id)
+
+    for company in companies.all():
+        touched = reconcile_cashbook(company.id, created_by=user_id)
+        click.echo(f"Company {company.id}: {touched} cashbook source(s) re-synced.")
+
+# CLI Command to replay every loan ledger (after rate fixes or imports)
+@click.command("ledger-rebuild")
+@click.option("--company-id", type=int, default=None, help="Only rebuild loans of this company.")
+@click.option("--workers", type=int, default=os.cpu_count() or 1, show_default=True, help="Worker processes.")
+@click.option("--batch-size", type=int, default=2000, show_default=True, help="Rows per fetch and per bulk update.")
+@with_appcontext
+def ledger_rebuild(company_id, workers, batch_size):
+    import time
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from ledger_rebuild import rebuild_shard, _init_worker
+
+    started = time.perf_counter()
+    workers = max(workers, 1)
+    if db.engine.dialect.name != 'postgresql':
+        workers = 1  # SQLite takes one writer at a time
+
+    if workers == 1:
+        results = [rebuild_shard(0, 1, company_id, batch_size)]
+    else:
+        # Spawned workers build their own app and connection pool
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        ) as pool:
+            futures = [pool.submit(rebuild_shard, shard, workers, company_id, batch_size) for shard in range(workers)]
+            results = [future.result() for future in futures]
+
+    elapsed = time.perf_counter() - started
+    loans = sum(r["loans"] for r in results)
+    rows = sum(r["rows"] for r in results)
+    timings = sorted((t for r in results for t in r["timings"]), reverse=True)
+
+    for r in results:
+        click.echo(f"Shard {r['shard']}: {r['loans']} loan(s), {r['rows']} row(s) in {r['seconds']:.2f}s")
+
+    click.echo(
+        f"✅ Rebuilt {loans} loan(s), {rows} ledger row(s) in {elapsed:.2f}s "
+        f"({loans / elapsed if elapsed else 0:.0f} loans/s, {rows / elapsed if elapsed else 0:.0f} rows/s)"
+    )
+    if timings:
+        avg_ms = sum(t for t, _ in timings) / len(timings) * 1000
+        click.echo(f"Per-loan allocation: avg {avg_ms:.2f}ms, max {timings[0][0] * 1000:.2f}ms")
+        for seconds, loan_id in timings[:5]:
+            click.echo(f"  loan {loan_id}: {seconds * 1000:.2f}ms")
+
+# CLI Command for the nightly KPI rollup catch-up
+@click.command("kpi-rollup")
+@click.option("--company-id", type=int, default=None, help="Only rebuild this company.")
+@with_appcontext
+def kpi_rollup(company_id):
+    from models import Company
+    from kpi_rollup import rebuild_kpi_rollups
+
+    companies = Company.query.order_by(Company.id)
+    if company_id:
+        companies = companies.filter_by(id=company_id)
+
+    for company in companies.all():
+        rows = rebuild_kpi_rollups(company.id)
+        click.echo(f"Company {company.id}: {rows} daily rollup row(s) rebuilt.")
+
+# CLI Command for the nightly PAR snapshot (trend lines)
+@click.command("par-snapshot")
+@click.option("--company-id", type=int, default=None, help="Only snapshot this company.")
+@with_appcontext
+def par_snapshot(company_id):
+    from models import Company
+    from par_report import take_par_snapshot
+
+    companies = Company.query.order_by(Company.id)
+    if company_id:
+        companies = companies.filter_by(id=company_id)
+
+    for company in companies.all():
+        rows = take_par_snapshot(company.id)
+        click.echo(f"Company {company.id}: {rows} PAR snapshot row(s) stored.")
+
+# CLI Command that builds queued report exports (run alongside the web workers)
+@click.command("export-worker")
+@click.option("--once", is_flag=True, help="Drain the queue and exit instead of polling.")
+@click.option("--poll-interval", type=float, default=2.0, show_default=True, help="Seconds between polls when idle.")
+@with_appcontext
+def export_worker(once, poll_interval):
+    from export_jobs import work
+
+    if once:
+        processed = work(once=True)
+        click.echo(f"✅ {processed} export job(s) processed.")
+    else:
+        click.echo("Export worker started; waiting for jobs.")
+        work(poll_interval=poll_interval)
+
 # Ensure app is available to Flask CLI
 app = create_app()
 
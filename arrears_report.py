@@ -0,0 +1,92 @@
+"""
+Arrears report queries.
+
+Every overdue loan of a scope comes back from one query that joins the
+borrower's phone and the latest repayment date and computes days overdue
+in SQL; totals come from one aggregate query. Pages are keyset paginated
+(keyset.keyset_page) on (due_date DESC, id DESC) — fewest days overdue
+first — so deep pages cost the same as the first one.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, literal
+
+from extensions import db
+from keyset import keyset_page
+from models import Loan, Borrower, LoanRepayment
+
+ARREARS_PAGE_SIZE = 100
+
+
+def days_overdue_expr(today, column):
+    """Whole days between `column` (a DateTime) and `today`, as SQL."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return literal(today, db.Date) - db.cast(column, db.Date)
+    return db.cast(func.julianday(literal(today.isoformat())) - func.julianday(func.date(column)), db.Integer)
+
+
+def arrears_filter(query, company_id, branch_id, today):
+    """Overdue = due_date before today and remaining_balance > 0."""
+    query = query.filter(
+        Loan.company_id == company_id,
+        Loan.remaining_balance > 0,
+        Loan.due_date < datetime.combine(today, datetime.min.time())
+    )
+    if branch_id:
+        query = query.filter(Loan.branch_id == branch_id)
+    return query
+
+
+def arrears_page(company_id, branch_id, today, after=None, limit=ARREARS_PAGE_SIZE):
+    """
+    One page of overdue loans as a KeysetPage. `after` is the raw cursor
+    request argument (the last row of the previous page).
+    """
+    last_repayment = arrears_filter(
+        db.session.query(
+            LoanRepayment.loan_id.label('loan_id'),
+            func.max(LoanRepayment.date_paid).label('last_repayment')
+        ).join(Loan, Loan.id == LoanRepayment.loan_id),
+        company_id, branch_id, today
+    ).group_by(LoanRepayment.loan_id).subquery()
+
+    penalty = func.coalesce(Loan.cumulative_interest, 0)
+
+    query = arrears_filter(
+        db.session.query(
+            Loan.id,
+            Loan.loan_id.label('loan_code'),
+            Loan.borrower_name.label('name'),
+            func.coalesce(Borrower.phone, 'N/A').label('phone'),
+            Loan.amount_borrowed,
+            Loan.date.label('disbursement_date'),
+            Loan.due_date,
+            Loan.remaining_balance.label('balance'),
+            penalty.label('penalty'),
+            (Loan.remaining_balance + penalty).label('total_arrears'),
+            days_overdue_expr(today, Loan.due_date).label('days'),
+            last_repayment.c.last_repayment,
+        ).outerjoin(Borrower, Borrower.id == Loan.borrower_id)
+         .outerjoin(last_repayment, last_repayment.c.loan_id == Loan.id),
+        company_id, branch_id, today
+    )
+
+    return keyset_page(query, Loan.due_date, Loan.id, after=after, per_page=limit)
+
+
+def arrears_totals(company_id, branch_id, today):
+    """Totals over the whole arrears list (not just the page)."""
+    penalty = func.coalesce(Loan.cumulative_interest, 0)
+
+    row = arrears_filter(
+        db.session.query(
+            func.count(Loan.id).label('count'),
+            func.coalesce(func.sum(Loan.amount_borrowed), 0).label('amount'),
+            func.coalesce(func.sum(Loan.remaining_balance), 0).label('original_balance'),
+            func.coalesce(func.sum(penalty), 0).label('penalty'),
+            func.coalesce(func.sum(Loan.remaining_balance + penalty), 0).label('total_arrears'),
+        ),
+        company_id, branch_id, today
+    ).one()
+
+    return row._asdict()
@@ -1,76 +1,522 @@
-from models import CashbookEntry, Loan, SavingAccount
+from models import (
+    CashbookEntry, CashbookDirtyMarker, Loan, LedgerEntry, OtherIncome, Expense,
+    BankTransfer, SavingAccount, SavingTransaction, User
+)
 from extensions import db
+from kpi_rollup import mark_kpi_day_stale
+from upserts import upsert_scope
 from decimal import Decimal
+from datetime import datetime
+from collections import namedtuple
+from flask_login import current_user
 
-def recalculate_balances(company_id, branch_id=None):
-    """Recalculate running balances for cashbook entries"""
-    entries = CashbookEntry.query.filter_by(company_id=company_id)
+# Ledger markers that do NOT move cash
+NON_CASH_LEDGER_PARTICULARS = ('loan application', 'loan approved')
+
+# Rows per flush when balances are rewritten without window functions
+BALANCE_BATCH_SIZE = 1000
+
+# The stored balance column runs per branch book: each branch's rows, plus one
+# book for rows without a branch. Company-wide views never read it; they
+# compute their running balance with window_balances instead.
+
+def _in_book(query, branch_id):
     if branch_id:
-        entries = entries.filter_by(branch_id=branch_id)
-
-    running_balance = Decimal('0.00')
-    for entry in entries.order_by(CashbookEntry.date.asc(), CashbookEntry.id.asc()):
-        debit = entry.debit or Decimal('0.00')
-        credit = entry.credit or Decimal('0.00')
-        running_balance += credit - debit
-        entry.balance = running_balance
-        db.session.add(entry)
-    db.session.commit()
+        return query.filter(CashbookEntry.branch_id == branch_id)
+    return query.filter(CashbookEntry.branch_id.is_(None))
 
-def ledger_to_cashbook(entry, created_by):
+def _opening_balance(company_id, branch_id=None, from_date=None):
+    """Stored balance of the book's last entry dated before from_date (0 if none)."""
+    if from_date is None:
+        return Decimal('0.00')
+
+    anchor = db.session.query(CashbookEntry.balance)\
+        .filter(CashbookEntry.company_id == company_id, CashbookEntry.date < from_date)
+    anchor = _in_book(anchor, branch_id)
+    anchor = anchor.order_by(CashbookEntry.date.desc(), CashbookEntry.id.desc()).first()
+
+    return anchor.balance if anchor and anchor.balance is not None else Decimal('0.00')
+
+def _recalculate_balances_window(company_id, branch_id, from_date, opening):
     """
-    Convert a LedgerEntry (loan or saving) into a CashbookEntry.
-    Automatically includes borrower name and correct debit/credit.
+    One set-based UPDATE: the running balance of the suffix is computed with
+    SUM() OVER (ORDER BY date, id) and only rows whose balance moved are written.
     """
-    if entry.loan_id:
-        # Loan entry
-        loan = entry.loan
-        borrower_name = loan.borrower_name if loan.borrower_name else "Unknown borrower"
-        company_id = loan.company_id
-        branch_id = loan.branch_id
-        created_by = loan.created_by or 1
+    filters = ["company_id = :company_id"]
+    params = {'company_id': company_id, 'opening': opening}
+    if branch_id:
+        filters.append("branch_id = :branch_id")
+        params['branch_id'] = branch_id
     else:
-        # Savings entry
-        saving = SavingAccount.query.filter_by(id=entry.saving_account_id).first() if hasattr(entry, 'saving_account_id') else None
-        borrower_name = saving.borrower.name if saving else "Unknown borrower"
-        company_id = saving.company_id if saving else None
-        branch_id = saving.branch_id if saving else None
-        created_by = 1  # fallback
-
-    # Determine debit/credit
-    particulars_lower = (entry.particulars or "").lower()
-    if particulars_lower.startswith("loan repayment") or particulars_lower.startswith("savings withdrawal"):
-        debit = Decimal(entry.payment or 0)
-        credit = Decimal('0.00')
+        filters.append("branch_id IS NULL")
+    if from_date is not None:
+        filters.append("date >= :from_date")
+        params['from_date'] = from_date
+
+    db.session.execute(db.text(f"""
+        UPDATE cashbook_entries AS c
+        SET balance = s.running_balance
+        FROM (
+            SELECT id,
+                   :opening + SUM(COALESCE(credit, 0) - COALESCE(debit, 0))
+                       OVER (ORDER BY date, id ROWS UNBOUNDED PRECEDING) AS running_balance
+            FROM cashbook_entries
+            WHERE {' AND '.join(filters)}
+        ) AS s
+        WHERE c.id = s.id
+          AND c.balance IS DISTINCT FROM s.running_balance
+    """), params)
+
+def _recalculate_balances_batched(company_id, branch_id, from_date, opening):
+    """
+    Portable fallback: walk the suffix in (date, id) pages of BALANCE_BATCH_SIZE
+    rows reading only the columns needed, and write each page's changed
+    balances in bulk before reading the next (no cursor stays open across writes).
+    """
+    suffix = db.session.query(
+        CashbookEntry.id, CashbookEntry.date, CashbookEntry.debit, CashbookEntry.credit, CashbookEntry.balance
+    ).filter(CashbookEntry.company_id == company_id)
+    suffix = _in_book(suffix, branch_id)
+    if from_date is not None:
+        suffix = suffix.filter(CashbookEntry.date >= from_date)
+    suffix = suffix.order_by(CashbookEntry.date.asc(), CashbookEntry.id.asc())
+
+    running_balance = opening
+    last = None
+    while True:
+        page = suffix
+        if last is not None:
+            page = page.filter(db.not_(_before(last.date, last.id + 1)))
+        rows = page.limit(BALANCE_BATCH_SIZE).all()
+        if not rows:
+            break
+
+        changed = []
+        for row in rows:
+            running_balance += (row.credit or Decimal('0.00')) - (row.debit or Decimal('0.00'))
+            if row.balance != running_balance:
+                changed.append({'id': row.id, 'balance': running_balance})
+        if changed:
+            db.session.execute(db.update(CashbookEntry), changed)
+        last = rows[-1]
+
+def _recalculate_book(company_id, branch_id, from_date):
+    opening = _opening_balance(company_id, branch_id, from_date)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        _recalculate_balances_window(company_id, branch_id, from_date, opening)
     else:
-        debit = Decimal('0.00')
-        credit = Decimal(entry.payment or 0)
+        _recalculate_balances_batched(company_id, branch_id, from_date, opening)
 
-    # Include borrower name in particulars
-    cb_particulars = f"{entry.particulars} by {borrower_name}" if borrower_name else entry.particulars
+    # Bulk statements bypass the identity map; drop stale loaded balances
+    db.session.expire_all()
 
-    # Check if CashbookEntry already exists to avoid duplicates
-    existing = CashbookEntry.query.filter_by(
-        date=entry.date,
-        particulars=cb_particulars,
-        company_id=company_id,
-        branch_id=branch_id
-    ).first()
-    if existing:
-        return existing  # Skip creating duplicate
+def recalculate_balances(company_id, branch_id=None, from_date=None):
+    """
+    Recalculate stored running balances of one branch book, or of every book
+    of the company without branch_id.
+    With from_date, only entries on/after that date are rewritten, starting
+    from the stored balance of the last entry before it. PostgreSQL does this
+    in a single window-function UPDATE; other databases use batched updates.
+    """
+    if branch_id:
+        books = [branch_id]
+    else:
+        books = [
+            book for (book,) in db.session.query(CashbookEntry.branch_id)
+            .filter(CashbookEntry.company_id == company_id).distinct()
+        ]
+
+    for book in books:
+        _recalculate_book(company_id, book, from_date)
+    db.session.commit()
 
-    cb_entry = CashbookEntry(
+# ---------------------------------------------------------------------------
+# Window-function read path
+#
+# Instead of trusting the stored balance column, the running balance of a
+# page is computed in SQL: an opening-balance aggregate up to the first row
+# of the page plus SUM(credit - debit) OVER (ORDER BY date, id) across the
+# page. Nothing is written on read.
+# ---------------------------------------------------------------------------
+
+CashbookLine = namedtuple('CashbookLine', 'id date particulars debit credit balance')
+
+def _scoped_entries(columns, company_id, branch_id=None):
+    query = db.session.query(*columns).filter(CashbookEntry.company_id == company_id)
+    if branch_id:
+        query = query.filter(CashbookEntry.branch_id == branch_id)
+    return query
+
+def _before(date, entry_id):
+    """(date, id) < (date, entry_id), spelled out for every backend."""
+    return db.or_(
+        CashbookEntry.date < date,
+        db.and_(CashbookEntry.date == date, CashbookEntry.id < entry_id)
+    )
+
+def opening_balance_before(company_id, branch_id, date, entry_id):
+    """Sum of credit - debit over every entry ordered before (date, entry_id)."""
+    total = _scoped_entries(
+        [db.func.coalesce(db.func.sum(
+            db.func.coalesce(CashbookEntry.credit, 0) - db.func.coalesce(CashbookEntry.debit, 0)
+        ), 0)],
+        company_id, branch_id
+    ).filter(_before(date, entry_id)).scalar()
+
+    return _money(total)
+
+def window_balances(entries, company_id, branch_id=None):
+    """
+    Running balances for a page of entries, keyed by entry id.
+    Only the slice of the book between the oldest and newest entry of the
+    page is windowed, so the cost follows the page and not the book.
+    """
+    if not entries:
+        return {}
+
+    first = min(entries, key=lambda e: (e.date, e.id))
+    last = max(entries, key=lambda e: (e.date, e.id))
+    opening = opening_balance_before(company_id, branch_id, first.date, first.id)
+
+    running = db.func.sum(
+        db.func.coalesce(CashbookEntry.credit, 0) - db.func.coalesce(CashbookEntry.debit, 0)
+    ).over(order_by=(CashbookEntry.date, CashbookEntry.id))
+
+    rows = _scoped_entries([CashbookEntry.id, running.label('running')], company_id, branch_id)\
+        .filter(db.not_(_before(first.date, first.id)), _before(last.date, last.id + 1))
+
+    return {row.id: opening + _money(row.running) for row in rows}
+
+def cashbook_lines(entries, company_id, branch_id=None):
+    """Read-only CashbookLine rows carrying the SQL-computed running balance."""
+    balances = window_balances(entries, company_id, branch_id)
+    return [
+        CashbookLine(e.id, e.date, e.particulars, e.debit, e.credit, balances.get(e.id, Decimal('0.00')))
+        for e in entries
+    ]
+
+# ---------------------------------------------------------------------------
+# Incremental cashbook engine
+#
+# Every cashbook row is derived from one source record and carries its
+# (source_type, source_id). Writes upsert only the row of the changed source
+# and mark the company/branch dirty from the earliest affected date; balances
+# are then recalculated from that date on the next read.
+# ---------------------------------------------------------------------------
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+def _acting_user_id():
+    try:
+        if current_user.is_authenticated:
+            return current_user.id
+    except AttributeError:
+        pass  # No request (CLI, scripts)
+    return None
+
+def cashbook_row_for_ledger(entry, created_by=None):
+    loan = entry.loan
+    particulars = (entry.particulars or '').lower().strip()
+    if not loan or particulars in NON_CASH_LEDGER_PARTICULARS:
+        return None
+
+    debit = Decimal('0.00')
+    credit = Decimal('0.00')
+    borrower_name = loan.borrower_name or 'Unknown'
+
+    if 'repayment' in particulars:
+        particulars = f"Loan Repayment by {borrower_name}"
+        credit = entry.payment
+    elif 'disbursed' in particulars:
+        particulars = f"Loan Disbursed to {borrower_name}"
+        debit = entry.principal
+
+    return dict(
         date=entry.date,
-        particulars=cb_particulars,
+        particulars=particulars,
         debit=debit,
         credit=credit,
-        balance=Decimal('0.00'),  # will recalc later
-        company_id=company_id,
-        branch_id=branch_id,
+        company_id=loan.company_id,
+        branch_id=loan.branch_id,
+        created_by=loan.created_by or created_by
+    )
+
+def cashbook_row_for_processing_fee(loan, created_by=None):
+    if not loan.processing_fee or loan.processing_fee <= 0:
+        return None
+    return dict(
+        date=loan.date,
+        particulars=f"Processing fee received from {loan.borrower_name}",
+        debit=Decimal('0.00'),
+        credit=loan.processing_fee,
+        company_id=loan.company_id,
+        branch_id=loan.branch_id,
+        created_by=loan.created_by or created_by
+    )
+
+def cashbook_row_for_other_income(income, created_by=None):
+    if not income.is_active:
+        return None
+    return dict(
+        date=income.income_date,
+        particulars=f"Other Income: {income.description}",
+        debit=Decimal('0.00'),
+        credit=income.amount,
+        company_id=income.company_id,
+        branch_id=income.branch_id,
+        created_by=income.created_by_id
+    )
+
+def cashbook_row_for_expense(expense, created_by=None):
+    return dict(
+        date=expense.date,
+        particulars=f"Expense: {expense.description}",
+        debit=expense.amount,
+        credit=Decimal('0.00'),
+        company_id=expense.company_id,
+        branch_id=expense.branch_id,
+        created_by=expense.created_by_id
+    )
+
+def cashbook_row_for_bank_transfer(bt, created_by=None):
+    if not bt.is_active:
+        return None
+    return dict(
+        date=bt.transfer_date,
+        particulars=f"Bank {(bt.transfer_type or '').capitalize()} - Ref: {bt.reference or 'N/A'}",
+        debit=bt.amount if bt.transfer_type == 'deposit' else Decimal('0.00'),
+        credit=bt.amount if bt.transfer_type == 'withdrawal' else Decimal('0.00'),
+        company_id=bt.company_id,
+        branch_id=bt.branch_id,
+        created_by=bt.created_by_id
+    )
+
+def cashbook_row_for_saving_transaction(tx, created_by=None):
+    account = tx.account
+    if not account:
+        return None
+    return dict(
+        date=tx.date,
+        particulars=f"Savings {tx.transaction_type} by {account.borrower.name}",
+        debit=tx.amount if tx.transaction_type == 'withdrawal' else Decimal('0.00'),
+        credit=tx.amount if tx.transaction_type == 'deposit' else Decimal('0.00'),
+        company_id=account.company_id,
+        branch_id=account.branch_id,
         created_by=created_by
     )
 
-    db.session.add(cb_entry)
+# source_type -> (model, row builder)
+CASHBOOK_SOURCES = {
+    'ledger': (LedgerEntry, cashbook_row_for_ledger),
+    'processing_fee': (Loan, cashbook_row_for_processing_fee),
+    'other_income': (OtherIncome, cashbook_row_for_other_income),
+    'expense': (Expense, cashbook_row_for_expense),
+    'bank_transfer': (BankTransfer, cashbook_row_for_bank_transfer),
+    'saving_transaction': (SavingTransaction, cashbook_row_for_saving_transaction),
+}
+
+def build_cashbook_row(source_type, source, created_by=None):
+    """Return the normalized cashbook row for a source record, or None if it has no cash effect."""
+    _, builder = CASHBOOK_SOURCES[source_type]
+    row = builder(source, created_by=created_by)
+    if row is None:
+        return None
+    row['date'] = _as_date(row['date'])
+    row['debit'] = _money(row['debit'])
+    row['credit'] = _money(row['credit'])
+    return row
+
+def mark_cashbook_dirty(company_id, branch_id, from_date):
+    """Record that balances of a company/branch are stale from from_date onwards."""
+    if company_id is None or from_date is None:
+        return
+    from_date = _as_date(from_date)
+
+    # The same day's cash totals in the KPI rollups are stale too
+    mark_kpi_day_stale(company_id, branch_id, from_date)
+
+    # One statement, so concurrent writers cannot both insert; the earlier date wins
+    markers = CashbookDirtyMarker.__table__
+    now = datetime.utcnow()
+    upsert_scope(
+        markers,
+        {'company_id': company_id, 'branch_id': branch_id, 'dirty_from': from_date, 'updated_at': now},
+        keys=(),
+        set_=lambda excluded: {
+            'dirty_from': db.case(
+                (excluded.dirty_from < markers.c.dirty_from, excluded.dirty_from),
+                else_=markers.c.dirty_from
+            ),
+            'updated_at': now,
+        },
+    )
+
+def sync_cashbook_source(source_type, source, created_by=None):
+    """
+    Upsert the cashbook row for one source record. Unchanged rows are not
+    written; changed, new or removed rows mark their scope dirty.
+    Caller commits.
+    """
+    existing = CashbookEntry.query.filter_by(source_type=source_type, source_id=source.id).first()
+    row = build_cashbook_row(source_type, source, created_by=created_by or _acting_user_id())
+
+    if row is None:
+        if existing:
+            mark_cashbook_dirty(existing.company_id, existing.branch_id, existing.date)
+            db.session.delete(existing)
+        return None
+
+    if existing is None:
+        if row['created_by'] is None:
+            return None  # No user to attribute the row to; `flask cashbook-sync` inserts it
+        cb_entry = CashbookEntry(source_type=source_type, source_id=source.id, balance=Decimal('0.00'), **row)
+        db.session.add(cb_entry)
+        mark_cashbook_dirty(row['company_id'], row['branch_id'], row['date'])
+        return cb_entry
+
+    changed = [
+        field for field in ('date', 'particulars', 'debit', 'credit', 'company_id', 'branch_id')
+        if getattr(existing, field) != row[field]
+    ]
+    if not changed:
+        return existing
+
+    mark_cashbook_dirty(existing.company_id, existing.branch_id, existing.date)
+    for field in changed:
+        setattr(existing, field, row[field])
+    mark_cashbook_dirty(existing.company_id, existing.branch_id, existing.date)
+    return existing
+
+def remove_cashbook_source(source_type, source_id):
+    """Delete the cashbook row of a source that no longer exists. Caller commits."""
+    existing = CashbookEntry.query.filter_by(source_type=source_type, source_id=source_id).first()
+    if existing:
+        mark_cashbook_dirty(existing.company_id, existing.branch_id, existing.date)
+        db.session.delete(existing)
+
+def sync_cashbook_loan(loan, created_by=None):
+    """Re-sync the processing fee and every ledger row of a loan (e.g. after the loan was edited)."""
+    sync_cashbook_source('processing_fee', loan, created_by=created_by)
+    for entry in LedgerEntry.query.filter_by(loan_id=loan.id).all():
+        sync_cashbook_source('ledger', entry, created_by=created_by)
+
+def remove_cashbook_loan(loan):
+    """Drop the processing fee and ledger rows of a loan that is being deleted."""
+    remove_cashbook_source('processing_fee', loan.id)
+    for (entry_id,) in db.session.query(LedgerEntry.id).filter_by(loan_id=loan.id):
+        remove_cashbook_source('ledger', entry_id)
+
+def flush_cashbook_balances(company_id, branch_id=None):
+    """Recalculate balances for every dirty scope of a company (or one branch) from its dirty date."""
+    # populate_existing: mark_cashbook_dirty writes markers past the identity map
+    markers = CashbookDirtyMarker.query.filter_by(company_id=company_id).populate_existing()
+    if branch_id:
+        markers = markers.filter_by(branch_id=branch_id)
+
+    for marker in markers.all():
+        # A marker names one book; branch None is the book of unbranched rows
+        scope_branch_id, dirty_from = marker.branch_id, marker.dirty_from
+        db.session.delete(marker)
+        _recalculate_book(company_id, scope_branch_id, dirty_from)
+        db.session.commit()
+
+def sync_cashbook(company_id, branch_id=None, balances=True):
+    """
+    Bring the cashbook of a company/branch up to date before it is read.
+    Scopes still holding rows without a source key (written before the
+    incremental engine) are rebuilt once; afterwards only dirty balances
+    are recalculated (skipped with balances=False, for the window read path).
+    """
+    legacy = CashbookEntry.query.filter_by(company_id=company_id).filter(CashbookEntry.source_type.is_(None))
+    if branch_id:
+        legacy = legacy.filter_by(branch_id=branch_id)
+
+    if legacy.first() is not None:
+        from routes.cashbook_routes import refresh_cashbook
+        refresh_cashbook(company_id, branch_id)
+        return
+
+    if balances:
+        flush_cashbook_balances(company_id, branch_id)
+
+def cashbook_system_user_id(company_id):
+    """User that rows written outside a request are attributed to: the company's first user, else a superuser."""
+    user = User.query.filter_by(company_id=company_id).order_by(User.id).first() \
+        or User.query.filter_by(is_superuser=True).order_by(User.id).first()
+    return user.id if user else None
+
+def reconcile_cashbook(company_id, branch_id=None, created_by=None):
+    """
+    Catch-up pass for sources written outside the routes (imports, scripts):
+    inserts rows for sources with no cashbook row, re-syncs rows whose amount
+    or date drifted and removes rows whose source is gone. Rows whose source
+    names no user (saving transactions) are attributed to created_by, by
+    default the company's system user. Returns the number of sources touched.
+    """
+    created_by = created_by or cashbook_system_user_id(company_id)
+    touched = 0
+    scoped_rows = CashbookEntry.query.filter_by(company_id=company_id)
+    if branch_id:
+        scoped_rows = scoped_rows.filter_by(branch_id=branch_id)
+
+    for source_type, (model, _) in CASHBOOK_SOURCES.items():
+        synced = {row.source_id: row for row in scoped_rows.filter_by(source_type=source_type)}
+
+        for source in scoped_cashbook_sources(source_type, company_id, branch_id):
+            existing = synced.pop(source.id, None)
+            row = build_cashbook_row(source_type, source, created_by=created_by)
+            if existing is None and row is not None and row['created_by'] is None:
+                continue  # Cannot be inserted without a user; not counted as touched
+            drifted = (existing is None) != (row is None) or (
+                existing is not None and any(getattr(existing, f) != row[f] for f in ('date', 'debit', 'credit'))
+            )
+            if drifted:
+                sync_cashbook_source(source_type, source, created_by=created_by)
+                touched += 1
+
+        # Rows whose source was deleted or moved out of this scope
+        for stale_id in synced:
+            source = db.session.get(model, stale_id)
+            if source is None:
+                remove_cashbook_source(source_type, stale_id)
+            else:
+                sync_cashbook_source(source_type, source, created_by=created_by)
+            touched += 1
+
+    db.session.commit()
+    flush_cashbook_balances(company_id, branch_id)
+    return touched
+
+def scoped_cashbook_sources(source_type, company_id, branch_id=None):
+    """Source records of one type belonging to a company (and branch), streamed in batches."""
+    model, _ = CASHBOOK_SOURCES[source_type]
+    if source_type == 'ledger':
+        query = LedgerEntry.query.join(Loan, LedgerEntry.loan_id == Loan.id).filter(Loan.company_id == company_id)
+        if branch_id:
+            query = query.filter(Loan.branch_id == branch_id)
+    elif source_type == 'saving_transaction':
+        query = SavingTransaction.query.join(SavingAccount, SavingTransaction.account_id == SavingAccount.id)\
+            .filter(SavingAccount.company_id == company_id)
+        if branch_id:
+            query = query.filter(SavingAccount.branch_id == branch_id)
+    else:
+        query = model.query.filter(model.company_id == company_id)
+        if branch_id:
+            query = query.filter(model.branch_id == branch_id)
+    return query.yield_per(500)
+
+def ledger_to_cashbook(entry, created_by):
+    """
+    Convert a loan LedgerEntry into its CashbookEntry.
+    The row is keyed by ('ledger', entry.id), so repeated calls update the
+    same row instead of matching on date/particulars text.
+    """
+    cb_entry = sync_cashbook_source('ledger', entry, created_by=created_by)
     db.session.commit()
 
     return cb_entry
@@ -19,6 +19,29 @@ class Config:
 
     WTF_CSRF_ENABLED = True
 
+    # Cashbook running balance on read: 'stored' uses CashbookEntry.balance
+    # (kept per branch; company-wide views always use the window path),
+    # 'window' computes it in SQL per page and never writes on read
+    CASHBOOK_BALANCE_MODE = os.environ.get("CASHBOOK_BALANCE_MODE", "stored")
+
+    # Dashboard JSON cache: in-process LRU unless a shared Redis URL is set
+    DASHBOARD_CACHE_URL = os.environ.get("DASHBOARD_CACHE_URL")
+    DASHBOARD_CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL", 60))
+    DASHBOARD_CACHE_SIZE = 1024
+
+    # Trust a signed user snapshot in the session instead of loading the user
+    # on every request (needs the shared cache URL with several workers)
+    SESSION_PRINCIPAL_CACHE = os.environ.get("SESSION_PRINCIPAL_CACHE", "").lower() in ("1", "true", "yes")
+    SESSION_PRINCIPAL_TTL = int(os.environ.get("SESSION_PRINCIPAL_TTL", 300))
+
+    # PDF layout runs in this many separate processes (0 = in the web worker)
+    PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", 0))
+    PDF_RENDER_TIMEOUT = int(os.environ.get("PDF_RENDER_TIMEOUT", 300))
+
+    # Finished background exports (flask export-worker) and how long to keep them
+    EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join(basedir, "instance", "exports"))
+    EXPORT_RETENTION_HOURS = int(os.environ.get("EXPORT_RETENTION_HOURS", 24))
+
     UPLOAD_FOLDER = os.path.join('static', 'uploads', 'logos')
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5MB
@@ -0,0 +1,42 @@
+"""Shared fixtures: a Flask app bound to a throwaway SQLite database with every table created."""
+from contextlib import contextmanager
+
+import pytest
+
+
+@contextmanager
+def _sqlite_app(uri):
+    # Imported here so suites without Flask installed still collect
+    from flask import Flask
+    from extensions import db
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=uri, SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    with app.app_context():
+        import models  # noqa: F401  registers the tables
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def app():
+    """In-memory database, fresh for each test."""
+    with _sqlite_app("sqlite://") as app:
+        yield app
+
+
+@pytest.fixture(scope="module")
+def module_app():
+    """In-memory database shared by the tests of one module."""
+    with _sqlite_app("sqlite://") as app:
+        yield app
+
+
+@pytest.fixture()
+def file_app(tmp_path):
+    """File database, for code that holds several connections at once."""
+    with _sqlite_app(f"sqlite:///{tmp_path / 'test.db'}") as app:
+        yield app
@@ -0,0 +1,165 @@
+"""
+Short-TTL cache for the polled dashboard JSON endpoints.
+
+Entries are keyed by (company_id, branch_id, endpoint, day) plus a per-scope
+version number; writes bump the version of their scope once their
+transaction commits, which orphans every cached entry of that scope at
+once (bumping before the commit would let a concurrent read re-cache the
+old figures). The default backend is an in-process
+LRU; set DASHBOARD_CACHE_URL (redis://...) to share the cache between
+workers.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+
+from flask import current_app, jsonify, session
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+
+DEFAULT_TTL = 60
+
+# Session.info key holding the scopes to invalidate when the transaction commits
+_PENDING_SCOPES = 'dashboard_cache_scopes'
+
+
+class LRUCacheBackend:
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._counters = {}  # scope versions, never evicted
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            expires_at = time.monotonic() + ttl if ttl else None
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCacheBackend:
+    """Shared backend; values are stored as JSON."""
+
+    def __init__(self, url):
+        import redis  # optional dependency, only needed for a shared cache
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, json.dumps(value), ex=ttl)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        url = current_app.config.get('DASHBOARD_CACHE_URL')
+        _backend = RedisCacheBackend(url) if url else LRUCacheBackend(
+            current_app.config.get('DASHBOARD_CACHE_SIZE', 1024)
+        )
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the backend (any object with get/set/incr)."""
+    global _backend
+    _backend = backend
+
+
+def _version_key(company_id, branch_id):
+    return f"dashboard:v:{company_id}:{branch_id or 'all'}"
+
+
+def _scope_version(backend, company_id, branch_id):
+    return backend.get(_version_key(company_id, branch_id)) or 0
+
+
+def invalidate_dashboard_cache(company_id, branch_id=None):
+    """Drop cached dashboard JSON for a branch and for its company-wide view."""
+    if company_id is None:
+        return
+    backend = get_backend()
+    backend.incr(_version_key(company_id, branch_id))
+    if branch_id:
+        backend.incr(_version_key(company_id, None))
+
+
+def invalidate_dashboard_cache_on_commit(company_id, branch_id=None):
+    """Invalidate a scope after the current transaction commits; a rollback forgets it."""
+    if company_id is None:
+        return
+    db.session.info.setdefault(_PENDING_SCOPES, set()).add((company_id, branch_id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_scopes(session):
+    for company_id, branch_id in session.info.pop(_PENDING_SCOPES, ()):
+        invalidate_dashboard_cache(company_id, branch_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back_scopes(session, previous_transaction):
+    # A savepoint rollback leaves the outer transaction's writes pending
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_SCOPES, None)
+
+
+def cached_dashboard_json(endpoint):
+    """Cache a view's JSON payload per (company, active branch, endpoint, day)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            backend = get_backend()
+            company_id = current_user.company_id
+            branch_id = session.get('active_branch_id')
+
+            version = _scope_version(backend, company_id, branch_id)
+            if branch_id:
+                version = f"{version}.{_scope_version(backend, company_id, None)}"
+            key = f"dashboard:{company_id}:{branch_id or 'all'}:{endpoint}:{date.today().isoformat()}:{version}"
+
+            payload = backend.get(key)
+            if payload is None:
+                payload = view(*args, **kwargs)
+                backend.set(key, payload, current_app.config.get('DASHBOARD_CACHE_TTL', DEFAULT_TTL))
+
+            return jsonify(payload)
+        return wrapper
+    return decorator
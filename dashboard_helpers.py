@@ -0,0 +1,133 @@
+"""
+Dashboard KPIs computed in the database.
+
+Each helper returns the figures for one company (and optionally one branch)
+from a single grouped query using conditional SUM/COUNT per period, instead
+of loading every loan and repayment into Python.
+"""
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, case
+
+from extensions import db
+from models import Loan, LoanRepayment
+from kpi_rollup import monthly_kpi_series
+
+LOAN_METRICS = ('disbursed', 'loans_paid', 'loans_remaining', 'loans_interest')
+
+
+def period_bounds(day=None):
+    """Half-open [start, end) datetime ranges for the day, month and year of `day`."""
+    day = day or date.today()
+    day_start = datetime.combine(day, datetime.min.time())
+    month_start = day_start.replace(day=1)
+    year_start = month_start.replace(month=1)
+
+    if month_start.month == 12:
+        next_month = month_start.replace(year=month_start.year + 1, month=1)
+    else:
+        next_month = month_start.replace(month=month_start.month + 1)
+
+    return {
+        'today': (day_start, day_start + timedelta(days=1)),
+        'month': (month_start, next_month),
+        'year': (year_start, year_start.replace(year=year_start.year + 1)),
+    }
+
+
+def _within(column, bounds):
+    start, end = bounds
+    return db.and_(column >= start, column < end)
+
+
+def _sum_if(condition, value):
+    return func.coalesce(func.sum(case((condition, value), else_=0)), 0)
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _distinct_if(condition, value):
+    return func.count(func.distinct(case((condition, value))))
+
+
+def _scope(query, model, company_id, branch_id=None):
+    query = query.filter(model.company_id == company_id)
+    if branch_id:
+        query = query.filter(model.branch_id == branch_id)
+    return query
+
+
+def loan_kpis(company_id, branch_id=None, day=None):
+    """Borrower, disbursement, balance and overdue figures in one row."""
+    periods = period_bounds(day)
+    outstanding = Loan.remaining_balance > 0
+
+    row = _scope(db.session.query(
+        func.count(Loan.id).label('total_loans'),
+        func.max(Loan.date).label('last_loan_date'),
+
+        # --- Borrowers ---
+        _distinct_if(_within(Loan.date, periods['today']), Loan.borrower_name).label('borrowers_today'),
+        _distinct_if(_within(Loan.date, periods['month']), Loan.borrower_name).label('borrowers_month'),
+        _distinct_if(_within(Loan.date, periods['year']), Loan.borrower_name).label('borrowers_year'),
+        func.count(func.distinct(Loan.borrower_name)).label('total_borrowers'),
+
+        # --- Disbursed ---
+        _sum_if(_within(Loan.date, periods['today']), Loan.amount_borrowed).label('disbursed_today'),
+        _sum_if(_within(Loan.date, periods['month']), Loan.amount_borrowed).label('disbursed_month'),
+        _sum_if(_within(Loan.date, periods['year']), Loan.amount_borrowed).label('disbursed_year'),
+        func.coalesce(func.sum(Loan.amount_borrowed), 0).label('total_disbursed'),
+
+        # --- Balances ---
+        func.coalesce(func.sum(Loan.amount_paid), 0).label('total_paid'),
+        func.coalesce(func.sum(Loan.remaining_balance), 0).label('total_remaining'),
+        func.coalesce(func.sum(Loan.amount_borrowed * 0.2), 0).label('total_interest'),
+
+        # --- Overdue ---
+        _count_if(db.and_(outstanding, _within(Loan.due_date, periods['today']))).label('overdue_today'),
+        _count_if(db.and_(outstanding, _within(Loan.due_date, periods['month']))).label('overdue_month'),
+        _count_if(db.and_(outstanding, _within(Loan.due_date, periods['year']))).label('overdue_year'),
+        _count_if(outstanding).label('total_overdue'),
+    ), Loan, company_id, branch_id).one()
+
+    return row._asdict()
+
+
+def repayment_kpis(company_id, branch_id=None, day=None):
+    """Collections for today, this month, this year and all time in one row."""
+    periods = period_bounds(day)
+
+    row = _scope(
+        db.session.query(
+            _sum_if(_within(LoanRepayment.date_paid, periods['today']), LoanRepayment.amount_paid).label('repaid_today'),
+            _sum_if(_within(LoanRepayment.date_paid, periods['month']), LoanRepayment.amount_paid).label('collections_month'),
+            _sum_if(_within(LoanRepayment.date_paid, periods['year']), LoanRepayment.amount_paid).label('collections_year'),
+            func.coalesce(func.sum(LoanRepayment.amount_paid), 0).label('total_repaid'),
+        ).join(Loan, LoanRepayment.loan_id == Loan.id),
+        Loan, company_id, branch_id
+    ).one()
+
+    return row._asdict()
+
+
+def monthly_loan_series(company_id, branch_id=None):
+    """Chart series per loan month: disbursed, paid, remaining and interest (from the daily rollups)."""
+    rows = [
+        r for r in monthly_kpi_series(company_id, branch_id, metrics=LOAN_METRICS)
+        if any(getattr(r, name) for name in LOAN_METRICS)
+    ]
+
+    return {
+        'months': [datetime(int(r.year), int(r.month), 1).strftime('%b %Y') for r in rows],
+        'loans_disbursed': [float(r.disbursed) for r in rows],
+        'loans_repaid': [float(r.loans_paid) for r in rows],
+        'remaining_balances': [float(r.loans_remaining) for r in rows],
+        'interest_earned': [float(r.loans_interest) for r in rows],
+    }
+
+
+def as_float(value):
+    return float(value if value is not None else Decimal('0.00'))
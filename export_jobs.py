@@ -0,0 +1,436 @@
+"""
+Background report exports.
+
+Export views only enqueue an ExportJob row; `flask export-worker` claims
+queued jobs (SKIP LOCKED on PostgreSQL, a conditional UPDATE everywhere),
+builds the file into EXPORT_DIR while reporting progress, and marks the job
+done or failed. The browser polls the job and downloads the file straight
+from disk once it is ready. Finished files are purged after
+EXPORT_RETENTION_HOURS.
+
+Rows are streamed with yield_per and written as they arrive: XLSX through
+xlsxwriter's constant_memory mode, CSV (served directly, no job) as a
+chunked response, so memory stays flat however large the export is.
+"""
+import csv
+import io
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from flask import current_app, Response, stream_with_context
+from sqlalchemy.orm import joinedload
+
+from extensions import db
+from models import ExportJob, Loan, Borrower, LoanRepayment, CashbookEntry
+from pdf_service import render_pdf_string, render_pdf_template
+from utils.period_filter import filter_by_period, range_filter
+
+# file_format -> extension
+FORMATS = {'excel': 'xlsx', 'pdf': 'pdf'}
+
+# Jobs stuck in 'running' this long belong to a dead worker
+STALE_AFTER = timedelta(hours=1)
+
+# How often a running worker requeues stale jobs and purges old files
+MAINTENANCE_INTERVAL = timedelta(minutes=5)
+
+# Stream rows from the database in chunks of this size
+FETCH_SIZE = 1000
+
+
+# ---------------------------------------------------------------------------
+# Queue
+# ---------------------------------------------------------------------------
+
+def enqueue_export(kind, file_format, user, branch_id=None, params=None):
+    """Queue an export for `user`. Returns the committed job."""
+    if file_format not in EXPORT_FORMATS.get(kind, ()):
+        raise ValueError(f"Unsupported export: {kind}/{file_format}")
+
+    job = ExportJob(
+        company_id=None if user.is_superuser else user.company_id,
+        branch_id=branch_id,
+        user_id=user.id,
+        kind=kind,
+        file_format=file_format,
+        params=params or {},
+        status='queued',
+        progress=0
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def claim_next_job():
+    """Move the oldest queued job to 'running' and return it, or None."""
+    while True:
+        query = ExportJob.query.filter_by(status='queued').order_by(ExportJob.id)
+        if db.session.get_bind().dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+        job = query.first()
+        if job is None:
+            db.session.rollback()
+            return None
+
+        # Conditional update: another worker may have taken it meanwhile
+        claimed = ExportJob.query.filter_by(id=job.id, status='queued').update(
+            {'status': 'running', 'started_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(ExportJob, job.id, populate_existing=True)
+
+
+def _set_progress(job_id, done, total):
+    # Own connection: the job's session may be mid-way through a streamed query
+    percent = min(99, int(done * 100 / total)) if total else 99
+    with db.engine.begin() as conn:
+        conn.execute(db.update(ExportJob).where(ExportJob.id == job_id).values(progress=percent))
+
+
+def progress_reporter(job_id, total, every=FETCH_SIZE):
+    """Callable(done) that records progress every `every` rows."""
+    def report(done):
+        if done % every == 0 or done == total:
+            _set_progress(job_id, done, total)
+    return report
+
+
+def run_job(job):
+    """Build one claimed job's file. Failures are recorded on the job, not raised."""
+    export_dir = current_app.config['EXPORT_DIR']
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, f"{job.id}_{uuid.uuid4().hex}.{FORMATS[job.file_format]}")
+    job_id = job.id
+
+    try:
+        filename = EXPORT_BUILDERS[job.kind](job, path)
+    except Exception as exc:
+        db.session.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        job = db.session.get(ExportJob, job_id)
+        job.status = 'failed'
+        job.error = str(exc)[:2000]
+        current_app.logger.exception("Export job %s failed", job_id)
+    else:
+        job = db.session.get(ExportJob, job_id)
+        job.status = 'done'
+        job.progress = 100
+        job.file_path = path
+        job.filename = filename
+
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def requeue_stale_jobs():
+    """Put jobs of crashed workers back in the queue."""
+    count = ExportJob.query.filter(
+        ExportJob.status == 'running',
+        ExportJob.started_at < datetime.utcnow() - STALE_AFTER
+    ).update({'status': 'queued', 'progress': 0}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def purge_old_exports():
+    """Delete finished jobs (and their files) older than EXPORT_RETENTION_HOURS."""
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config.get('EXPORT_RETENTION_HOURS', 24))
+    old = ExportJob.query.filter(
+        ExportJob.status.in_(('done', 'failed')),
+        ExportJob.finished_at < cutoff
+    ).all()
+    for job in old:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        db.session.delete(job)
+    db.session.commit()
+    return len(old)
+
+
+def work(poll_interval=2.0, once=False):
+    """Worker loop. With once, drain the queue and return the number of jobs run."""
+    processed = 0
+    maintenance_due = 0.0
+    while True:
+        # Housekeeping on start and then every MAINTENANCE_INTERVAL, busy or idle
+        if time.monotonic() >= maintenance_due:
+            requeue_stale_jobs()
+            purge_old_exports()
+            maintenance_due = time.monotonic() + MAINTENANCE_INTERVAL.total_seconds()
+
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+
+
+# ---------------------------------------------------------------------------
+# Builders: (job, path) -> download filename
+# ---------------------------------------------------------------------------
+
+def _write_pdf(path, pdf):
+    with open(path, 'wb') as f:
+        f.write(pdf)
+
+
+def _xlsx_cell(value):
+    return float(value) if isinstance(value, Decimal) else value
+
+
+def write_xlsx(path, sheet_name, columns, rows, report=None):
+    """Write rows straight to disk; constant_memory flushes each row as it goes."""
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    sheet = workbook.add_worksheet(sheet_name)
+    sheet.write_row(0, 0, columns)
+    for done, row in enumerate(rows, start=1):
+        sheet.write_row(done, 0, [_xlsx_cell(value) for value in row])
+        if report:
+            report(done)
+    workbook.close()
+
+
+def csv_response(filename, columns, rows, chunk_size=64 * 1024):
+    """Chunked text/csv response; rows are pulled from the database as it is sent."""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def stream_rows(query, job=None):
+    """Iterate `query` FETCH_SIZE rows at a time."""
+    if job is not None and db.session.get_bind().dialect.name != 'postgresql':
+        # SQLite: an open read would block the worker's progress writes
+        return iter(query.all())
+    return iter(query.yield_per(FETCH_SIZE))
+
+
+def _with_totals(rows, label_index, sum_indexes):
+    """Pass rows through, then yield a TOTAL row summing the given columns."""
+    totals = {index: 0 for index in sum_indexes}
+    width = max(sum_indexes) + 1
+    for row in rows:
+        width = len(row)
+        for index in sum_indexes:
+            totals[index] += row[index] or 0
+        yield row
+    total_row = [''] * width
+    total_row[label_index] = 'TOTAL'
+    for index, value in totals.items():
+        total_row[index] = value
+    yield tuple(total_row)
+
+
+def _progress(query, job):
+    return progress_reporter(job.id, query.order_by(None).count())
+
+
+# --- Loans ---
+
+LOAN_COLUMNS = (
+    'Loan ID', 'Borrower', 'Date', 'Amount Borrowed', 'Processing Fee',
+    'Total Due', 'Amount Paid', 'Remaining Balance', 'Status',
+)
+LOAN_TOTAL_COLUMNS = (3, 4, 5, 6, 7)
+
+
+def loans_export_query(company_id, params):
+    """Column-only query behind the loans export (company_id None = all companies)."""
+    query = db.session.query(
+        Loan.loan_id, Loan.borrower_name, Loan.date, Loan.amount_borrowed, Loan.processing_fee,
+        Loan.total_due, Loan.amount_paid, Loan.remaining_balance, Loan.status
+    ).order_by(Loan.date.desc())
+    if company_id is not None:
+        query = query.filter(Loan.company_id == company_id)
+
+    search = params.get('search')
+    if search:
+        query = query.filter((Loan.loan_id.ilike(f"%{search}%")) | (Loan.borrower_name.ilike(f"%{search}%")))
+    query = filter_by_period(query, Loan.date, month=params.get('month'), year=params.get('year'))
+    return query
+
+
+def loans_export_rows(rows, totals=True):
+    rows = ((row.loan_id, row.borrower_name, row.date.strftime('%Y-%m-%d'), *row[3:]) for row in rows)
+    return _with_totals(rows, 0, LOAN_TOTAL_COLUMNS) if totals else rows
+
+
+LOANS_PDF = """
+    <h2>Loan Export Report</h2>
+    <table border="1" cellspacing="0" cellpadding="5">
+        <tr>
+            {% for column in columns %}
+                <th>{{ column }}</th>
+            {% endfor %}
+        </tr>
+        {% for row in rows %}
+            <tr>
+                {% for cell in row %}
+                    <td>{{ cell }}</td>
+                {% endfor %}
+            </tr>
+        {% endfor %}
+    </table>
+"""
+
+
+def build_loans_export(job, path):
+    query = loans_export_query(job.company_id, job.params or {})
+    report = _progress(query, job)
+    rows = loans_export_rows(stream_rows(query, job))
+
+    if job.file_format == 'excel':
+        write_xlsx(path, 'Loans', LOAN_COLUMNS, rows, report)
+        return 'loans.xlsx'
+
+    # A PDF is laid out as a whole, so its rows are collected
+    _write_pdf(path, render_pdf_string(LOANS_PDF, columns=LOAN_COLUMNS, rows=list(rows)))
+    return 'loans.pdf'
+
+
+# --- Cashbook ---
+
+CASHBOOK_COLUMNS = ('Date', 'Particulars', 'Debit', 'Credit', 'Balance')
+
+
+def cashbook_export_query(company_id, branch_id=None):
+    """Cashbook rows with running balances (company_id None = all companies, book by book)."""
+    from cashbook_helpers import flush_cashbook_balances
+
+    # Stored balances run per branch, so only a single branch's book can use them
+    stored = current_app.config.get('CASHBOOK_BALANCE_MODE') != 'window' and company_id is not None and branch_id
+    if stored:
+        flush_cashbook_balances(company_id, branch_id)
+        balance = CashbookEntry.balance
+    else:
+        # One pass over the book with the running balance computed in SQL
+        balance = db.func.sum(
+            db.func.coalesce(CashbookEntry.credit, 0) - db.func.coalesce(CashbookEntry.debit, 0)
+        ).over(partition_by=CashbookEntry.company_id, order_by=(CashbookEntry.date, CashbookEntry.id))
+
+    query = db.session.query(
+        CashbookEntry.date, CashbookEntry.particulars,
+        CashbookEntry.debit, CashbookEntry.credit, balance.label('balance')
+    )
+    if company_id is not None:
+        query = query.filter(CashbookEntry.company_id == company_id)
+
+    if branch_id:
+        query = query.filter(CashbookEntry.branch_id == branch_id)
+    return query.order_by(CashbookEntry.company_id, CashbookEntry.date, CashbookEntry.id)
+
+
+def cashbook_export_rows(rows):
+    for row in rows:
+        yield (row.date.strftime('%Y-%m-%d'), row.particulars, row.debit, row.credit, row.balance)
+
+
+CASHBOOK_PDF = """
+<html><body><h3>Cashbook Export</h3><table border="1" cellpadding="5">
+<tr>{% for column in columns %}<th>{{ column }}</th>{% endfor %}</tr>
+{% for row in rows %}
+<tr>{% for cell in row %}<td>{{ cell }}</td>{% endfor %}</tr>
+{% endfor %}
+</table></body></html>
+"""
+
+
+def build_cashbook_export(job, path):
+    query = cashbook_export_query(job.company_id, job.branch_id)
+    report = _progress(query, job)
+    rows = cashbook_export_rows(stream_rows(query, job))
+
+    if job.file_format == 'excel':
+        write_xlsx(path, 'Cashbook', CASHBOOK_COLUMNS, rows, report)
+        return 'cashbook.xlsx'
+
+    _write_pdf(path, render_pdf_string(CASHBOOK_PDF, columns=CASHBOOK_COLUMNS, rows=list(rows)))
+    return 'cashbook.pdf'
+
+
+def build_repayments_export(job, path):
+    query = LoanRepayment.query.join(Loan).join(Borrower)\
+        .options(joinedload(LoanRepayment.loan).joinedload(Loan.borrower))
+    if job.company_id is not None:
+        query = query.filter(Loan.company_id == job.company_id)
+    if job.branch_id:
+        query = query.filter(Loan.branch_id == job.branch_id)
+
+    # Date filtering
+    params = job.params or {}
+    filter_type = params.get('filter_type', 'all')
+    today = job.created_at.date()
+    if filter_type in ('today', 'month', 'year'):
+        query = filter_by_period(query, LoanRepayment.date_paid, filter_type, today=today)
+        filter_label = {
+            'today': f"Today ({today.strftime('%Y-%m-%d')})",
+            'month': f"This Month ({today.strftime('%B %Y')})",
+            'year': f"This Year ({today.year})",
+        }[filter_type]
+    elif filter_type == 'custom' and params.get('start_date') and params.get('end_date'):
+        try:
+            start = datetime.strptime(params['start_date'], '%Y-%m-%d').date()
+            end = datetime.strptime(params['end_date'], '%Y-%m-%d').date()
+            # Inclusive end date
+            query = query.filter(range_filter(LoanRepayment.date_paid, start, end + timedelta(days=1)))
+            filter_label = f"Custom Range ({start.strftime('%Y-%m-%d')} to {end.strftime('%Y-%m-%d')})"
+        except ValueError:
+            filter_label = "All"
+    else:
+        filter_label = "All"
+
+    report = _progress(query, job)
+    # A PDF is laid out as a whole, so its rows are collected
+    repayments, total_collected = [], 0
+    for done, repayment in enumerate(stream_rows(query, job), 1):
+        repayments.append(repayment)
+        total_collected += repayment.amount_paid or 0
+        report(done)
+
+    _write_pdf(path, render_pdf_template(
+        'repayments/pdf_template.html',
+        repayments=repayments,
+        total_collected=total_collected,
+        filter_label=filter_label
+    ))
+    return f'repayments_{today}.pdf'
+
+
+EXPORT_BUILDERS = {
+    'loans': build_loans_export,
+    'cashbook': build_cashbook_export,
+    'repayments': build_repayments_export,
+}
+
+EXPORT_FORMATS = {
+    'loans': ('excel', 'pdf'),
+    'cashbook': ('excel', 'pdf'),
+    'repayments': ('pdf',),
+}
@@ -0,0 +1,162 @@
+"""
+Keyset ("seek") pagination for list pages.
+
+OFFSET pagination reads and throws away every row before the page, and the
+page count needs a COUNT(*) over the whole list, so both grow with the
+tenant. Here a page is "the next N rows after (date, id) of the last row
+shown", which the (company, branch, date[, id]) indexes answer directly;
+page 500 costs what page 1 does. Links carry the cursor as `after` (next
+page) or `before` (previous page).
+
+A NULL sort value ranks above every date, as PostgreSQL orders it, so
+undated rows lead a newest-first list and close an oldest-first one; their
+cursor has an empty date ('_<id>'). NOT NULL sort columns skip the extra
+NULL terms and keep the plain row-value seek.
+
+The total is optional: PostgreSQL's planner estimate (no table scan), or
+an exact count elsewhere.
+"""
+import json
+from datetime import date, datetime
+
+from sqlalchemy import Date, DateTime, tuple_
+
+from extensions import db
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class KeysetPage:
+    """One page of rows plus the cursors for the pages either side of it."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, per_page=DEFAULT_PAGE_SIZE, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """(date, id) -> 'YYYY-MM-DD[THH:MM:SS]_id'; a NULL date gives '_id'."""
+    sort_value, row_id = values
+    if sort_value is None:
+        sort_value = ''
+    elif isinstance(sort_value, (date, datetime)):
+        sort_value = sort_value.isoformat()
+    return f"{sort_value}_{row_id}"
+
+
+def decode_cursor(value, column):
+    """Parse an after/before argument for `column`; malformed values give None."""
+    try:
+        sort_value, row_id = value.rsplit('_', 1)
+        row_id = int(row_id)
+        if not sort_value:
+            sort_value = None
+        elif isinstance(column.type, DateTime):
+            sort_value = datetime.fromisoformat(sort_value)
+        elif isinstance(column.type, Date):
+            sort_value = date.fromisoformat(sort_value[:10])
+        return sort_value, row_id
+    except (AttributeError, ValueError):
+        return None
+
+
+def _cursor_of(item, columns):
+    return tuple(getattr(item, column.key) for column in columns)
+
+
+def _order(columns, descending, nullable):
+    sort_column, id_column = columns
+    if descending:
+        sort = sort_column.desc().nulls_first() if nullable else sort_column.desc()
+        return [sort, id_column.desc()]
+    sort = sort_column.asc().nulls_last() if nullable else sort_column.asc()
+    return [sort, id_column.asc()]
+
+
+def _seek(columns, cursor, larger, nullable):
+    """Rows on the larger (or smaller) side of `cursor`, NULL ranking above every value."""
+    sort_column, id_column = columns
+    sort_value, row_id = cursor
+    if sort_value is None:
+        undated = db.and_(sort_column.is_(None), id_column > row_id if larger else id_column < row_id)
+        return undated if larger else db.or_(undated, sort_column.isnot(None))
+
+    key, cursor = tuple_(*columns), tuple_(sort_value, row_id)
+    if larger:
+        return db.or_(key > cursor, sort_column.is_(None)) if nullable else key > cursor
+    return key < cursor
+
+
+def keyset_page(query, sort_column, id_column, after=None, before=None,
+                per_page=DEFAULT_PAGE_SIZE, descending=True, count=False):
+    """
+    Page `query` on (sort_column, id_column), newest first unless
+    descending=False. `after`/`before` are the raw request arguments.
+    count=True also fills page.total (estimated on PostgreSQL).
+    """
+    columns = (sort_column, id_column)
+    nullable = getattr(sort_column.expression, 'nullable', True)
+    after = decode_cursor(after, sort_column) if after else None
+    before = decode_cursor(before, sort_column) if before else None
+
+    total = estimated_count(query) if count else None
+
+    if before and not after:
+        # Walk backwards from the cursor, then put the rows back in page order
+        seek = _seek(columns, before, larger=descending, nullable=nullable)
+        order = _order(columns, not descending, nullable)
+        rows = query.filter(seek).order_by(None).order_by(*order).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        return KeysetPage(
+            items,
+            next_cursor=encode_cursor(_cursor_of(items[-1], columns)) if items else None,
+            prev_cursor=encode_cursor(_cursor_of(items[0], columns)) if items and has_more else None,
+            per_page=per_page,
+            total=total,
+        )
+
+    if after:
+        query = query.filter(_seek(columns, after, larger=not descending, nullable=nullable))
+    rows = query.order_by(None).order_by(*_order(columns, descending, nullable)).limit(per_page + 1).all()
+    items = rows[:per_page]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(_cursor_of(items[-1], columns)) if len(rows) > per_page else None,
+        prev_cursor=encode_cursor(_cursor_of(items[0], columns)) if items and after else None,
+        per_page=per_page,
+        total=total,
+    )
+
+
+def estimated_count(query):
+    """Row count for `query`: the planner's estimate on PostgreSQL, exact elsewhere."""
+    query = query.order_by(None)
+    bind = db.session.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return query.count()
+
+    compiled = query.statement.compile(dialect=bind.dialect)
+    plan = db.session.connection().exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
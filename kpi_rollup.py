@@ -0,0 +1,242 @@
+"""
+Daily KPI rollups.
+
+One DailyKpiRollup row per company/branch/day holds the loan, cash and
+borrower totals the dashboard and cash-flow charts need. Writes flag the
+affected days as stale; stale days are recomputed from the source tables
+before the rollups are read, and `flask kpi-rollup` rebuilds everything
+nightly (which also refreshes time-dependent figures like overdue counts).
+Marking a day stale also invalidates the scope's cached dashboard JSON
+once the transaction commits.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, case, extract
+
+from extensions import db
+from dashboard_cache import invalidate_dashboard_cache_on_commit
+from models import DailyKpiRollup, Loan, Borrower, CashbookEntry
+from upserts import upsert_scope
+
+MONEY_METRICS = (
+    'disbursed', 'loans_paid', 'loans_remaining', 'loans_interest',
+    'collected', 'fees', 'income', 'expenses', 'cash_in', 'cash_out',
+)
+COUNT_METRICS = ('new_borrowers', 'overdue_count')
+METRICS = MONEY_METRICS + COUNT_METRICS
+
+
+def _as_day(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):  # SQLite returns DATE() as text
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _empty_metrics():
+    metrics = {name: Decimal('0.00') for name in MONEY_METRICS}
+    metrics.update({name: 0 for name in COUNT_METRICS})
+    return metrics
+
+
+def _on_day(column, day):
+    start = datetime.combine(day, datetime.min.time())
+    return db.and_(column >= start, column < start + timedelta(days=1))
+
+
+def _sum_if(condition, value):
+    return func.coalesce(func.sum(case((condition, value), else_=0)), 0)
+
+
+# ---------------------------------------------------------------------------
+# Write side
+# ---------------------------------------------------------------------------
+
+def mark_kpi_day_stale(company_id, branch_id, day):
+    """Flag one company/branch/day for recomputation. Caller commits."""
+    day = _as_day(day)
+    if company_id is None or day is None:
+        return
+
+    # Anything that moves a rollup also moves the cached dashboard JSON
+    invalidate_dashboard_cache_on_commit(company_id, branch_id)
+
+    # One statement, so concurrent writers to the same day cannot both insert
+    now = datetime.utcnow()
+    upsert_scope(
+        DailyKpiRollup.__table__,
+        {'company_id': company_id, 'branch_id': branch_id, 'day': day, 'stale': True, 'updated_at': now},
+        keys=('day',),
+        set_={'stale': True, 'updated_at': now},
+    )
+
+
+def mark_loan_kpi_days(loan):
+    """A loan feeds the day it was booked (disbursed, balances) and its due day (overdue)."""
+    mark_kpi_day_stale(loan.company_id, loan.branch_id, loan.date)
+    mark_kpi_day_stale(loan.company_id, loan.branch_id, loan.due_date)
+
+
+def collect_rollups(company_id, day=None):
+    """
+    Compute rollup metrics for a company from the source tables, grouped by
+    (branch_id, day). With day, only that day is computed.
+    """
+    computed = {}
+
+    def add(branch_id, value_day, **metrics):
+        key = (branch_id, _as_day(value_day))
+        row = computed.setdefault(key, _empty_metrics())
+        for name, value in metrics.items():
+            row[name] += value or 0
+
+    # --- Loans by booking day ---
+    loan_day = func.date(Loan.date)
+    loans = db.session.query(
+        Loan.branch_id, loan_day,
+        func.coalesce(func.sum(Loan.amount_borrowed), 0),
+        func.coalesce(func.sum(Loan.amount_paid), 0),
+        func.coalesce(func.sum(Loan.remaining_balance), 0),
+        func.coalesce(func.sum(Loan.total_due - Loan.amount_borrowed), 0),
+    ).filter(Loan.company_id == company_id, Loan.date.isnot(None))
+    if day:
+        loans = loans.filter(_on_day(Loan.date, day))
+    for branch_id, value_day, disbursed, paid, remaining, interest in loans.group_by(Loan.branch_id, loan_day):
+        add(branch_id, value_day, disbursed=disbursed, loans_paid=paid,
+            loans_remaining=remaining, loans_interest=interest)
+
+    # --- Unpaid loans by due day ---
+    due_day = func.date(Loan.due_date)
+    overdue = db.session.query(Loan.branch_id, due_day, func.count(Loan.id))\
+        .filter(Loan.company_id == company_id, Loan.due_date.isnot(None), Loan.remaining_balance > 0)
+    if day:
+        overdue = overdue.filter(_on_day(Loan.due_date, day))
+    for branch_id, value_day, count in overdue.group_by(Loan.branch_id, due_day):
+        add(branch_id, value_day, overdue_count=count)
+
+    # --- Cash movements from the cashbook ---
+    source = CashbookEntry.source_type
+    cash = db.session.query(
+        CashbookEntry.branch_id, CashbookEntry.date,
+        _sum_if(source == 'ledger', CashbookEntry.credit),
+        _sum_if(source == 'processing_fee', CashbookEntry.credit),
+        _sum_if(source == 'other_income', CashbookEntry.credit),
+        _sum_if(source == 'expense', CashbookEntry.debit),
+        func.coalesce(func.sum(CashbookEntry.credit), 0),
+        func.coalesce(func.sum(CashbookEntry.debit), 0),
+    ).filter(CashbookEntry.company_id == company_id)
+    if day:
+        cash = cash.filter(CashbookEntry.date == day)
+    for branch_id, value_day, collected, fees, income, expenses, cash_in, cash_out in \
+            cash.group_by(CashbookEntry.branch_id, CashbookEntry.date):
+        add(branch_id, value_day, collected=collected, fees=fees, income=income,
+            expenses=expenses, cash_in=cash_in, cash_out=cash_out)
+
+    # --- New borrowers ---
+    borrower_day = func.date(Borrower.created_at)
+    borrowers = db.session.query(Borrower.branch_id, borrower_day, func.count(Borrower.id))\
+        .filter(Borrower.company_id == company_id, Borrower.created_at.isnot(None))
+    if day:
+        borrowers = borrowers.filter(_on_day(Borrower.created_at, day))
+    for branch_id, value_day, count in borrowers.group_by(Borrower.branch_id, borrower_day):
+        add(branch_id, value_day, new_borrowers=count)
+
+    return computed
+
+
+def refresh_kpi_day(company_id, day):
+    """Recompute every branch row of one company day. Caller commits."""
+    computed = collect_rollups(company_id, day)
+    existing = {
+        rollup.branch_id: rollup
+        for rollup in DailyKpiRollup.query.filter_by(company_id=company_id, day=day)
+    }
+
+    for (branch_id, _day), metrics in computed.items():
+        rollup = existing.pop(branch_id, None)
+        if rollup is None:
+            rollup = DailyKpiRollup(company_id=company_id, branch_id=branch_id, day=day)
+            db.session.add(rollup)
+        for name, value in metrics.items():
+            setattr(rollup, name, value)
+        rollup.stale = False
+
+    # Nothing left on this day for these branches
+    for rollup in existing.values():
+        db.session.delete(rollup)
+
+
+def refresh_stale_rollups(company_id):
+    """Recompute the days flagged by writes since the last read."""
+    stale_days = [
+        day for (day,) in db.session.query(DailyKpiRollup.day)
+        .filter_by(company_id=company_id, stale=True).distinct()
+    ]
+    for day in stale_days:
+        refresh_kpi_day(company_id, day)
+    if stale_days:
+        db.session.commit()
+
+
+def rebuild_kpi_rollups(company_id):
+    """Nightly catch-up: replace every rollup row of a company. Returns the row count."""
+    computed = collect_rollups(company_id)
+
+    DailyKpiRollup.query.filter_by(company_id=company_id).delete(synchronize_session=False)
+    db.session.add_all(
+        DailyKpiRollup(company_id=company_id, branch_id=branch_id, day=day, stale=False, **metrics)
+        for (branch_id, day), metrics in computed.items()
+    )
+    db.session.commit()
+
+    return len(computed)
+
+
+# ---------------------------------------------------------------------------
+# Read side
+# ---------------------------------------------------------------------------
+
+def _ensure_rollups(company_id):
+    # First read for a company with no rollups yet: build them once
+    if DailyKpiRollup.query.filter_by(company_id=company_id).first() is None:
+        rebuild_kpi_rollups(company_id)
+    else:
+        refresh_stale_rollups(company_id)
+
+
+def _metric_sums(*names):
+    return [func.coalesce(func.sum(getattr(DailyKpiRollup, name)), 0).label(name) for name in names]
+
+
+def daily_kpi_series(company_id, branch_id=None, start=None, end=None, metrics=METRICS):
+    """Per-day totals (summed over branches unless branch_id is given)."""
+    _ensure_rollups(company_id)
+
+    query = db.session.query(DailyKpiRollup.day, *_metric_sums(*metrics))\
+        .filter(DailyKpiRollup.company_id == company_id)
+    if branch_id:
+        query = query.filter(DailyKpiRollup.branch_id == branch_id)
+    if start:
+        query = query.filter(DailyKpiRollup.day >= start)
+    if end:
+        query = query.filter(DailyKpiRollup.day <= end)
+
+    return query.group_by(DailyKpiRollup.day).order_by(DailyKpiRollup.day).all()
+
+
+def monthly_kpi_series(company_id, branch_id=None, metrics=METRICS):
+    """Per-month totals as rows of (year, month, *metrics)."""
+    _ensure_rollups(company_id)
+
+    year = extract('year', DailyKpiRollup.day)
+    month = extract('month', DailyKpiRollup.day)
+    query = db.session.query(year.label('year'), month.label('month'), *_metric_sums(*metrics))\
+        .filter(DailyKpiRollup.company_id == company_id)
+    if branch_id:
+        query = query.filter(DailyKpiRollup.branch_id == branch_id)
+
+    return query.group_by(year, month).order_by(year, month).all()
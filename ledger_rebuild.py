@@ -0,0 +1,122 @@
+"""
+Portfolio-wide ledger replay used by `flask ledger-rebuild`.
+
+Loans are sharded by id (loan.id % shards) across a process pool. Each
+worker streams its shard's ledger rows in (loan_id, date, id) order through
+a server-side cursor, runs them through loan_allocation and writes ledger
+and loan columns back with executemany UPDATEs on a second connection.
+SQLite cannot commit on one connection while another holds a read open, so
+there the shard is read up front and written afterwards by a single worker.
+"""
+import time
+from itertools import groupby
+
+from sqlalchemy import bindparam, update
+
+from loan_allocation import allocate_ledger, ledger_kind, loan_snapshot
+from models import Loan, LedgerEntry
+
+# Worker process state: one Flask app per process
+_app = None
+
+_LEDGER_COLUMNS = (
+    'principal', 'interest', 'cumulative_interest',
+    'principal_balance', 'interest_balance', 'cumulative_interest_balance', 'running_balance',
+)
+_LOAN_COLUMNS = ('amount_paid', 'remaining_balance', 'status')
+
+_update_ledger = update(LedgerEntry.__table__)\
+    .where(LedgerEntry.__table__.c.id == bindparam('b_id'))\
+    .values({column: bindparam(f'b_{column}') for column in _LEDGER_COLUMNS})
+
+_update_loan = update(Loan.__table__)\
+    .where(Loan.__table__.c.id == bindparam('b_id'))\
+    .values({column: bindparam(f'b_{column}') for column in _LOAN_COLUMNS})
+
+
+def _init_worker():
+    global _app
+    from app import create_app
+    _app = create_app()
+
+
+def _bound(prefix_values):
+    return {f'b_{key}': value for key, value in prefix_values.items()}
+
+
+def rebuild_shard(shard, shards, company_id=None, batch_size=2000):
+    """
+    Replay every loan in one shard. Returns a stats dict with loan/row counts,
+    elapsed seconds and per-loan timings as (seconds, loan_id) pairs.
+    """
+    from extensions import db
+
+    app = _app
+    if app is None:
+        # In-process run from the CLI: reuse the current app
+        from flask import current_app
+        app = current_app._get_current_object()
+
+    started = time.perf_counter()
+    stats = {'shard': shard, 'loans': 0, 'rows': 0, 'timings': []}
+
+    with app.app_context():
+        engine = db.engine
+        ledger = LedgerEntry.__table__
+        loans = Loan.__table__
+
+        query = db.select(
+            ledger.c.id, ledger.c.loan_id, ledger.c.date, ledger.c.particulars, ledger.c.payment,
+            loans.c.amount_borrowed, loans.c.interest_rate
+        ).join(loans, loans.c.id == ledger.c.loan_id)\
+         .where((loans.c.id % shards) == shard)\
+         .order_by(ledger.c.loan_id, ledger.c.date, ledger.c.id)
+        if company_id:
+            query = query.where(loans.c.company_id == company_id)
+
+        with engine.connect() as reader, engine.connect() as writer:
+            if engine.dialect.name == 'postgresql':
+                # 🔹 Server-side cursor: rows arrive in batches, never all at once
+                result = reader.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+            else:
+                # SQLite: an open read would lock out the writer's commits
+                result = reader.execute(query).all()
+                reader.rollback()
+
+            ledger_updates, loan_updates = [], []
+
+            def flush():
+                if ledger_updates:
+                    writer.execute(_update_ledger, ledger_updates)
+                if loan_updates:
+                    writer.execute(_update_loan, loan_updates)
+                writer.commit()
+                ledger_updates.clear()
+                loan_updates.clear()
+
+            for loan_id, rows in groupby(result, key=lambda row: row.loan_id):
+                loan_started = time.perf_counter()
+                rows = list(rows)
+
+                allocated, state = allocate_ledger(
+                    rows[0].amount_borrowed,
+                    rows[0].interest_rate,
+                    [(row.date, ledger_kind(row.particulars), row.payment) for row in rows]
+                )
+
+                ledger_updates.extend(
+                    _bound(dict(id=row.id, **values._asdict())) for row, values in zip(rows, allocated)
+                )
+                loan_updates.append(_bound(dict(id=loan_id, **loan_snapshot(state))))
+
+                stats['loans'] += 1
+                stats['rows'] += len(rows)
+                stats['timings'].append((time.perf_counter() - loan_started, loan_id))
+
+                if len(ledger_updates) >= batch_size:
+                    flush()
+
+            flush()
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
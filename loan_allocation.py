@@ -0,0 +1,160 @@
+"""
+Loan ledger allocation engine.
+
+Pure functions (no Flask, no ORM) that run the repayment waterfall over a
+loan's ledger: every payment goes to cumulative interest first, then
+interest, then principal. Input rows are compact (date, kind, amount)
+tuples in ledger order; the output is the allocation and balance columns
+for each row, ready to be written back in bulk.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+ZERO = Decimal('0.00')
+
+# Ledger row kinds
+KIND_APPLICATION = 'application'     # 'Loan Application' / 'Loan Approved'
+KIND_DISBURSED = 'disbursed'         # 'Loan Disbursed'
+KIND_CUMULATIVE = 'cumulative'       # 'Cumulative Interest'
+KIND_REPAYMENT = 'repayment'         # 'Loan Repayment'
+KIND_OTHER = 'other'
+
+FIXED_KINDS = (KIND_APPLICATION, KIND_DISBURSED)
+
+_KIND_BY_PARTICULARS = {
+    'loan application': KIND_APPLICATION,
+    'loan approved': KIND_APPLICATION,
+    'loan disbursed': KIND_DISBURSED,
+    'cumulative interest': KIND_CUMULATIVE,
+    'loan repayment': KIND_REPAYMENT,
+}
+
+# Outstanding balances after a row, plus the total paid so far
+AllocationState = namedtuple(
+    'AllocationState',
+    'principal_balance interest_balance cumulative_interest_balance total_paid'
+)
+
+# Columns written back to a LedgerEntry
+AllocatedRow = namedtuple(
+    'AllocatedRow',
+    'principal interest cumulative_interest '
+    'principal_balance interest_balance cumulative_interest_balance running_balance'
+)
+
+
+def ledger_kind(particulars):
+    """Map LedgerEntry.particulars to an allocation kind."""
+    return _KIND_BY_PARTICULARS.get((particulars or '').lower().strip(), KIND_OTHER)
+
+
+def _dec(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value or 0))
+
+
+def loan_interest(amount_borrowed, interest_rate):
+    return _dec(amount_borrowed) * _dec(interest_rate) / Decimal('100')
+
+
+def opening_state(amount_borrowed, interest_rate):
+    """Balances before the first ledger row: full principal and interest owed."""
+    return AllocationState(_dec(amount_borrowed), loan_interest(amount_borrowed, interest_rate), ZERO, ZERO)
+
+
+def state_from_row(row, total_paid):
+    """Resume from the stored balances of an already-allocated ledger row."""
+    return AllocationState(
+        _dec(row.principal_balance),
+        _dec(row.interest_balance),
+        _dec(row.cumulative_interest_balance),
+        _dec(total_paid),
+    )
+
+
+def allocate_row(state, kind, amount, amount_borrowed=None, interest_rate=None):
+    """
+    Apply one ledger row to the running state.
+    Returns (AllocatedRow, new AllocationState). Fixed rows (application,
+    disbursement) need amount_borrowed/interest_rate for their display columns.
+    """
+    principal_balance, interest_balance, ci_balance, total_paid = state
+
+    if kind in FIXED_KINDS:
+        row = AllocatedRow(
+            _dec(amount_borrowed),
+            loan_interest(amount_borrowed, interest_rate) if kind == KIND_APPLICATION else ZERO,
+            ZERO,
+            principal_balance,
+            interest_balance,
+            ci_balance,
+            principal_balance + interest_balance + ci_balance,
+        )
+        return row, state
+
+    principal = interest = cumulative_interest = ZERO
+    amount = _dec(amount)
+
+    if kind == KIND_CUMULATIVE:
+        ci_balance += amount
+        cumulative_interest = amount
+
+    elif kind == KIND_REPAYMENT:
+        payment = amount
+
+        # 1️⃣ Pay cumulative interest
+        cumulative_interest = min(payment, ci_balance)
+        ci_balance -= cumulative_interest
+        payment -= cumulative_interest
+
+        # 2️⃣ Pay interest
+        interest = min(payment, interest_balance)
+        interest_balance -= interest
+        payment -= interest
+
+        # 3️⃣ Pay principal
+        principal = min(payment, principal_balance)
+        principal_balance -= principal
+
+        total_paid += cumulative_interest + interest + principal
+
+    # 🔢 Clamp
+    principal_balance = max(principal_balance, ZERO)
+    interest_balance = max(interest_balance, ZERO)
+    ci_balance = max(ci_balance, ZERO)
+
+    row = AllocatedRow(
+        principal,
+        interest,
+        cumulative_interest,
+        principal_balance,
+        interest_balance,
+        ci_balance,
+        principal_balance + interest_balance + ci_balance,
+    )
+    return row, AllocationState(principal_balance, interest_balance, ci_balance, total_paid)
+
+
+def allocate_ledger(amount_borrowed, interest_rate, rows, state=None):
+    """
+    Run the waterfall over rows of (date, kind, amount) in ledger order.
+    Returns (list of AllocatedRow aligned with rows, final AllocationState).
+    Pass state to continue from a known point instead of the loan's opening.
+    """
+    state = state or opening_state(amount_borrowed, interest_rate)
+    allocated = []
+
+    for _date, kind, amount in rows:
+        row, state = allocate_row(state, kind, amount, amount_borrowed, interest_rate)
+        allocated.append(row)
+
+    return allocated, state
+
+
+def loan_snapshot(state):
+    """Loan summary columns (amount_paid, remaining_balance, status) for a final state."""
+    remaining = state.principal_balance + state.interest_balance + state.cumulative_interest_balance
+    return {
+        'amount_paid': state.total_paid,
+        'remaining_balance': remaining,
+        'status': 'Paid' if remaining <= 0 else 'Partially Paid',
+    }
@@ -0,0 +1,44 @@
+"""Add cashbook source keys and dirty markers
+
+Revision ID: 324e63f312f8
+Revises: 4d328d36d533, 5f8cc5db944d
+Create Date: 2026-10-18 09:12:41.220417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '324e63f312f8'
+down_revision = ('4d328d36d533', '5f8cc5db944d')
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('cashbook_entries', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('source_type', sa.String(length=30), nullable=True))
+        batch_op.add_column(sa.Column('source_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_cashbook_entries_source', ['source_type', 'source_id'], unique=False)
+
+    op.create_table('cashbook_dirty_markers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=True),
+    sa.Column('dirty_from', sa.Date(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['branch_id'], ['branches.id'], ),
+    sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('company_id', 'branch_id', name='uq_cashbook_dirty_markers_scope')
+    )
+
+
+def downgrade():
+    op.drop_table('cashbook_dirty_markers')
+
+    with op.batch_alter_table('cashbook_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_cashbook_entries_source')
+        batch_op.drop_column('source_id')
+        batch_op.drop_column('source_type')
@@ -0,0 +1,52 @@
+"""Add daily KPI rollups
+
+Revision ID: 8b1e6f0c2a97
+Revises: d7dbb3b62eab
+Create Date: 2026-10-18 13:05:27.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e6f0c2a97'
+down_revision = 'd7dbb3b62eab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_kpi_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=True),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('disbursed', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('loans_paid', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('loans_remaining', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('loans_interest', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('collected', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('fees', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('income', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('expenses', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('cash_in', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('cash_out', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('new_borrowers', sa.Integer(), nullable=True),
+    sa.Column('overdue_count', sa.Integer(), nullable=True),
+    sa.Column('stale', sa.Boolean(), nullable=False, server_default=sa.false()),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['branch_id'], ['branches.id'], ),
+    sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('company_id', 'branch_id', 'day', name='uq_daily_kpi_rollups_scope_day')
+    )
+    with op.batch_alter_table('daily_kpi_rollups', schema=None) as batch_op:
+        batch_op.create_index('ix_daily_kpi_rollups_company_day', ['company_id', 'day'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('daily_kpi_rollups', schema=None) as batch_op:
+        batch_op.drop_index('ix_daily_kpi_rollups_company_day')
+
+    op.drop_table('daily_kpi_rollups')
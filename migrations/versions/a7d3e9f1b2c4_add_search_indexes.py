@@ -0,0 +1,83 @@
+"""Add borrower and loan search indexes
+
+Revision ID: a7d3e9f1b2c4
+Revises: f2c8d4b6a1e7
+Create Date: 2026-10-18 18:04:51.302716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9f1b2c4'
+down_revision = 'f2c8d4b6a1e7'
+branch_labels = None
+depends_on = None
+
+
+# (table, FTS5 table, searched columns); see search_index.py
+SEARCHED = (
+    ('borrowers', 'borrowers_fts', ('name', 'phone')),
+    ('loans', 'loans_fts', ('loan_id', 'borrower_name', 'phone_number')),
+)
+
+
+def _sqlite_fts(table, fts, columns):
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"""CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+        END""",
+        f"""CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+        END""",
+        f"""CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});
+            INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});
+        END""",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, _, columns in SEARCHED:
+            with op.batch_alter_table(table, schema=None) as batch_op:
+                for name in columns:
+                    batch_op.create_index(
+                        f'ix_{table}_{name}_trgm', [name], unique=False,
+                        postgresql_using='gin', postgresql_ops={name: 'gin_trgm_ops'}
+                    )
+
+    elif dialect == 'sqlite':
+        # Needs SQLite 3.34+ for the trigram tokenizer; without it the app
+        # falls back to ILIKE
+        version = tuple(int(part) for part in op.get_bind().dialect.dbapi.sqlite_version.split('.'))
+        if version < (3, 34):
+            return
+        for table, fts, columns in SEARCHED:
+            for statement in _sqlite_fts(table, fts, columns):
+                op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        for table, _, columns in reversed(SEARCHED):
+            with op.batch_alter_table(table, schema=None) as batch_op:
+                for name in reversed(columns):
+                    batch_op.drop_index(f'ix_{table}_{name}_trgm')
+
+    elif dialect == 'sqlite':
+        for table, fts, _ in reversed(SEARCHED):
+            for suffix in ('au', 'ad', 'ai'):
+                op.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {fts}')
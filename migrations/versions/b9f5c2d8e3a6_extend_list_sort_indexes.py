@@ -0,0 +1,36 @@
+"""Extend borrower and savings indexes with their list sort column
+
+Revision ID: b9f5c2d8e3a6
+Revises: a7d3e9f1b2c4
+Create Date: 2026-10-18 18:47:13.560284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9f5c2d8e3a6'
+down_revision = 'a7d3e9f1b2c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('borrowers', schema=None) as batch_op:
+        batch_op.create_index('ix_borrowers_company_branch_created', ['company_id', 'branch_id', 'created_at'], unique=False)
+        batch_op.drop_index('ix_borrowers_company_branch')
+
+    with op.batch_alter_table('saving_accounts', schema=None) as batch_op:
+        batch_op.create_index('ix_saving_accounts_company_branch_opened', ['company_id', 'branch_id', 'date_opened'], unique=False)
+        batch_op.drop_index('ix_saving_accounts_company_branch')
+
+
+def downgrade():
+    with op.batch_alter_table('saving_accounts', schema=None) as batch_op:
+        batch_op.create_index('ix_saving_accounts_company_branch', ['company_id', 'branch_id'], unique=False)
+        batch_op.drop_index('ix_saving_accounts_company_branch_opened')
+
+    with op.batch_alter_table('borrowers', schema=None) as batch_op:
+        batch_op.create_index('ix_borrowers_company_branch', ['company_id', 'branch_id'], unique=False)
+        batch_op.drop_index('ix_borrowers_company_branch_created')
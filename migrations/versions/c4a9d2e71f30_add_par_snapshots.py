@@ -0,0 +1,48 @@
+"""Add PAR snapshots
+
+Revision ID: c4a9d2e71f30
+Revises: 8b1e6f0c2a97
+Create Date: 2026-10-18 14:21:48.331905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a9d2e71f30'
+down_revision = '8b1e6f0c2a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('par_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('branch_id', sa.Integer(), nullable=True),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('loans', sa.Integer(), nullable=True),
+    sa.Column('outstanding', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('current', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('days_1_30', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('days_31_60', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('days_61_90', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('days_over_90', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('par1_amount', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('par30_amount', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('par90_amount', sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['branch_id'], ['branches.id'], ),
+    sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('par_snapshots', schema=None) as batch_op:
+        batch_op.create_index('ix_par_snapshots_company_day', ['company_id', 'day'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('par_snapshots', schema=None) as batch_op:
+        batch_op.drop_index('ix_par_snapshots_company_day')
+
+    op.drop_table('par_snapshots')
@@ -0,0 +1,55 @@
+"""Add sequence counters for loan ids and voucher numbers
+
+Revision ID: c6a1f4e8d2b9
+Revises: b9f5c2d8e3a6
+Create Date: 2026-10-18 19:26:37.840159
+
+"""
+import re
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6a1f4e8d2b9'
+down_revision = 'b9f5c2d8e3a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    counters = op.create_table('sequence_counters',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('prefix', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('company_id', 'prefix', name='uq_sequence_counters_company_prefix')
+    )
+
+    # Carry on from the highest existing C<company>-T<n> loan id per company.
+    # Voucher numbers now carry the company (VCH-<year>-C<company>-<n>), so
+    # their counters start fresh without clashing with older numbers.
+    last = {}
+    rows = op.get_bind().execute(sa.text(
+        "SELECT company_id, loan_id FROM loans WHERE loan_id IS NOT NULL"
+    ))
+    for company_id, loan_id in rows:
+        match = re.fullmatch(rf"C{company_id}-T(\d+)", loan_id)
+        if match:
+            last[company_id] = max(last.get(company_id, 0), int(match.group(1)))
+
+    if last:
+        now = datetime.utcnow()
+        op.bulk_insert(counters, [
+            {'company_id': company_id, 'prefix': f"C{company_id}-T", 'value': value, 'updated_at': now}
+            for company_id, value in last.items()
+        ])
+
+
+def downgrade():
+    op.drop_table('sequence_counters')
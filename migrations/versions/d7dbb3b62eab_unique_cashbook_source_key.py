@@ -0,0 +1,42 @@
+"""Unique cashbook source key
+
+Revision ID: d7dbb3b62eab
+Revises: 324e63f312f8
+Create Date: 2026-10-18 11:40:05.118352
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7dbb3b62eab'
+down_revision = '324e63f312f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of any duplicated source before enforcing uniqueness
+    op.execute("""
+        DELETE FROM cashbook_entries
+        WHERE source_type IS NOT NULL
+          AND id NOT IN (
+              SELECT keep_id FROM (
+                  SELECT MIN(id) AS keep_id
+                  FROM cashbook_entries
+                  WHERE source_type IS NOT NULL
+                  GROUP BY source_type, source_id
+              ) AS keepers
+          )
+    """)
+
+    with op.batch_alter_table('cashbook_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_cashbook_entries_source')
+        batch_op.create_unique_constraint('uq_cashbook_entries_source', ['source_type', 'source_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('cashbook_entries', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_cashbook_entries_source', type_='unique')
+        batch_op.create_index('ix_cashbook_entries_source', ['source_type', 'source_id'], unique=False)
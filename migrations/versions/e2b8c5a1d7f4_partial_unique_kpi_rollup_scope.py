@@ -0,0 +1,53 @@
+"""Partial unique indexes for daily KPI rollup scopes
+
+Revision ID: e2b8c5a1d7f4
+Revises: c6a1f4e8d2b9
+Create Date: 2026-10-18 21:04:12.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8c5a1d7f4'
+down_revision = 'c6a1f4e8d2b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The old UNIQUE let company-wide (NULL branch) days repeat. Keep the
+    # newest row of each, flagged stale so the next read recomputes it.
+    op.execute("""
+        UPDATE daily_kpi_rollups SET stale = TRUE
+        WHERE branch_id IS NULL AND EXISTS (
+            SELECT 1 FROM daily_kpi_rollups AS other
+            WHERE other.branch_id IS NULL
+              AND other.company_id = daily_kpi_rollups.company_id
+              AND other.day = daily_kpi_rollups.day
+              AND other.id <> daily_kpi_rollups.id
+        )
+    """)
+    op.execute("""
+        DELETE FROM daily_kpi_rollups
+        WHERE branch_id IS NULL AND id NOT IN (
+            SELECT MAX(id) FROM daily_kpi_rollups WHERE branch_id IS NULL GROUP BY company_id, day
+        )
+    """)
+
+    with op.batch_alter_table('daily_kpi_rollups', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_daily_kpi_rollups_scope_day', type_='unique')
+        batch_op.create_index('uq_daily_kpi_rollups_branch_day', ['company_id', 'branch_id', 'day'], unique=True,
+                              postgresql_where=sa.text('branch_id IS NOT NULL'),
+                              sqlite_where=sa.text('branch_id IS NOT NULL'))
+        batch_op.create_index('uq_daily_kpi_rollups_company_day', ['company_id', 'day'], unique=True,
+                              postgresql_where=sa.text('branch_id IS NULL'),
+                              sqlite_where=sa.text('branch_id IS NULL'))
+
+
+def downgrade():
+    with op.batch_alter_table('daily_kpi_rollups', schema=None) as batch_op:
+        batch_op.drop_index('uq_daily_kpi_rollups_company_day')
+        batch_op.drop_index('uq_daily_kpi_rollups_branch_day')
+        batch_op.create_unique_constraint('uq_daily_kpi_rollups_scope_day', ['company_id', 'branch_id', 'day'])
@@ -0,0 +1,90 @@
+"""Add composite tenant/branch/date indexes
+
+Revision ID: f2c8d4b6a1e7
+Revises: e5b3f7a1c9d2
+Create Date: 2026-10-18 17:22:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8d4b6a1e7'
+down_revision = 'e5b3f7a1c9d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('borrowers', schema=None) as batch_op:
+        batch_op.create_index('ix_borrowers_company_branch', ['company_id', 'branch_id'], unique=False)
+
+    with op.batch_alter_table('loans', schema=None) as batch_op:
+        batch_op.create_index('ix_loans_company_branch_date', ['company_id', 'branch_id', 'date'], unique=False)
+        batch_op.create_index('ix_loans_company_due_date', ['company_id', 'due_date'], unique=False)
+        batch_op.create_index('ix_loans_borrower_id', ['borrower_id'], unique=False)
+
+    with op.batch_alter_table('loan_repayments', schema=None) as batch_op:
+        batch_op.create_index('ix_loan_repayments_loan_date_paid', ['loan_id', 'date_paid'], unique=False)
+
+    with op.batch_alter_table('ledger_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_ledger_entries_loan_date', ['loan_id', 'date', 'id'], unique=False)
+
+    with op.batch_alter_table('saving_accounts', schema=None) as batch_op:
+        batch_op.create_index('ix_saving_accounts_company_branch', ['company_id', 'branch_id'], unique=False)
+
+    with op.batch_alter_table('saving_transactions', schema=None) as batch_op:
+        batch_op.create_index('ix_saving_transactions_account_date', ['account_id', 'date'], unique=False)
+
+    with op.batch_alter_table('cashbook_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_cashbook_entries_company_branch_date', ['company_id', 'branch_id', 'date', 'id'], unique=False)
+
+    with op.batch_alter_table('expenses', schema=None) as batch_op:
+        batch_op.create_index('ix_expenses_company_branch_date', ['company_id', 'branch_id', 'date'], unique=False)
+
+    with op.batch_alter_table('other_income', schema=None) as batch_op:
+        batch_op.create_index('ix_other_income_company_branch_date', ['company_id', 'branch_id', 'income_date'], unique=False)
+
+    with op.batch_alter_table('bank_transfers', schema=None) as batch_op:
+        batch_op.create_index('ix_bank_transfers_company_branch_date', ['company_id', 'branch_id', 'transfer_date'], unique=False)
+
+    with op.batch_alter_table('vouchers', schema=None) as batch_op:
+        batch_op.create_index('ix_vouchers_company_branch_date', ['company_id', 'branch_id', 'date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('vouchers', schema=None) as batch_op:
+        batch_op.drop_index('ix_vouchers_company_branch_date')
+
+    with op.batch_alter_table('bank_transfers', schema=None) as batch_op:
+        batch_op.drop_index('ix_bank_transfers_company_branch_date')
+
+    with op.batch_alter_table('other_income', schema=None) as batch_op:
+        batch_op.drop_index('ix_other_income_company_branch_date')
+
+    with op.batch_alter_table('expenses', schema=None) as batch_op:
+        batch_op.drop_index('ix_expenses_company_branch_date')
+
+    with op.batch_alter_table('cashbook_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_cashbook_entries_company_branch_date')
+
+    with op.batch_alter_table('saving_transactions', schema=None) as batch_op:
+        batch_op.drop_index('ix_saving_transactions_account_date')
+
+    with op.batch_alter_table('saving_accounts', schema=None) as batch_op:
+        batch_op.drop_index('ix_saving_accounts_company_branch')
+
+    with op.batch_alter_table('ledger_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_ledger_entries_loan_date')
+
+    with op.batch_alter_table('loan_repayments', schema=None) as batch_op:
+        batch_op.drop_index('ix_loan_repayments_loan_date_paid')
+
+    with op.batch_alter_table('loans', schema=None) as batch_op:
+        batch_op.drop_index('ix_loans_borrower_id')
+        batch_op.drop_index('ix_loans_company_due_date')
+        batch_op.drop_index('ix_loans_company_branch_date')
+
+    with op.batch_alter_table('borrowers', schema=None) as batch_op:
+        batch_op.drop_index('ix_borrowers_company_branch')
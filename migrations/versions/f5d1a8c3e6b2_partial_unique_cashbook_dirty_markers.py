@@ -0,0 +1,50 @@
+"""Partial unique indexes for cashbook dirty marker scopes
+
+Revision ID: f5d1a8c3e6b2
+Revises: e2b8c5a1d7f4
+Create Date: 2026-10-18 21:31:48.093562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5d1a8c3e6b2'
+down_revision = 'e2b8c5a1d7f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The old UNIQUE let company-wide (NULL branch) markers repeat. Keep one
+    # per company, dirty from the earliest date any of them recorded.
+    op.execute("""
+        UPDATE cashbook_dirty_markers SET dirty_from = (
+            SELECT MIN(other.dirty_from) FROM cashbook_dirty_markers AS other
+            WHERE other.branch_id IS NULL AND other.company_id = cashbook_dirty_markers.company_id
+        )
+        WHERE branch_id IS NULL
+    """)
+    op.execute("""
+        DELETE FROM cashbook_dirty_markers
+        WHERE branch_id IS NULL AND id NOT IN (
+            SELECT MIN(id) FROM cashbook_dirty_markers WHERE branch_id IS NULL GROUP BY company_id
+        )
+    """)
+
+    with op.batch_alter_table('cashbook_dirty_markers', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_cashbook_dirty_markers_scope', type_='unique')
+        batch_op.create_index('uq_cashbook_dirty_markers_branch', ['company_id', 'branch_id'], unique=True,
+                              postgresql_where=sa.text('branch_id IS NOT NULL'),
+                              sqlite_where=sa.text('branch_id IS NOT NULL'))
+        batch_op.create_index('uq_cashbook_dirty_markers_company', ['company_id'], unique=True,
+                              postgresql_where=sa.text('branch_id IS NULL'),
+                              sqlite_where=sa.text('branch_id IS NULL'))
+
+
+def downgrade():
+    with op.batch_alter_table('cashbook_dirty_markers', schema=None) as batch_op:
+        batch_op.drop_index('uq_cashbook_dirty_markers_company')
+        batch_op.drop_index('uq_cashbook_dirty_markers_branch')
+        batch_op.create_unique_constraint('uq_cashbook_dirty_markers_scope', ['company_id', 'branch_id'])
@@ -69,16 +69,25 @@ class User(UserMixin, db.Model):
 
     roles = db.relationship('Role', secondary=user_roles, backref=db.backref('users', lazy='dynamic'))
 
+    # Lower-cased role names, built once per loaded user (reset when roles change)
+    _role_set = None
+
+    @property
+    def role_set(self):
+        if self._role_set is None:
+            self._role_set = frozenset(role.name.lower() for role in self.roles)
+        return self._role_set
+
     @property
     def role_names(self):
-        return [role.name.lower() for role in self.roles]
+        return sorted(self.role_set)
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
     @property
     def is_admin(self):
-        return 'admin' in [role.name.lower() for role in self.roles]
+        return 'admin' in self.role_set
 
     @property
     def is_company_admin(self):
@@ -92,12 +101,31 @@ class User(UserMixin, db.Model):
 
     def has_role(self, role_names):
         if isinstance(role_names, list):
-            return any(role.name.lower() in [r.lower() for r in role_names] for role in self.roles)
-        return any(role.name.lower() == role_names.lower() for role in self.roles)
+            return any(r.lower() in self.role_set for r in role_names)
+        return role_names.lower() in self.role_set
 
     def __repr__(self):
         return f"<User {self.username}>"
 
+
+def _roles_changed(user):
+    user._role_set = None
+    if user.id is not None:
+        # Existing user: session snapshots carrying the old roles are void once committed
+        from session_principal import bump_principal_version_on_commit
+        bump_principal_version_on_commit(user.id)
+
+
+@listens_for(User.roles, 'append')
+@listens_for(User.roles, 'remove')
+def _reset_role_set(user, role, initiator):
+    _roles_changed(user)
+
+
+@listens_for(User.roles, 'set')
+def _reset_role_set_on_assign(user, value, oldvalue, initiator):
+    _roles_changed(user)
+
 class Company(db.Model):
     __tablename__ = 'companies'
 
@@ -188,6 +216,10 @@ class Borrower(db.Model):
     photo = db.Column(db.String(200))
     company_id = db.Column(db.Integer)  # For multi-tenancy
 
+    __table_args__ = (
+        db.Index('ix_borrowers_company_branch_created', 'company_id', 'branch_id', 'created_at'),
+    )
+
     documents = db.relationship('BorrowerDocument', back_populates='borrower', cascade='all, delete-orphan', lazy='dynamic')
 
     # Relationships
@@ -196,6 +228,10 @@ class Borrower(db.Model):
 
     @property
     def total_paid(self):
+        # Set in bulk by preload_balances(); per-instance queries otherwise
+        if '_total_paid' in self.__dict__:
+            return self._total_paid
+
         from models import LoanRepayment
         total = 0
         for loan in self.loans:
@@ -205,8 +241,46 @@ class Borrower(db.Model):
 
     @property
     def open_balance(self):
+        if '_open_balance' in self.__dict__:
+            return self._open_balance
         return sum(loan.remaining_balance for loan in self.loans)
 
+    @classmethod
+    def preload_balances(cls, borrowers):
+        """
+        Fill total_paid/open_balance for a page of borrowers with one grouped
+        query (repayments are summed per loan first so loans are not double counted).
+        """
+        borrowers = list(borrowers)
+        if not borrowers:
+            return borrowers
+
+        from models import Loan, LoanRepayment
+
+        ids = [b.id for b in borrowers]
+        # Only this page's loans are summed, not every tenant's repayments
+        repaid = db.session.query(
+            LoanRepayment.loan_id.label('loan_id'),
+            func.sum(LoanRepayment.amount_paid).label('paid')
+        ).join(Loan, LoanRepayment.loan_id == Loan.id)\
+         .filter(Loan.borrower_id.in_(ids))\
+         .group_by(LoanRepayment.loan_id).subquery()
+
+        rows = db.session.query(
+            Loan.borrower_id,
+            func.coalesce(func.sum(repaid.c.paid), 0),
+            func.coalesce(func.sum(Loan.remaining_balance), 0)
+        ).outerjoin(repaid, repaid.c.loan_id == Loan.id)\
+         .filter(Loan.borrower_id.in_(ids))\
+         .group_by(Loan.borrower_id)\
+         .all()
+
+        totals = {borrower_id: (paid, balance) for borrower_id, paid, balance in rows}
+        for borrower in borrowers:
+            borrower._total_paid, borrower._open_balance = totals.get(borrower.id, (0, 0))
+
+        return borrowers
+
 class BorrowerDocument(db.Model):
     __tablename__ = 'borrower_documents'
 
@@ -255,6 +329,13 @@ class Loan(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
     company = db.relationship('Company', back_populates='loans')
 
+    # Lists filter on tenant/branch and sort by date; arrears and PAR range over due_date
+    __table_args__ = (
+        db.Index('ix_loans_company_branch_date', 'company_id', 'branch_id', 'date'),
+        db.Index('ix_loans_company_due_date', 'company_id', 'due_date'),
+        db.Index('ix_loans_borrower_id', 'borrower_id'),
+    )
+
     @property
     def total_interest(self):
         return Decimal(self.amount_borrowed) * Decimal(self.interest_rate) / Decimal(100)
@@ -278,10 +359,9 @@ class Loan(db.Model):
 @event.listens_for(Loan, 'before_insert')
 def receive_before_insert(mapper, connection, target):
     if target.loan_id is None:
-        # Get the company name (for the company initial part)
-        company_name = target.company.name
-        # Generate the loan_id
-        target.loan_id = Loan.generate_loan_id(company_name)
+        from sequences import next_loan_id
+        # Allocated on the flush's connection, so a rollback returns the number
+        target.loan_id = next_loan_id(target.company_id, connection=connection)
 
 class LoanRepayment(db.Model):
     __tablename__ = 'loan_repayments'
@@ -297,6 +377,10 @@ class LoanRepayment(db.Model):
     date_paid = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     balance_after = db.Column(db.Numeric(12, 2), nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_loan_repayments_loan_date_paid', 'loan_id', 'date_paid'),
+    )
+
     def __repr__(self):
         return f"<Repayment of {self.amount_paid} for Loan ID {self.loan_id}>"
 
@@ -322,6 +406,11 @@ class LedgerEntry(db.Model):
 
     loan = db.relationship('Loan', back_populates='ledger_entries')
 
+    # A loan's ledger is always read in (date, id) order
+    __table_args__ = (
+        db.Index('ix_ledger_entries_loan_date', 'loan_id', 'date', 'id'),
+    )
+
 class SavingAccount(db.Model):
     __tablename__ = 'saving_accounts'
 
@@ -339,6 +428,10 @@ class SavingAccount(db.Model):
     company = db.relationship('Company', backref='saving_accounts')
     branch = db.relationship('Branch')
 
+    __table_args__ = (
+        db.Index('ix_saving_accounts_company_branch_opened', 'company_id', 'branch_id', 'date_opened'),
+    )
+
     def __repr__(self):
         return f"<SavingAccount {self.account_number} for {self.borrower.name}>"
 
@@ -353,6 +446,10 @@ class SavingTransaction(db.Model):
 
     account = db.relationship('SavingAccount', backref='transactions')
 
+    __table_args__ = (
+        db.Index('ix_saving_transactions_account_date', 'account_id', 'date'),
+    )
+
     def __repr__(self):
         return f"<{self.transaction_type.title()} of {self.amount} on {self.date.strftime('%Y-%m-%d')} to Account {self.account_id}>"
 
@@ -391,13 +488,44 @@ class CashbookEntry(db.Model):
 
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
+    # Record that produced this row, e.g. ('expense', 12) or ('ledger', 345)
+    source_type = db.Column(db.String(30), nullable=True)
+    source_id = db.Column(db.Integer, nullable=True)
+
     company = db.relationship('Company', backref='cashbook_entries')
     branch = db.relationship('Branch', backref='cashbook_entries')
     user = db.relationship('User', backref='cashbook_entries')
 
+    # One cashbook row per source record
+    __table_args__ = (
+        UniqueConstraint('source_type', 'source_id', name='uq_cashbook_entries_source'),
+        db.Index('ix_cashbook_entries_company_branch_date', 'company_id', 'branch_id', 'date', 'id'),
+    )
+
     def __repr__(self):
         return f"<CashbookEntry {self.date} | {self.particulars} | Dr: {self.debit} | Cr: {self.credit}>"
 
+class CashbookDirtyMarker(db.Model):
+    """Earliest cashbook date whose running balances are stale for a company/branch."""
+    __tablename__ = 'cashbook_dirty_markers'
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=True)
+    dirty_from = db.Column(db.Date, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # NULL branches never collide under UNIQUE, so the company-wide marker gets its own index
+        db.Index('uq_cashbook_dirty_markers_branch', 'company_id', 'branch_id', unique=True,
+                 postgresql_where=branch_id.isnot(None), sqlite_where=branch_id.isnot(None)),
+        db.Index('uq_cashbook_dirty_markers_company', 'company_id', unique=True,
+                 postgresql_where=branch_id.is_(None), sqlite_where=branch_id.is_(None)),
+    )
+
+    def __repr__(self):
+        return f"<CashbookDirtyMarker company={self.company_id} branch={self.branch_id} from={self.dirty_from}>"
+
 class Expense(db.Model):
     __tablename__ = 'expenses'
 
@@ -420,6 +548,10 @@ class Expense(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_expenses_company_branch_date', 'company_id', 'branch_id', 'date'),
+    )
+
 class Collateral(db.Model):
     __tablename__ = 'collaterals'
 
@@ -457,6 +589,10 @@ class OtherIncome(db.Model):
 
     is_active = db.Column(db.Boolean, default=True)
 
+    __table_args__ = (
+        db.Index('ix_other_income_company_branch_date', 'company_id', 'branch_id', 'income_date'),
+    )
+
 class BankTransfer(db.Model):
     __tablename__ = 'bank_transfers'
 
@@ -474,6 +610,10 @@ class BankTransfer(db.Model):
 
     branch = db.relationship('Branch', backref='bank_transfers')
 
+    __table_args__ = (
+        db.Index('ix_bank_transfers_company_branch_date', 'company_id', 'branch_id', 'transfer_date'),
+    )
+
 class CashFlowSnapshot(db.Model):
     __tablename__ = 'cashflow_snapshots'
     id = db.Column(db.Integer, primary_key=True)
@@ -486,6 +626,128 @@ class CashFlowSnapshot(db.Model):
     branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class DailyKpiRollup(db.Model):
+    """Per company/branch/day totals behind the dashboard and cash-flow charts."""
+    __tablename__ = 'daily_kpi_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=True)
+    day = db.Column(db.Date, nullable=False)
+
+    # Loans booked on this day (by Loan.date)
+    disbursed = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    loans_paid = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    loans_remaining = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    loans_interest = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+
+    # Cash movements on this day (from the cashbook)
+    collected = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    fees = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    income = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    expenses = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    cash_in = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    cash_out = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+
+    new_borrowers = db.Column(db.Integer, default=0)
+    overdue_count = db.Column(db.Integer, default=0)  # unpaid loans falling due on this day
+
+    stale = db.Column(db.Boolean, default=False, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # NULL branches never collide under UNIQUE, so company-wide rows get their own index
+        db.Index('uq_daily_kpi_rollups_branch_day', 'company_id', 'branch_id', 'day', unique=True,
+                 postgresql_where=branch_id.isnot(None), sqlite_where=branch_id.isnot(None)),
+        db.Index('uq_daily_kpi_rollups_company_day', 'company_id', 'day', unique=True,
+                 postgresql_where=branch_id.is_(None), sqlite_where=branch_id.is_(None)),
+        db.Index('ix_daily_kpi_rollups_company_day', 'company_id', 'day'),
+    )
+
+    def __repr__(self):
+        return f"<DailyKpiRollup company={self.company_id} branch={self.branch_id} day={self.day}>"
+
+class ParSnapshot(db.Model):
+    """Daily portfolio-at-risk figures per company/branch, for trend lines."""
+    __tablename__ = 'par_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=True)
+    day = db.Column(db.Date, nullable=False)
+
+    loans = db.Column(db.Integer, default=0)
+    outstanding = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+
+    # Outstanding balance per days-past-due bucket
+    current = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    days_1_30 = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    days_31_60 = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    days_61_90 = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    days_over_90 = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+
+    # Balance at least 1/30/90 days past due
+    par1_amount = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    par30_amount = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+    par90_amount = db.Column(db.Numeric(14, 2), default=Decimal('0.00'))
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_par_snapshots_company_day', 'company_id', 'day'),
+    )
+
+    def __repr__(self):
+        return f"<ParSnapshot company={self.company_id} branch={self.branch_id} day={self.day}>"
+
+class ExportJob(db.Model):
+    """A queued report export, built by `flask export-worker` and downloaded when done."""
+    __tablename__ = 'export_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=True)  # None: superuser, all companies
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    kind = db.Column(db.String(30), nullable=False)  # loans, cashbook, repayments
+    file_format = db.Column(db.String(10), nullable=False)  # excel, pdf
+    params = db.Column(db.JSON, default=dict)
+
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    progress = db.Column(db.Integer, default=0)  # percent
+    file_path = db.Column(db.String(255))
+    filename = db.Column(db.String(255))
+    error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_export_jobs_status_id', 'status', 'id'),
+        db.Index('ix_export_jobs_user_created', 'user_id', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"<ExportJob {self.id} {self.kind}/{self.file_format} {self.status}>"
+
+class SequenceCounter(db.Model):
+    """Last number issued per company and code prefix (e.g. 'C3-T'); see sequences.py."""
+    __tablename__ = 'sequence_counters'
+
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
+    prefix = db.Column(db.String(50), nullable=False)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('company_id', 'prefix', name='uq_sequence_counters_company_prefix'),
+    )
+
+    def __repr__(self):
+        return f"<SequenceCounter {self.company_id}/{self.prefix}={self.value}>"
+
 class Voucher(db.Model):
     __tablename__ = 'vouchers'
 
@@ -509,21 +771,15 @@ class Voucher(db.Model):
     loan = db.relationship('Loan', backref=db.backref('vouchers', lazy='dynamic'))
     creator = db.relationship('User', backref='vouchers_created', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_vouchers_company_branch_date', 'company_id', 'branch_id', 'date'),
+    )
+
 @listens_for(Voucher, 'before_insert')
 def generate_voucher_number(mapper, connect, target):
-    year = datetime.utcnow().year
-    last_voucher = connect.execute(
-        db.text("SELECT voucher_number FROM vouchers WHERE voucher_number LIKE :pattern ORDER BY id DESC LIMIT 1"),
-            {'pattern': f'VCH-{year}-%'}
-        ).fetchone()
-
-    if last_voucher:
-        last_num = int(last_voucher[0].split('-')[-1])
-    else:
-        last_num = 0
-
-    new_number = f"VCH-{year}-{last_num + 1:04d}"
-    target.voucher_number = new_number
+    if target.voucher_number is None:
+        from sequences import next_voucher_number
+        target.voucher_number = next_voucher_number(target.company_id, connection=connect)
 
 class CompanyLog(db.Model):
     __tablename__ = 'company_logs'
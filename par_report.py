@@ -0,0 +1,154 @@
+"""
+Portfolio-at-risk (PAR) aging engine.
+
+Outstanding balances of active loans are bucketed by days past due_date
+per branch and loan officer (Loan.created_by) in one grouped query over
+Loan. Bucket edges are turned into due_date cut-offs up front, so the query
+only compares due_date with constants. ParSnapshot keeps one row per
+company/branch/day for trend lines, written by `flask par-snapshot`.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, case
+
+from extensions import db
+from models import Loan, Branch, User, ParSnapshot
+
+# (key, min days overdue, max days overdue); None = open-ended
+PAR_BUCKETS = (
+    ('current', None, 0),
+    ('days_1_30', 1, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('days_over_90', 91, None),
+)
+
+# PARn = share of outstanding balance at least n days past due
+PAR_THRESHOLDS = (1, 30, 90)
+
+
+def _overdue_since(today, days):
+    """due_date cut-off for 'at least `days` days past due' on `today`."""
+    return datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+
+
+def _bucket_condition(today, low, high):
+    if low is None:
+        # Not yet past due (or no due date)
+        return db.or_(Loan.due_date.is_(None), Loan.due_date >= _overdue_since(today, 1))
+    conditions = [Loan.due_date < _overdue_since(today, low)]
+    if high is not None:
+        conditions.append(Loan.due_date >= _overdue_since(today, high + 1))
+    return db.and_(*conditions)
+
+
+def _par_columns(today):
+    balance = func.coalesce(Loan.remaining_balance, 0)
+    columns = [
+        func.count(Loan.id).label('loans'),
+        func.coalesce(func.sum(balance), 0).label('outstanding'),
+    ]
+    for key, low, high in PAR_BUCKETS:
+        condition = _bucket_condition(today, low, high)
+        columns.append(func.coalesce(func.sum(case((condition, balance), else_=0)), 0).label(key))
+        columns.append(func.coalesce(func.sum(case((condition, 1), else_=0)), 0).label(f'{key}_count'))
+    for days in PAR_THRESHOLDS:
+        condition = Loan.due_date < _overdue_since(today, days)
+        columns.append(func.coalesce(func.sum(case((condition, balance), else_=0)), 0).label(f'par{days}_amount'))
+    return columns
+
+
+def _active_loans(query, company_id, branch_id=None):
+    query = query.filter(
+        Loan.company_id == company_id,
+        Loan.remaining_balance > 0,
+        Loan.approval_status == 'approved',
+        db.or_(Loan.is_archived.is_(False), Loan.is_archived.is_(None))
+    )
+    if branch_id:
+        query = query.filter(Loan.branch_id == branch_id)
+    return query
+
+
+def _with_ratios(values):
+    outstanding = Decimal(values['outstanding'] or 0)
+    for days in PAR_THRESHOLDS:
+        amount = Decimal(values[f'par{days}_amount'] or 0)
+        values[f'par{days}'] = round(float(amount / outstanding * 100), 2) if outstanding else 0.0
+    return values
+
+
+def par_report(company_id, branch_id=None, today=None):
+    """
+    PAR buckets per (branch, officer) plus portfolio totals.
+    Returns {'rows': [...], 'totals': {...}, 'as_of': today}.
+    """
+    today = today or date.today()
+
+    rows = _active_loans(
+        db.session.query(
+            Loan.branch_id,
+            Branch.name.label('branch_name'),
+            Loan.created_by.label('officer_id'),
+            User.full_name.label('officer_name'),
+            *_par_columns(today)
+        ).outerjoin(Branch, Branch.id == Loan.branch_id)
+         .outerjoin(User, User.id == Loan.created_by),
+        company_id, branch_id
+    ).group_by(Loan.branch_id, Branch.name, Loan.created_by, User.full_name)\
+     .order_by(Branch.name, User.full_name)\
+     .all()
+
+    totals = _active_loans(db.session.query(*_par_columns(today)), company_id, branch_id).one()
+
+    return {
+        'rows': [_with_ratios(row._asdict()) for row in rows],
+        'totals': _with_ratios(totals._asdict()),
+        'as_of': today,
+    }
+
+
+def take_par_snapshot(company_id, today=None):
+    """Store today's PAR figures per branch (replacing any earlier run). Returns the row count."""
+    today = today or date.today()
+
+    rows = _active_loans(
+        db.session.query(Loan.branch_id, *_par_columns(today)),
+        company_id
+    ).group_by(Loan.branch_id).all()
+
+    ParSnapshot.query.filter_by(company_id=company_id, day=today).delete(synchronize_session=False)
+    for row in rows:
+        values = row._asdict()
+        db.session.add(ParSnapshot(
+            company_id=company_id,
+            branch_id=values['branch_id'],
+            day=today,
+            loans=values['loans'],
+            outstanding=values['outstanding'],
+            **{key: values[key] for key, _low, _high in PAR_BUCKETS},
+            **{f'par{days}_amount': values[f'par{days}_amount'] for days in PAR_THRESHOLDS}
+        ))
+    db.session.commit()
+
+    return len(rows)
+
+
+def par_trend(company_id, branch_id=None, since=None):
+    """Daily PAR1/30/90 ratios from the snapshots, summed over branches unless branch_id is given."""
+    amounts = [f'par{days}_amount' for days in PAR_THRESHOLDS]
+    query = db.session.query(
+        ParSnapshot.day,
+        func.sum(ParSnapshot.outstanding).label('outstanding'),
+        *[func.sum(getattr(ParSnapshot, name)).label(name) for name in amounts]
+    ).filter(ParSnapshot.company_id == company_id)
+    if branch_id:
+        query = query.filter(ParSnapshot.branch_id == branch_id)
+    if since:
+        query = query.filter(ParSnapshot.day >= since)
+
+    return [
+        _with_ratios(row._asdict())
+        for row in query.group_by(ParSnapshot.day).order_by(ParSnapshot.day)
+    ]
@@ -0,0 +1,128 @@
+"""
+PDF rendering service.
+
+Every PDF goes through WeasyPrint: views render a Jinja template (compiled
+templates are cached by Jinja; inline template strings are compiled once
+here) and hand the HTML to `render_pdf`. Parsed stylesheets, the font
+configuration and fetched images are cached per process, so a warm worker
+only pays for layout. With PDF_RENDER_WORKERS > 0, layout runs in a pool of
+separate processes, which keeps long documents (a 500-page ledger) from
+holding the web worker's GIL. /static/ URLs are read from disk.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from io import BytesIO
+from multiprocessing import get_context
+
+from flask import current_app, has_request_context, render_template, send_file
+
+# Relative URLs in PDF templates resolve against this, and /static/ below it
+# is served straight from the app's static folder
+BASE_URL = 'http://techlend.pdf/'
+
+# Plain report look for templates without their own <style>
+BASE_CSS = '''
+    @page { size: A4; margin: 1cm; }
+    body { font-family: Arial, sans-serif; font-size: 12px; }
+    table { border-collapse: collapse; width: 100%; }
+    th, td { border: 1px solid #ccc; padding: 5px; }
+    th { background-color: #f2f2f2; }
+'''
+
+DEFAULT_TIMEOUT = 300
+
+_image_cache = {}
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# ---------------------------------------------------------------------------
+# Engine (runs in the web worker or in a pool process)
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def _font_config():
+    from weasyprint.text.fonts import FontConfiguration
+    return FontConfiguration()
+
+
+@lru_cache(maxsize=64)
+def _stylesheet(css):
+    from weasyprint import CSS
+    return CSS(string=css, font_config=_font_config())
+
+
+def _fetch_url(static_root, url, *args, **kwargs):
+    from weasyprint import default_url_fetcher
+    if url.startswith(BASE_URL + 'static/'):
+        path = os.path.normpath(os.path.join(static_root, url[len(BASE_URL + 'static/'):]))
+        if not path.startswith(static_root + os.sep):
+            raise ValueError(f'Refusing to load {url}')
+        url = 'file://' + path
+    return default_url_fetcher(url, *args, **kwargs)
+
+
+def _html_to_pdf(html, stylesheets, static_root):
+    from weasyprint import HTML
+    document = HTML(string=html, base_url=BASE_URL, url_fetcher=partial(_fetch_url, static_root))
+    return document.write_pdf(
+        stylesheets=[_stylesheet(css) for css in stylesheets],
+        font_config=_font_config(),
+        cache=_image_cache,
+    )
+
+
+def _pool(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: pool processes must not inherit the web worker's DB connections
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+        return _executor
+
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+def render_pdf(html, stylesheets=()):
+    """HTML string to PDF bytes, in a pool process if PDF_RENDER_WORKERS is set."""
+    static_root = os.path.realpath(current_app.static_folder)
+    stylesheets = tuple(stylesheets)
+
+    workers = current_app.config.get('PDF_RENDER_WORKERS', 0)
+    if not workers:
+        return _html_to_pdf(html, stylesheets, static_root)
+
+    future = _pool(workers).submit(_html_to_pdf, html, stylesheets, static_root)
+    return future.result(timeout=current_app.config.get('PDF_RENDER_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def render_pdf_template(template_name, stylesheets=(), **context):
+    if has_request_context():
+        html = render_template(template_name, **context)
+    else:
+        # Export worker: no request, so no context processors
+        html = current_app.jinja_env.get_template(template_name).render(**context)
+    return render_pdf(html, stylesheets)
+
+
+@lru_cache(maxsize=32)
+def _compiled(source):
+    return current_app.jinja_env.from_string(source)
+
+
+def render_pdf_string(source, stylesheets=(BASE_CSS,), **context):
+    """Like render_pdf_template for a template kept inline in a view."""
+    return render_pdf(_compiled(source).render(**context), stylesheets)
+
+
+def pdf_response(pdf, filename, inline=False):
+    return send_file(
+        BytesIO(pdf),
+        mimetype='application/pdf',
+        as_attachment=not inline,
+        download_name=filename
+    )
@@ -10,6 +10,7 @@ from utils.decorators import superuser_required, roles_required, admin_or_superu
 from sqlalchemy import func
 from flask import session
 from utils.logging import log_company_action, log_system_action
+from session_principal import bump_principal_version
 from extensions import db, csrf
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -135,6 +136,7 @@ def move_staff(user_id):
         if new_branch_id and new_branch_id != str(user.branch_id):
             user.branch_id = int(new_branch_id)
             db.session.commit()
+            bump_principal_version(user.id)
             flash('Staff successfully moved to new branch.', 'success')
         else:
             flash('No branch change detected.', 'info')
@@ -153,6 +155,7 @@ def delete_staff(user_id):
 
     db.session.delete(user)
     db.session.commit()
+    bump_principal_version(user_id)
 
     flash(f"Staff member {user.username} has been permanently deleted.", "success")
     return redirect(url_for('admin.manage_staff'))
@@ -12,6 +12,7 @@ import os
 from werkzeug.utils import secure_filename
 from extensions import csrf
 from email_utils import send_reset_email
+from session_principal import store_principal, clear_principal, bump_principal_version
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
 auth_bp = Blueprint('auth', __name__)
@@ -215,6 +216,8 @@ def login():
 
             # ✅ Log the user in
             login_user(user)
+            if current_app.config.get('SESSION_PRINCIPAL_CACHE'):
+                store_principal(user)
 
             # 🔧 Branch assignment logic
             session['active_branch_id'] = None
@@ -318,6 +321,7 @@ def reset_password_token(token):
 
         user.set_password(new_password)
         db.session.commit()
+        bump_principal_version(user.id)
 
         flash('Password reset successfully. You can now log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -335,5 +339,6 @@ def verify_reset_token(token, expiration=3600):
 @login_required
 def logout():
     logout_user()
+    clear_principal()
     flash('Logged out successfully.', 'success')
     return redirect(url_for('auth.login'))
@@ -5,13 +5,14 @@ from flask import session
 from models import BankTransfer, Branch
 from datetime import datetime
 from models import CashbookEntry
-from weasyprint import HTML
 from io import BytesIO
 from sqlalchemy import and_
 from utils.decorators import roles_required
 from extensions import csrf
+from pdf_service import render_pdf_template, pdf_response
 from decimal import Decimal
-from routes.cashbook_routes import add_cashbook_entry
+from cashbook_helpers import sync_cashbook_source, remove_cashbook_source
+from keyset import keyset_page
 
 bank_bp = Blueprint('bank', __name__, template_folder='../templates/bank')
 
@@ -56,17 +57,10 @@ def bank_deposit():
             created_by_id=current_user.id
         )
         db.session.add(transfer)
+        db.session.flush()
 
         # Cashbook entry
-        add_cashbook_entry(
-            date=transfer_date,
-            particulars=f"Bank deposit - Ref: {reference or 'N/A'}",
-            debit=amount,
-            credit=Decimal('0.00'),
-            company_id=current_user.company_id,
-            branch_id=branch_id,
-            created_by=current_user.id
-        )
+        sync_cashbook_source('bank_transfer', transfer)
 
         db.session.commit()
         flash("Bank deposit recorded successfully.", "success")
@@ -116,17 +110,10 @@ def bank_withdraw():
             created_by_id=current_user.id
         )
         db.session.add(transfer)
+        db.session.flush()
 
         # Cashbook entry
-        add_cashbook_entry(
-            date=transfer_date,
-            particulars=f"Bank withdrawal - Ref: {reference or 'N/A'}",
-            debit=Decimal('0.00'),
-            credit=amount,
-            company_id=current_user.company_id,
-            branch_id=branch_id,
-            created_by=current_user.id
-        )
+        sync_cashbook_source('bank_transfer', transfer)
 
         db.session.commit()
         flash("Bank withdrawal recorded successfully.", "success")
@@ -177,11 +164,15 @@ def view_transfers():
         except ValueError:
             flash('Invalid end date format.', 'error')
 
-    transfers = query.order_by(BankTransfer.transfer_date.desc()).all()
+    page = keyset_page(
+        query, BankTransfer.transfer_date, BankTransfer.id,
+        after=request.args.get('after'), before=request.args.get('before')
+    )
 
     return render_template(
         'bank/view_transfers.html',
-        transfers=transfers,
+        transfers=page.items,
+        page=page,
         datetime=datetime,
         branches=branches
     )
@@ -199,12 +190,10 @@ def delete_transfer(transfer_id):
         branch_id=branch_id
     ).first_or_404()
 
+    remove_cashbook_source('bank_transfer', transfer.id)
     db.session.delete(transfer)
     db.session.commit()
 
-    # 🔄 Rebuild cashbook safely
-    refresh_cashbook(current_user.company_id, branch_id)
-
     flash('Bank transfer deleted successfully.', 'success')
     return redirect(url_for('bank.view_transfers'))
 
@@ -227,11 +216,10 @@ def edit_transfer(transfer_id):
             request.form['transfer_date'], '%Y-%m-%d'
         )
 
+        # 🔄 Re-sync this transfer's cashbook row
+        sync_cashbook_source('bank_transfer', transfer)
         db.session.commit()
 
-        # 🔄 Re-sync cashbook
-        refresh_cashbook(current_user.company_id, branch_id)
-
         flash('Bank transfer updated successfully.', 'success')
         return redirect(url_for('bank.view_transfers'))
 
@@ -258,16 +246,7 @@ def export_transfers_pdf():
 
     transfers = BankTransfer.query.filter(and_(*filters)).order_by(BankTransfer.transfer_date.desc()).all()
 
-    # Render HTML to a string
-    html_out = render_template('bank/transfer_pdf_template.html', transfers=transfers)
-
-    # Generate PDF
-    pdf_io = BytesIO()
-    HTML(string=html_out).write_pdf(pdf_io)
-    pdf_io.seek(0)
+    # Render HTML and generate PDF
+    pdf = render_pdf_template('bank/transfer_pdf_template.html', transfers=transfers)
 
-    # Prepare response
-    response = make_response(pdf_io.read())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'inline; filename=bank_transfers.pdf'
-    return response
+    return pdf_response(pdf, 'bank_transfers.pdf', inline=True)
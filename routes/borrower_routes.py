@@ -4,20 +4,24 @@ from flask_login import login_required, current_user
 from utils.decorators import roles_required
 from flask import session
 from utils.logging import log_company_action, log_system_action, log_action
-from xhtml2pdf import pisa
 import io
 import uuid
 from models import Borrower, SavingAccount, Loan, LoanRepayment, Branch, BorrowerDocument
+from kpi_rollup import mark_kpi_day_stale
 from werkzeug.utils import secure_filename
 import os, random, string
 from forms import AddBorrowerForm, BorrowerEmailForm
 from sqlalchemy import or_, extract
 from datetime import datetime
+from utils.period_filter import filter_by_period
+from search_index import borrower_search
+from keyset import keyset_page
 from flask import request
 from sqlalchemy import or_, extract
 from utils.utils import allowed_file, validate_image 
 from email_utils import send_bulk_borrower_email
 from extensions import csrf
+from pdf_service import render_pdf_template, pdf_response
 
 borrower_bp = Blueprint('borrowers', __name__)
 
@@ -67,7 +71,6 @@ def send_email_to_borrowers():
 @roles_required('Superuser', 'Admin', 'Accountant', 'Branch_Manager', 'Loans_Supervisor')
 def view_borrowers():
     branch_id = session.get('active_branch_id')
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '').strip()
 
     # ✅ Do casting in Python, not in Jinja
@@ -79,34 +82,30 @@ def view_borrowers():
     if branch_id:
         borrowers_query = borrowers_query.filter_by(branch_id=branch_id)
 
-    # Search by name or phone
+    # Search by name or phone (trigram/FTS-backed, see search_index)
     if search:
-        borrowers_query = borrowers_query.filter(
-            or_(
-                Borrower.name.ilike(f"%{search}%"),
-                Borrower.phone.ilike(f"%{search}%")
-            )
-        )
+        condition, _ = borrower_search(search)
+        borrowers_query = borrowers_query.filter(condition)
 
-    # Filter by year and month
-    if year:
-        borrowers_query = borrowers_query.filter(extract('year', Borrower.created_at) == year)
-    if month:
-        borrowers_query = borrowers_query.filter(extract('month', Borrower.created_at) == month)
+    # Filter by year and month (as a created_at range)
+    borrowers_query = filter_by_period(borrowers_query, Borrower.created_at, month=month, year=year)
 
-    pagination = borrowers_query.order_by(Borrower.created_at.desc()).paginate(page=page, per_page=50)
-    borrowers = pagination.items
+    # Keyset page on (created_at, id), newest first
+    page = keyset_page(
+        borrowers_query, Borrower.created_at, Borrower.id,
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=50, count=True
+    )
+    borrowers = page.items
 
-    # Preload calculated properties
-    for borrower in borrowers:
-        _ = borrower.total_paid
-        _ = borrower.open_balance
+    # Preload calculated properties (one grouped query for the whole page)
+    Borrower.preload_balances(borrowers)
 
     # ✅ Pass year & month to template
     return render_template(
         'borrowers/view_borrowers.html',
         borrowers=borrowers,
-        pagination=pagination,
+        page=page,
         year=year,
         month=month,
         search=search
@@ -172,6 +171,7 @@ def add_borrower():
         )
 
         db.session.add(new_borrower)
+        mark_kpi_day_stale(current_user.company_id, branch_id, datetime.utcnow())
         db.session.commit()
 
         # Create savings account if not exists
@@ -357,12 +357,8 @@ def download_borrower_pdf(borrower_id):
 
     borrower = Borrower.query.get_or_404(borrower_id)
     loans = Loan.query.filter_by(borrower_id=borrower_id).all()
-    rendered = render_template('borrowers/pdf_template.html', borrower=borrower, loans=loans)
-    pdf = io.BytesIO()
-    pisa.CreatePDF(io.BytesIO(rendered.encode('utf-8')), dest=pdf)
-    pdf.seek(0)
-    return Response(pdf.read(), content_type='application/pdf',
-                    headers={'Content-Disposition': f'attachment; filename=borrower_{borrower.id}.pdf'})
+    pdf = render_pdf_template('borrowers/pdf_template.html', borrower=borrower, loans=loans)
+    return pdf_response(pdf, f'borrower_{borrower.id}.pdf')
 
 # Other existing routes (view_groups, add_group, etc.) remain unchanged
 
@@ -6,6 +6,7 @@ from datetime import datetime
 from flask import abort
 from utils.decorators import superuser_required, roles_required, admin_or_superuser_required
 from utils.logging import log_company_action, log_system_action, log_action
+from utils.branch_filter import invalidate_branch_cache
 from extensions import csrf
 from flask import session
 
@@ -115,6 +116,7 @@ def update_branch(branch_id):
         branch.phone_number = phone_number
 
         db.session.commit()
+        invalidate_branch_cache(current_user.company_id)
         flash('Branch updated successfully.', 'success')
         return redirect(url_for('branches.list_branches'))
 
@@ -136,6 +138,7 @@ def delete_branch(branch_id):
 
     branch.deleted_at = datetime.utcnow()
     db.session.commit()
+    invalidate_branch_cache(current_user.company_id)
     log_action(f"{current_user.full_name} deleted branch: {branch.name}")
 
     flash('Branch deleted successfully!', 'success')
@@ -171,6 +174,7 @@ def toggle_branch_status(branch_id):
 
     branch.is_active = not branch.is_active
     db.session.commit()
+    invalidate_branch_cache(current_user.company_id)
 
     status = 'activated' if branch.is_active else 'deactivated'
     flash(f"Branch {status} successfully.", 'info')
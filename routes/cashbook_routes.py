@@ -1,20 +1,33 @@
-from flask import Blueprint, render_template, request, session
+from flask import Blueprint, render_template, request, session, current_app, flash, redirect, url_for
 from flask_login import login_required, current_user
 from extensions import db
-from sqlalchemy import extract
+from utils.period_filter import filter_by_period
+from keyset import keyset_page
 from decimal import Decimal
 from models import (
-    CashbookEntry, LedgerEntry, Loan, OtherIncome, Expense,
+    CashbookEntry, CashbookDirtyMarker, LedgerEntry, Loan, OtherIncome, Expense,
     BankTransfer, SavingTransaction, SavingAccount
 )
+from cashbook_helpers import (
+    CASHBOOK_SOURCES, build_cashbook_row, recalculate_balances, sync_cashbook,
+    sync_cashbook_source, flush_cashbook_balances, scoped_cashbook_sources,
+    cashbook_lines
+)
+from export_jobs import (
+    enqueue_export, csv_response, stream_rows, cashbook_export_query, cashbook_export_rows, CASHBOOK_COLUMNS
+)
 from datetime import datetime, timedelta
 
 cashbook_bp = Blueprint('cashbook', __name__, url_prefix='/cashbook')
 
 
-def recalc_balances(entries):
-    """Given a list of cashbook entries, compute running balances."""
-    running_balance = Decimal('0.00')
+def recalc_balances(entries, opening_balance=None):
+    """
+    Given a list of cashbook entries, compute running balances.
+    Pass only the changed suffix together with the stored balance of the
+    entry before it as opening_balance to avoid walking the whole book.
+    """
+    running_balance = opening_balance if opening_balance is not None else Decimal('0.00')
     for entry in entries:
         debit = entry.debit or Decimal('0.00')
         credit = entry.credit or Decimal('0.00')
@@ -25,49 +38,20 @@ def recalc_balances(entries):
 def sync_cashbook_entries(company_id, branch_id=None):
     """
     Sync ledger entries to the cashbook without rebuilding the whole table.
-    Only inserts new ledger entries that are missing in the cashbook.
+    Only ledger entries with no keyed cashbook row are inserted; the lookup
+    is an anti-join on (source_type, source_id).
     """
-    # 1️⃣ Get all ledger entries for the company (and branch)
-    query = LedgerEntry.query.filter_by(company_id=company_id)
+    missing = LedgerEntry.query.join(Loan, LedgerEntry.loan_id == Loan.id)\
+        .outerjoin(CashbookEntry, db.and_(
+            CashbookEntry.source_type == 'ledger',
+            CashbookEntry.source_id == LedgerEntry.id
+        ))\
+        .filter(Loan.company_id == company_id, CashbookEntry.id.is_(None))
     if branch_id:
-        query = query.filter_by(branch_id=branch_id)
-    ledger_entries = query.order_by(LedgerEntry.date.asc(), LedgerEntry.id.asc()).all()
+        missing = missing.filter(Loan.branch_id == branch_id)
 
-    # 2️⃣ Get last cashbook entry for running balance
-    last_cb = CashbookEntry.query.filter_by(company_id=company_id)
-    if branch_id:
-        last_cb = last_cb.filter_by(branch_id=branch_id)
-    last_cb = last_cb.order_by(CashbookEntry.date.desc(), CashbookEntry.id.desc()).first()
-
-    running_balance = last_cb.balance if last_cb else Decimal('0.00')
-
-    # 3️⃣ Insert missing ledger entries
-    for entry in ledger_entries:
-        # Skip if already exists in cashbook
-        exists = CashbookEntry.query.filter_by(
-            date=entry.date,
-            particulars=entry.particulars,
-            company_id=company_id,
-            branch_id=entry.branch_id
-        ).first()
-        if exists:
-            continue
-
-        debit = Decimal(entry.debit or 0)
-        credit = Decimal(entry.credit or 0)
-        running_balance += debit - credit
-
-        cb_entry = CashbookEntry(
-            date=entry.date,
-            particulars=entry.particulars,
-            debit=debit,
-            credit=credit,
-            balance=running_balance,
-            company_id=entry.company_id,
-            branch_id=entry.branch_id,
-            created_by=entry.created_by_id
-        )
-        db.session.add(cb_entry)
+    for entry in missing.order_by(LedgerEntry.date.asc(), LedgerEntry.id.asc()).all():
+        sync_cashbook_source('ledger', entry)
 
     db.session.commit()
 
@@ -91,207 +75,70 @@ def add_cashbook_entry(date, particulars, debit, credit, company_id, branch_id,
 def ledger_to_cashbook(entry, created_by=None):
     """
     Convert a LedgerEntry into a CashbookEntry.
-    Handles branch, company, and created_by properly.
+    Handles branch, company, and created_by properly; the row is found by
+    its ('ledger', entry.id) key and only its scope is marked for balance
+    recalculation.
     """
-    debit = Decimal('0.00')
-    credit = Decimal('0.00')
-    particulars = entry.particulars or ""
-
-    # Loan repayment = cash in
-    if "repayment" in particulars.lower():
-        credit = entry.payment or Decimal('0.00')
-    # Loan disbursement = cash out
-    elif "disbursed" in particulars.lower():
-        debit = (
-            (entry.principal or Decimal('0.00')) +
-            (entry.interest or Decimal('0.00')) +
-            (entry.cumulative_interest or Decimal('0.00'))
-        )
-
-    # Avoid duplicates
-    existing = CashbookEntry.query.filter_by(
-        particulars=particulars,
-        date=entry.date,
-        branch_id=entry.loan.branch_id if entry.loan else None,
-        company_id=entry.loan.company_id if entry.loan else None
-    ).first()
-    if existing:
-        return existing
-
     # Use the provided created_by or fallback to loan's creator
     cb_created_by = created_by or (entry.loan.created_by if entry.loan else None)
 
-    cb_entry = CashbookEntry(
-        date=entry.date,
-        particulars=particulars,
-        debit=debit,
-        credit=credit,
-        balance=Decimal('0.00'),  # recalculated below
-        company_id=entry.loan.company_id if entry.loan else None,
-        branch_id=entry.loan.branch_id if entry.loan else None,
-        created_by=cb_created_by
-    )
-
-    db.session.add(cb_entry)
+    cb_entry = sync_cashbook_source('ledger', entry, created_by=cb_created_by)
     db.session.commit()
 
-    # Recalculate running balances for this branch/company
-    refresh_cashbook(cb_entry.company_id, cb_entry.branch_id)
-
     return cb_entry
 
 def refresh_cashbook(company_id, branch_id=None):
-    """Populate Cashbook from all sources: Ledger, Bank, Savings, Expenses, Other Income."""
+    """
+    Full rebuild of the Cashbook from all sources: Ledger, Bank, Savings, Expenses, Other Income.
+    Only needed once per scope to key legacy rows; day-to-day writes go through
+    cashbook_helpers.sync_cashbook_source.
+    """
     # 1️⃣ Clear existing cashbook entries for this branch/company
     query = CashbookEntry.query.filter_by(company_id=company_id)
     if branch_id:
         query = query.filter_by(branch_id=branch_id)
     query.delete()
-    db.session.commit()
 
-    # 2️ Loan repayments & disbursements from Ledger
-    ledger_entries = LedgerEntry.query.join(Loan, LedgerEntry.loan_id == Loan.id)\
-        .filter(Loan.company_id == company_id)
+    markers = CashbookDirtyMarker.query.filter_by(company_id=company_id)
     if branch_id:
-        ledger_entries = ledger_entries.filter(Loan.branch_id == branch_id)
-    ledger_entries = ledger_entries.order_by(LedgerEntry.date.asc(), LedgerEntry.id.asc()).all()
-
-    for entry in ledger_entries:
-        particulars = (entry.particulars or '').lower().strip()
-    
-        # 🔒 Skip ledger markers that do NOT affect cash
-        if particulars in ('loan application', 'loan approved'):
-            continue
-
-        debit = Decimal('0.00')
-        credit = Decimal('0.00')
-        borrower_name = entry.loan.borrower_name if entry.loan else 'Unknown'
-
-        # Build particulars with borrower name
-        if 'repayment' in particulars:
-            particulars = f"Loan Repayment by {borrower_name}"
-            credit = entry.payment or Decimal('0.00')
-        elif 'disbursed' in particulars:
-            particulars = f"Loan Disbursed to {borrower_name}"
-            debit = entry.principal or Decimal('0.00')
-
-        cb_entry = CashbookEntry(
-            date=entry.date,
-            particulars=particulars,
-            debit=debit,
-            credit=credit,
-            balance=Decimal('0.00'),
-            company_id=company_id,
-            branch_id=entry.loan.branch_id if entry.loan else branch_id,
-            created_by=entry.loan.created_by if entry.loan else None
-        )
-        db.session.add(cb_entry)
-
-    # 2b️ Add processing fees as Cashbook entries
-    loans_with_fees = Loan.query.filter_by(company_id=company_id).filter(Loan.processing_fee > 0)
-    if branch_id:
-        loans_with_fees = loans_with_fees.filter(Loan.branch_id == branch_id)
-
-    for loan in loans_with_fees.all():
-        db.session.add(CashbookEntry(
-            date=loan.date,
-            particulars=f"Processing fee received from {loan.borrower_name}",
-            debit=Decimal('0.00'),
-            credit=loan.processing_fee,
-            balance=Decimal('0.00'),
-            company_id=company_id,
-            branch_id=loan.branch_id,
-            created_by=loan.created_by
-        ))
-
-    # 3️⃣ Other Income → Credit
-    other_incomes = OtherIncome.query.filter_by(company_id=company_id, is_active=True)
-    if branch_id:
-        other_incomes = other_incomes.filter_by(branch_id=branch_id)
-    for income in other_incomes.all():
-        db.session.add(CashbookEntry(
-            date=income.income_date,
-            particulars=f"Other Income: {income.description}",
-            debit=Decimal('0.00'),
-            credit=income.amount,
-            balance=Decimal('0.00'),
-            company_id=company_id,
-            branch_id=income.branch_id,
-            created_by=income.created_by_id
-        ))
-
-    # 4️⃣ Expenses → Debit
-    expenses = Expense.query.filter_by(company_id=company_id)
-    if branch_id:
-        expenses = expenses.filter_by(branch_id=branch_id)
-    for exp in expenses.all():
-        db.session.add(CashbookEntry(
-            date=exp.date,
-            particulars=f"Expense: {exp.description}",
-            debit=exp.amount,
-            credit=Decimal('0.00'),
-            balance=Decimal('0.00'),
-            company_id=company_id,
-            branch_id=exp.branch_id,
-            created_by=exp.created_by_id
-        ))
-
-    # 5️⃣ Bank transfers
-    bank_transfers = BankTransfer.query.filter_by(company_id=company_id, is_active=True)
-    if branch_id:
-        bank_transfers = bank_transfers.filter_by(branch_id=branch_id)
-    for bt in bank_transfers.all():
-        debit = bt.amount if bt.transfer_type == 'deposit' else Decimal('0.00')
-        credit = bt.amount if bt.transfer_type == 'withdrawal' else Decimal('0.00')
-        db.session.add(CashbookEntry(
-            date=bt.transfer_date,
-            particulars=f"Bank {bt.transfer_type.capitalize()} - Ref: {bt.reference or 'N/A'}",
-            debit=debit,
-            credit=credit,
-            balance=Decimal('0.00'),
-            company_id=company_id,
-            branch_id=bt.branch_id,
-            created_by=bt.created_by_id
-        ))
-
-    # 6️⃣ Savings transactions
-    savings_tx = SavingTransaction.query.join(SavingAccount, SavingTransaction.account_id == SavingAccount.id)\
-        .filter(SavingAccount.company_id == company_id)
-    if branch_id:
-        savings_tx = savings_tx.filter(SavingAccount.branch_id == branch_id)
-    for tx in savings_tx.all():
-        debit = tx.amount if tx.transaction_type == 'withdrawal' else Decimal('0.00')
-        credit = tx.amount if tx.transaction_type == 'deposit' else Decimal('0.00')
-        db.session.add(CashbookEntry(
-            date=tx.date,
-            particulars=f"Savings {tx.transaction_type} by {tx.account.borrower.name}",
-            debit=debit,
-            credit=credit,
-            balance=Decimal('0.00'),
-            company_id=company_id,
-            branch_id=tx.account.branch_id,
-            created_by=current_user.id
-        ))
+        markers = markers.filter_by(branch_id=branch_id)
+    markers.delete()
+    db.session.commit()
+
+    created_by = current_user.id if current_user.is_authenticated else None
+
+    # 2️ Loan repayments & disbursements from Ledger, processing fees,
+    # 3️⃣ Other Income, 4️⃣ Expenses, 5️⃣ Bank transfers, 6️⃣ Savings transactions
+    for source_type in CASHBOOK_SOURCES:
+        for source in scoped_cashbook_sources(source_type, company_id, branch_id):
+            row = build_cashbook_row(source_type, source, created_by=created_by)
+            if row is None or row['created_by'] is None:
+                continue
+            db.session.add(CashbookEntry(
+                source_type=source_type,
+                source_id=source.id,
+                balance=Decimal('0.00'),
+                **row
+            ))
 
     db.session.commit()
 
     # 🔹 Recalculate running balances
-    all_entries = CashbookEntry.query.filter_by(company_id=company_id)
-    if branch_id:
-        all_entries = all_entries.filter_by(branch_id=branch_id)
-    all_entries = all_entries.order_by(CashbookEntry.date.asc(), CashbookEntry.id.asc()).all()
-    recalc_balances(all_entries)
+    recalculate_balances(company_id, branch_id)
 
 
 @cashbook_bp.route('/', methods=['GET'])
 @login_required
 def view_cashbook():
-    page = request.args.get('page', 1, type=int)
     per_page = 50
     branch_id = session.get('active_branch_id')
 
-    # Always refresh cashbook from all sources
-    refresh_cashbook(current_user.company_id, branch_id)
+    # Stored balances run per branch; window mode and the company-wide view
+    # compute the page's running balance in SQL instead
+    stored = current_app.config.get('CASHBOOK_BALANCE_MODE') != 'window' and bool(branch_id)
+
+    # Bring keyed rows and dirty balances up to date (no full rebuild)
+    sync_cashbook(current_user.company_id, branch_id, balances=stored)
 
     query = CashbookEntry.query.filter_by(company_id=current_user.company_id)
     if branch_id:
@@ -304,32 +151,22 @@ def view_cashbook():
     selected_month = request.args.get('month', type=int)
     selected_year = request.args.get('year', type=int)
 
-    if filter_option == 'today':
-        query = query.filter(CashbookEntry.date == today.date())
-    elif filter_option == 'weekly':
-        start_week = today - timedelta(days=today.weekday())
-        end_week = start_week + timedelta(days=6)
-        query = query.filter(CashbookEntry.date.between(start_week.date(), end_week.date()))
-    elif filter_option == 'monthly' and selected_month and selected_year:
-        query = query.filter(
-            extract('month', CashbookEntry.date) == selected_month,
-            extract('year', CashbookEntry.date) == selected_year
-        )
-    elif filter_option == 'yearly' and selected_year:
-        query = query.filter(extract('year', CashbookEntry.date) == selected_year)
-    else:
-        # Manual day/month/year filter
-        if selected_day:
-            query = query.filter(extract('day', CashbookEntry.date) == selected_day)
-        if selected_month:
-            query = query.filter(extract('month', CashbookEntry.date) == selected_month)
-        if selected_year:
-            query = query.filter(extract('year', CashbookEntry.date) == selected_year)
-
-    total_entries = query.count()
-    paginated = query.order_by(CashbookEntry.date.desc(), CashbookEntry.id.desc())\
-                     .paginate(page=page, per_page=per_page, error_out=False)
-    entries = paginated.items
+    # Named period or manual day/month/year, as a date range on the index
+    query = filter_by_period(
+        query, CashbookEntry.date, filter_option,
+        day=selected_day, month=selected_month, year=selected_year, today=today.date()
+    )
+
+    # Keyset page on (date, id): no OFFSET scan, no COUNT(*)
+    page = keyset_page(
+        query, CashbookEntry.date, CashbookEntry.id,
+        after=request.args.get('after'), before=request.args.get('before'), per_page=per_page
+    )
+    entries = page.items
+
+    # 🔹 Running balance computed in SQL for this page only
+    if not stored:
+        entries = cashbook_lines(entries, current_user.company_id, branch_id)
 
     total_debit = sum(e.debit or Decimal('0.00') for e in entries)
     total_credit = sum(e.credit or Decimal('0.00') for e in entries)
@@ -345,8 +182,7 @@ def view_cashbook():
         total_debit=total_debit,
         total_credit=total_credit,
         final_balance=final_balance,
-        current_page=page,
-        total_pages=paginated.pages,
+        page=page,
         months=months,
         years=years,
         selected_day=selected_day,
@@ -355,54 +191,22 @@ def view_cashbook():
         filter=filter_option
     )
 
-from flask import send_file
-import io
-
 @cashbook_bp.route('/cashbook/export/<format>')
 @login_required
 def export_cashbook(format):
-    query = CashbookEntry.query.filter_by(company_id=current_user.company_id)
-
+    branch_id = None
     if current_user.branch_id and not current_user.has_role(['admin', 'accountant']):
-        query = query.filter_by(branch_id=current_user.branch_id)
-
-    entries = query.order_by(CashbookEntry.date, CashbookEntry.id).all()
-
-    data = [{
-        'Date': e.date.strftime('%Y-%m-%d'),
-        'Particulars': e.particulars,
-        'Debit': e.debit,
-        'Credit': e.credit,
-        'Balance': e.balance
-    } for e in entries]
-
-    df = pd.DataFrame(data)
-
-    if format == 'excel':
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Cashbook')
-        output.seek(0)
-        return send_file(output, download_name='cashbook.xlsx', as_attachment=True)
-
-    elif format == 'pdf':
-        from xhtml2pdf import pisa
-        from flask import render_template_string
-
-        html = render_template_string("""
-        <html><body><h3>Cashbook Export</h3><table border="1" cellpadding="5">
-        <tr><th>Date</th><th>Particulars</th><th>Debit</th><th>Credit</th><th>Balance</th></tr>
-        {% for e in entries %}
-        <tr><td>{{ e['Date'] }}</td><td>{{ e['Particulars'] }}</td><td>{{ e['Debit'] }}</td>
-        <td>{{ e['Credit'] }}</td><td>{{ e['Balance'] }}</td></tr>
-        {% endfor %}
-        </table></body></html>
-        """, entries=data)
-
-        pdf = io.BytesIO()
-        pisa.CreatePDF(html, dest=pdf)
-        pdf.seek(0)
-        return send_file(pdf, download_name='cashbook.pdf', as_attachment=True)
-
-    flash('Invalid format selected.', 'danger')
-    return redirect(url_for('cashbook.view_cashbook'))
+        branch_id = current_user.branch_id
+
+    if format == 'csv':
+        # Streamed straight from the query, row by row
+        query = cashbook_export_query(current_user.company_id, branch_id)
+        return csv_response('cashbook.csv', CASHBOOK_COLUMNS, cashbook_export_rows(stream_rows(query)))
+
+    if format not in ('excel', 'pdf'):
+        flash('Invalid format selected.', 'danger')
+        return redirect(url_for('cashbook.view_cashbook'))
+
+    # Built by the export worker; the user waits on the job page
+    job = enqueue_export('cashbook', format, current_user, branch_id=branch_id)
+    return redirect(url_for('exports.job_status', job_id=job.id))
@@ -4,12 +4,27 @@ from models import CashbookEntry, OtherIncome, Branch
 from datetime import datetime, timedelta
 from calendar import month_name
 from utils.decorators import roles_required
+from kpi_rollup import daily_kpi_series
 
 cashflow_bp = Blueprint('cashflow', __name__)
 
 def pct_change(current, previous):
     return round(((current - previous) / previous * 100), 2) if previous else None
 
+def cash_flow_chart(company_id, branch_id=None, start=None, end=None):
+    """Daily inflow/outflow/net series read from the KPI rollups."""
+    rows = [
+        r for r in daily_kpi_series(company_id, branch_id, start, end, metrics=('cash_in', 'cash_out', 'income'))
+        if r.cash_in or r.cash_out or r.income
+    ]
+
+    chart_dates = [r.day.strftime('%Y-%m-%d') for r in rows]
+    chart_inflows = [float(r.cash_in + r.income) for r in rows]
+    chart_outflows = [float(r.cash_out) for r in rows]
+    chart_net = [i - o for i, o in zip(chart_inflows, chart_outflows)]
+
+    return chart_dates, chart_inflows, chart_outflows, chart_net
+
 @cashflow_bp.route('/cash-flow')
 @login_required
 @roles_required('Admin')
@@ -94,25 +109,12 @@ def view_cash_flow():
     out_change = pct_change(total_out, prev_out)
     net_change = pct_change(net_flow, prev_in - prev_out)
 
-    # --- Chart data ---
-    daily_data = {}
-    for entry in cashbook_entries:
-        date_str = entry.date.strftime('%Y-%m-%d')
-        daily_data.setdefault(date_str, {'in':0,'out':0,'net':0})
-        daily_data[date_str]['in'] += entry.credit
-        daily_data[date_str]['out'] += entry.debit
-        daily_data[date_str]['net'] = daily_data[date_str]['in'] - daily_data[date_str]['out']
-
-    for item in other_income_entries:
-        date_str = item.income_date.strftime('%Y-%m-%d')
-        daily_data.setdefault(date_str, {'in':0,'out':0,'net':0})
-        daily_data[date_str]['in'] += item.amount
-        daily_data[date_str]['net'] = daily_data[date_str]['in'] - daily_data[date_str]['out']
-
-    chart_dates = sorted(daily_data.keys())
-    chart_inflows = [daily_data[d]['in'] for d in chart_dates]
-    chart_outflows = [daily_data[d]['out'] for d in chart_dates]
-    chart_net = [daily_data[d]['net'] for d in chart_dates]
+    # --- Chart data (daily rollups) ---
+    chart_dates, chart_inflows, chart_outflows, chart_net = cash_flow_chart(
+        current_user.company_id,
+        branch_id if not current_user.is_superuser else None,
+        start, end
+    )
 
     # Months & years for dropdown
     months = list(enumerate(month_name))[1:]
@@ -221,20 +223,12 @@ def cash_flow_data():
             'outflow': 0
         })
 
-    # Chart data
-    daily_data = {}
-    for row in table_data:
-        d = row['date']
-        if d not in daily_data:
-            daily_data[d] = {'in': 0, 'out': 0, 'net': 0}
-        daily_data[d]['in'] += row['inflow']
-        daily_data[d]['out'] += row['outflow']
-        daily_data[d]['net'] = daily_data[d]['in'] - daily_data[d]['out']
-
-    chart_dates = sorted(daily_data.keys())
-    chart_inflows = [daily_data[d]['in'] for d in chart_dates]
-    chart_outflows = [daily_data[d]['out'] for d in chart_dates]
-    chart_net = [daily_data[d]['net'] for d in chart_dates]
+    # Chart data (daily rollups)
+    chart_dates, chart_inflows, chart_outflows, chart_net = cash_flow_chart(
+        current_user.company_id,
+        branch_id if not current_user.is_superuser else None,
+        start, end
+    )
 
     return jsonify({
         'total_in': total_in,
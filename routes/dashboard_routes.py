@@ -8,6 +8,9 @@ from flask import session
 import pytz
 from extensions import csrf
 from decimal import Decimal, InvalidOperation
+from dashboard_cache import cached_dashboard_json
+from utils.branch_filter import validated_branch
+from dashboard_helpers import loan_kpis, repayment_kpis, monthly_loan_series, as_float
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
@@ -17,29 +20,23 @@ def set_active_branch_context():
         # Get the active branch from session or user's assigned branch
         active_branch_id = session.get('active_branch_id', current_user.branch_id)
 
-        # Validate branch is not deleted
-        branch = Branch.query.filter_by(
-            id=active_branch_id,
-            company_id=current_user.company_id
-        ).filter(Branch.deleted_at.is_(None)).first()
+        # Validate branch is not deleted (cached per request and per session)
+        branch = validated_branch(active_branch_id)
+
+        if not branch:
+            # Fallback to user's assigned branch if available
+            branch = validated_branch(current_user.branch_id)
 
         if branch:
-            session['active_branch_id'] = branch.id
-            session['active_branch_name'] = branch.name  # Add branch name to session
+            # Only touch the session when something changed
+            if session.get('active_branch_id') != branch['id']:
+                session['active_branch_id'] = branch['id']
+            if session.get('active_branch_name') != branch['name']:
+                session['active_branch_name'] = branch['name']  # Add branch name to session
         else:
-            # Fallback to user's assigned branch if available
-            fallback_branch = Branch.query.filter_by(
-                id=current_user.branch_id,
-                company_id=current_user.company_id
-            ).filter(Branch.deleted_at.is_(None)).first()
-
-            if fallback_branch:
-                session['active_branch_id'] = fallback_branch.id
-                session['active_branch_name'] = fallback_branch.name  # Add fallback branch name
-            else:
-                # No valid branch, clear the session keys
-                session.pop('active_branch_id', None)
-                session.pop('active_branch_name', None)
+            # No valid branch, clear the session keys
+            session.pop('active_branch_id', None)
+            session.pop('active_branch_name', None)
 
 @dashboard_bp.route('/switch-branch/<int:branch_id>', methods=['POST'])
 @login_required
@@ -132,45 +129,18 @@ def index():
 def dashboard():
     active_branch_id = session.get('active_branch_id')
     today = date.today()
-    now = datetime.now()
-    current_year = now.year
-    current_month = now.month
 
-    # Start/end of today for SQLAlchemy comparisons
-    today_start = datetime.combine(today, datetime.min.time())
+    # End of today for SQLAlchemy comparisons
     today_end = datetime.combine(today, datetime.max.time())
 
-    # Filter loans for this company (and branch if set)
-    loan_query = Loan.query.filter_by(company_id=current_user.company_id)
-    if active_branch_id:
-        loan_query = loan_query.filter_by(branch_id=active_branch_id)
-    loans = loan_query.all()
+    # --- Borrowers, disbursed, balances, overdue: one aggregate row ---
+    kpis = loan_kpis(current_user.company_id, active_branch_id, today)
 
-    if not loans:
+    if not kpis['total_loans']:
         return render_template('dashboard/dashboard.html', message="No loans found for your company.")
 
-    # --- Borrowers ---
-    borrowers_today = len({l.borrower_name for l in loans if l.date.date() == today})
-    borrowers_month = len({l.borrower_name for l in loans if l.date.year == current_year and l.date.month == current_month})
-    borrowers_year = len({l.borrower_name for l in loans if l.date.year == current_year})
-    total_borrowers = len({l.borrower_name for l in loans})
-
-    # --- Disbursed ---
-    disbursed_today = sum(l.amount_borrowed for l in loans if l.date.date() == today)
-    disbursed_month = sum(l.amount_borrowed for l in loans if l.date.year == current_year and l.date.month == current_month)
-    disbursed_year = sum(l.amount_borrowed for l in loans if l.date.year == current_year)
-    total_disbursed = sum(l.amount_borrowed for l in loans)
-
     # --- Repaid ---
-    repayments_query = LoanRepayment.query.join(Loan).filter(Loan.company_id == current_user.company_id)
-    if active_branch_id:
-        repayments_query = repayments_query.filter(Loan.branch_id == active_branch_id)
-    repayments = repayments_query.all()
-
-    repaid_today = sum(r.amount_paid for r in repayments if r.date_paid.date() == today)
-    collections_month = sum(r.amount_paid for r in repayments if r.date_paid.year == current_year and r.date_paid.month == current_month)
-    collections_year = sum(r.amount_paid for r in repayments if r.date_paid.year == current_year)
-    total_repaid = sum(r.amount_paid for r in repayments)
+    repaid = repayment_kpis(current_user.company_id, active_branch_id, today)
 
     # --- Overdue Loans ---
     overdue_loans_query = Loan.query.filter(
@@ -182,67 +152,40 @@ def dashboard():
         overdue_loans_query = overdue_loans_query.filter(Loan.branch_id == active_branch_id)
     overdue_loans = overdue_loans_query.order_by(Loan.due_date.asc()).limit(5).all()
 
-    overdue_today = len([l for l in loans if l.remaining_balance > 0 and l.due_date <= today_end and l.due_date >= today_start])
-    overdue_month = len([l for l in loans if l.remaining_balance > 0 and l.due_date.year == current_year and l.due_date.month == current_month])
-    overdue_year = len([l for l in loans if l.remaining_balance > 0 and l.due_date.year == current_year])
-
-    # Total overdue loans (all, not limited)
-    total_overdue = len([l for l in loans if l.remaining_balance > 0])
-
     # --- Monthly chart data ---
-    monthly_data = defaultdict(lambda: {
-        "total_disbursed": 0,
-        "total_paid": 0,
-        "total_remaining": 0,
-        "total_interest": 0
-    })
-
-    for loan in loans:
-        month_key = loan.date.strftime('%Y-%m')
-        monthly_data[month_key]["total_disbursed"] += float(loan.amount_borrowed)
-        monthly_data[month_key]["total_paid"] += float(loan.amount_paid)
-        monthly_data[month_key]["total_remaining"] += float(loan.remaining_balance)
-        monthly_data[month_key]["total_interest"] += float(loan.total_due - loan.amount_borrowed if hasattr(loan, "total_due") else loan.amount_borrowed * Decimal('0.2'))
-
-    sorted_months = sorted(monthly_data.keys())
-    months = [datetime.strptime(m, "%Y-%m").strftime("%b %Y") for m in sorted_months]
-    loans_disbursed = [monthly_data[m]["total_disbursed"] for m in sorted_months]
-    loans_repaid = [monthly_data[m]["total_paid"] for m in sorted_months]
-    remaining_balances = [monthly_data[m]["total_remaining"] for m in sorted_months]
-    interest_earned = [monthly_data[m]["total_interest"] for m in sorted_months]
+    series = monthly_loan_series(current_user.company_id, active_branch_id)
 
     # --- Last update ---
-    latest_loan = max(loans, key=lambda l: l.date, default=None)
-    if latest_loan:
+    if kpis['last_loan_date']:
         local_tz = pytz.timezone("Africa/Kampala")
-        local_date = latest_loan.date.astimezone(local_tz)
+        local_date = kpis['last_loan_date'].astimezone(local_tz)
         last_update = local_date.strftime("%d %b %Y, %I:%M %p")
     else:
         last_update = "No data"
 
     return render_template(
         'dashboard/dashboard.html',
-        total_borrowers=total_borrowers,
-        borrowers_today=borrowers_today,
-        borrowers_month=borrowers_month,
-        borrowers_year=borrowers_year,
-        total_disbursed=total_disbursed,
-        disbursed_today=disbursed_today,
-        disbursed_month=disbursed_month,
-        disbursed_year=disbursed_year,
-        total_repaid=total_repaid,
-        repaid_today=repaid_today,
-        collections_month=collections_month,
-        collections_year=collections_year,
+        total_borrowers=kpis['total_borrowers'],
+        borrowers_today=kpis['borrowers_today'],
+        borrowers_month=kpis['borrowers_month'],
+        borrowers_year=kpis['borrowers_year'],
+        total_disbursed=kpis['total_disbursed'],
+        disbursed_today=kpis['disbursed_today'],
+        disbursed_month=kpis['disbursed_month'],
+        disbursed_year=kpis['disbursed_year'],
+        total_repaid=repaid['total_repaid'],
+        repaid_today=repaid['repaid_today'],
+        collections_month=repaid['collections_month'],
+        collections_year=repaid['collections_year'],
         overdue_loans=overdue_loans,
-        overdue_today=overdue_today,
-        overdue_month=overdue_month,
-        overdue_year=overdue_year,
-        months=months,
-        loans_disbursed=loans_disbursed,
-        loans_repaid=loans_repaid,
-        remaining_balances=remaining_balances,
-        interest_earned=interest_earned,
+        overdue_today=kpis['overdue_today'],
+        overdue_month=kpis['overdue_month'],
+        overdue_year=kpis['overdue_year'],
+        months=series['months'],
+        loans_disbursed=series['loans_disbursed'],
+        loans_repaid=series['loans_repaid'],
+        remaining_balances=series['remaining_balances'],
+        interest_earned=series['interest_earned'],
         last_update=last_update,
         user=current_user,
         company=current_user.company
@@ -250,137 +193,54 @@ def dashboard():
 
 @dashboard_bp.route('dashboard/loan_data')
 @login_required
+@cached_dashboard_json('loan_data')
 def loan_data():
-    today = date.today()
-    now = datetime.now()
-    current_year = now.year
-    current_month = now.month
-
-    today_start = datetime.combine(today, datetime.min.time())
-    today_end = datetime.combine(today, datetime.max.time())
-
     branch_id = session.get('active_branch_id')
 
-    # Filter loans
-    loan_query = Loan.query.filter_by(company_id=current_user.company_id)
-    if branch_id:
-        loan_query = loan_query.filter_by(branch_id=branch_id)
-    loans = loan_query.all()
-
-    if not loans:
-        return jsonify({})  # empty fallback
-
-    # Borrowers
-    borrowers_today = len({l.borrower_name for l in loans if l.date.date() == today})
-    borrowers_month = len({l.borrower_name for l in loans if l.date.year == current_year and l.date.month == current_month})
-    borrowers_year = len({l.borrower_name for l in loans if l.date.year == current_year})
-
-    # Disbursed
-    disbursed_today = sum(l.amount_borrowed for l in loans if l.date.date() == today)
-    disbursed_month = sum(l.amount_borrowed for l in loans if l.date.year == current_year and l.date.month == current_month)
-    disbursed_year = sum(l.amount_borrowed for l in loans if l.date.year == current_year)
-    total_borrowed = sum(l.amount_borrowed for l in loans)
-
-    # Repaid
-    repayments_query = LoanRepayment.query.join(Loan).filter(Loan.company_id == current_user.company_id)
-    if branch_id:
-        repayments_query = repayments_query.filter(Loan.branch_id == branch_id)
-    repayments = repayments_query.all()
-
-    repaid_today = sum(r.amount_paid for r in repayments if r.date_paid.date() == today)
-    collections_month = sum(r.amount_paid for r in repayments if r.date_paid.year == current_year and r.date_paid.month == current_month)
-    collections_year = sum(r.amount_paid for r in repayments if r.date_paid.year == current_year)
-    total_paid = sum(r.amount_paid for r in repayments)
-
-    # Overdue
-    overdue_today = len([l for l in loans if l.remaining_balance > 0 and l.due_date <= today_end and l.due_date >= today_start])
-    overdue_month = len([l for l in loans if l.remaining_balance > 0 and l.due_date.year == current_year and l.due_date.month == current_month])
-    overdue_year = len([l for l in loans if l.remaining_balance > 0 and l.due_date.year == current_year])
-    total_remaining = sum(l.remaining_balance for l in loans)
-
-    # Monthly chart data
-    monthly_data = defaultdict(lambda: {
-        "total_disbursed": 0,
-        "total_paid": 0,
-        "total_remaining": 0,
-        "total_interest": 0
-    })
-    for loan in loans:
-        month_key = loan.date.strftime('%Y-%m')
-        monthly_data[month_key]["total_disbursed"] += float(loan.amount_borrowed)
-        monthly_data[month_key]["total_paid"] += float(loan.amount_paid)
-        monthly_data[month_key]["total_remaining"] += float(loan.remaining_balance)
-        monthly_data[month_key]["total_interest"] += float(loan.total_due - loan.amount_borrowed if hasattr(loan, "total_due") else loan.amount_borrowed * Decimal('0.2'))
-
-    sorted_months = sorted(monthly_data.keys())
-    months = [datetime.strptime(m, "%Y-%m").strftime("%b %Y") for m in sorted_months]
-    loans_disbursed = [monthly_data[m]["total_disbursed"] for m in sorted_months]
-    loans_repaid = [monthly_data[m]["total_paid"] for m in sorted_months]
-    remaining_balances = [monthly_data[m]["total_remaining"] for m in sorted_months]
-    interest_earned = [monthly_data[m]["total_interest"] for m in sorted_months]
-
-    return jsonify({
-        "borrowers_today": borrowers_today,
-        "borrowers_month": borrowers_month,
-        "borrowers_year": borrowers_year,
-        "disbursed_today": float(disbursed_today),
-        "disbursed_month": float(disbursed_month),
-        "disbursed_year": float(disbursed_year),
-        "repaid_today": float(repaid_today),
-        "collections_month": float(collections_month),
-        "collections_year": float(collections_year),
-        "overdue_today": overdue_today,
-        "overdue_month": overdue_month,
-        "overdue_year": overdue_year,
-        "total_borrowed": float(total_borrowed),
-        "total_paid": float(total_paid),
-        "total_remaining": float(total_remaining),
-        "months": months,
-        "loans_disbursed": loans_disbursed,
-        "loans_repaid": loans_repaid,
-        "remaining_balances": remaining_balances,
-        "interest_earned": interest_earned
-    })
+    kpis = loan_kpis(current_user.company_id, branch_id)
+    if not kpis['total_loans']:
+        return {}  # empty fallback
+
+    repaid = repayment_kpis(current_user.company_id, branch_id)
+    series = monthly_loan_series(current_user.company_id, branch_id)
+
+    return {
+        "borrowers_today": kpis['borrowers_today'],
+        "borrowers_month": kpis['borrowers_month'],
+        "borrowers_year": kpis['borrowers_year'],
+        "disbursed_today": as_float(kpis['disbursed_today']),
+        "disbursed_month": as_float(kpis['disbursed_month']),
+        "disbursed_year": as_float(kpis['disbursed_year']),
+        "repaid_today": as_float(repaid['repaid_today']),
+        "collections_month": as_float(repaid['collections_month']),
+        "collections_year": as_float(repaid['collections_year']),
+        "overdue_today": kpis['overdue_today'],
+        "overdue_month": kpis['overdue_month'],
+        "overdue_year": kpis['overdue_year'],
+        "total_borrowed": as_float(kpis['total_disbursed']),
+        "total_paid": as_float(repaid['total_repaid']),
+        "total_remaining": as_float(kpis['total_remaining']),
+        **series
+    }
 
 @dashboard_bp.route('/summary_data')
 @login_required
+@cached_dashboard_json('summary_data')
 def summary_data():
     branch_id = session.get('active_branch_id')  # 👈 Get active branch from session
 
-    # Filter loans by company (and branch if applicable)
-    loan_query = Loan.query.filter_by(company_id=current_user.company_id)
-    if branch_id:
-        loan_query = loan_query.filter_by(branch_id=branch_id)
-
-    loans = loan_query.all()
-
-    if not loans:
-        return jsonify({
-            "total_borrowers": total_borrowers,
-            "total_loans": total_loans,
-            "total_borrowed": float(total_borrowed),
-            "total_paid": float(total_paid),
-            "total_remaining": float(total_remaining),
-            "total_interest": float(total_interest),
-            "last_updated": last_updated
-        })
-
-    total_borrowers = len(set(loan.borrower_name for loan in loans))
-    total_loans = len(loans)
-    total_borrowed = float(sum(l.amount_borrowed for l in loans))
-    total_paid = sum(l.amount_paid for l in loans)
-    total_remaining = sum(l.remaining_balance for l in loans)
-    total_interest = sum(l.amount_borrowed * 0.2 for l in loans)
-
-    last_loan = max(loans, key=lambda l: l.date)
-    last_updated = last_loan.date.strftime("%B %d, %Y")
-
-    return jsonify({
-        "total_borrowers": total_borrowers,
-        "total_loans": total_loans,
-        "total_borrowed": total_borrowed,
-        "total_paid": total_paid,
-        "total_remaining": total_remaining,
-        "total_interest": total_interest,
+    # Company (and branch) totals in a single aggregate query
+    kpis = loan_kpis(current_user.company_id, branch_id)
+
+    last_loan_date = kpis['last_loan_date']
+    last_updated = last_loan_date.strftime("%B %d, %Y") if last_loan_date else None
+
+    return {
+        "total_borrowers": kpis['total_borrowers'],
+        "total_loans": kpis['total_loans'],
+        "total_borrowed": as_float(kpis['total_disbursed']),
+        "total_paid": as_float(kpis['total_paid']),
+        "total_remaining": as_float(kpis['total_remaining']),
+        "total_interest": as_float(kpis['total_interest']),
         "last_updated": last_updated
-    })
+    }
@@ -2,10 +2,6 @@ from flask import current_app
 import os
 import psycopg
 from flask import Blueprint, redirect, request, session, url_for, flash
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import google.oauth2.credentials
 from models import db, Company
 from flask_login import current_user, login_required
 from functools import wraps
@@ -38,6 +34,8 @@ def test_env():
 @login_required
 @company_admin_required
 def authorize():
+    from google_auth_oauthlib.flow import Flow
+
     company = Company.query.get(current_user.company_id)
     if not company:
         flash("Company not found.", "danger")
@@ -80,6 +78,8 @@ def authorize():
 @login_required
 @company_admin_required
 def callback():
+    from google_auth_oauthlib.flow import Flow
+
     if "state" not in session:
         flash("Session expired. Please try linking again.", "danger")
         return redirect(url_for("dashboard.index"))
@@ -135,6 +135,10 @@ def callback():
 @login_required
 @company_admin_required
 def upload_backup():
+    from googleapiclient.discovery import build
+    from googleapiclient.http import MediaFileUpload
+    import google.oauth2.credentials
+
     company_id = current_user.company_id
 
     # ✅ Get DB URL from Flask config or env
@@ -7,8 +7,9 @@ from datetime import datetime
 from models import CashbookEntry
 from extensions import csrf
 from decimal import Decimal, InvalidOperation
-from routes.cashbook_routes import add_cashbook_entry, refresh_cashbook
+from cashbook_helpers import sync_cashbook_source, remove_cashbook_source
 from utils.decorators import roles_required
+from keyset import keyset_page
 
 expenses_bp = Blueprint('expenses', __name__, url_prefix='/expenses')
 
@@ -21,8 +22,11 @@ def all_expenses():
     if branch_id:
         query = query.filter_by(branch_id=branch_id)
 
-    expenses = query.order_by(Expense.date.desc()).all()
-    return render_template('expenses/all_expenses.html', expenses=expenses)
+    page = keyset_page(
+        query, Expense.date, Expense.id,
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return render_template('expenses/all_expenses.html', expenses=page.items, page=page)
 
 @csrf.exempt
 @expenses_bp.route('/add', methods=['GET', 'POST'])
@@ -52,17 +56,10 @@ def add_expense():
             created_by_id=current_user.id
         )
         db.session.add(expense)
+        db.session.flush()
 
         # 3️⃣ Add to cashbook
-        add_cashbook_entry(
-            date=date,
-            particulars=f"Expense: {description}",
-            debit=amount,
-            credit=Decimal('0.00'),
-            company_id=current_user.company_id,
-            branch_id=branch_id,
-            created_by=current_user.id
-        )
+        sync_cashbook_source('expense', expense)
 
         db.session.commit()
         flash("Expense recorded successfully.", "success")
@@ -95,11 +92,10 @@ def edit_expense(expense_id):
         request.form['date'], '%Y-%m-%d'
     )
 
+    # 🔄 Update only this expense's cashbook row
+    sync_cashbook_source('expense', expense)
     db.session.commit()
 
-    # 🔄 Ledger-safe rebuild
-    refresh_cashbook(current_user.company_id, branch_id)
-
     flash('Expense updated successfully.', 'success')
     return redirect(url_for('expenses.all_expenses'))
 
@@ -116,12 +112,10 @@ def delete_expense(expense_id):
         branch_id=branch_id
     ).first_or_404()
 
+    remove_cashbook_source('expense', expense.id)
     db.session.delete(expense)
     db.session.commit()
 
-    # 🔄 Ledger-safe rebuild
-    refresh_cashbook(current_user.company_id, branch_id)
-
     flash('Expense deleted successfully.', 'success')
     return redirect(url_for('expenses.all_expenses'))
 
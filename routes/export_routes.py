@@ -0,0 +1,50 @@
+from flask import Blueprint, render_template, jsonify, send_file, abort
+from flask_login import login_required, current_user
+from extensions import db
+from models import ExportJob
+
+exports_bp = Blueprint('exports', __name__, url_prefix='/exports')
+
+
+def _own_job(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+    return job
+
+
+@exports_bp.route('/')
+@login_required
+def my_exports():
+    jobs = ExportJob.query.filter_by(user_id=current_user.id)\
+        .order_by(ExportJob.created_at.desc()).limit(20).all()
+    return render_template('exports/my_exports.html', jobs=jobs)
+
+
+@exports_bp.route('/<int:job_id>')
+@login_required
+def job_status(job_id):
+    return render_template('exports/job_status.html', job=_own_job(job_id))
+
+
+@exports_bp.route('/<int:job_id>/status')
+@login_required
+def job_status_data(job_id):
+    job = _own_job(job_id)
+    return jsonify({
+        'status': job.status,
+        'progress': job.progress or 0,
+        'filename': job.filename,
+        'error': job.error,
+    })
+
+
+@exports_bp.route('/<int:job_id>/download')
+@login_required
+def download_export(job_id):
+    job = _own_job(job_id)
+    if job.status != 'done' or not job.file_path:
+        abort(404)
+
+    # Streamed from disk, never loaded into the web worker
+    return send_file(job.file_path, as_attachment=True, download_name=job.filename)
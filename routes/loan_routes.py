@@ -1,5 +1,5 @@
 # techlend/routes/loan_routes.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from utils.decorators import roles_required
 from forms import VoucherForm
@@ -11,13 +11,14 @@ from datetime import datetime, timedelta, date
 from utils import get_company_filter
 from models import CashbookEntry
 from utils.branch_filter import filter_by_active_branch
+from utils.period_filter import filter_by_period
+from search_index import apply_search, loan_search, typeahead_loans
+from keyset import keyset_page
 from dateutil.relativedelta import relativedelta
 from sqlalchemy import extract, func
 import io
 from flask import send_file
-import pandas as pd
 from flask import render_template, make_response, current_app
-from xhtml2pdf import pisa
 from io import BytesIO
 import os
 from extensions import csrf
@@ -25,12 +26,26 @@ from zoneinfo import ZoneInfo
 from utils.time_helpers import today
 from utils.utils import sum_paid
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
-from weasyprint import HTML, CSS
-from cashbook_helpers import ledger_to_cashbook, recalculate_balances
-from routes.cashbook_routes import add_cashbook_entry
+from pdf_service import BASE_CSS, render_pdf_template, pdf_response
+from export_jobs import (
+    enqueue_export, csv_response, stream_rows, loans_export_query, loans_export_rows, LOAN_COLUMNS
+)
+from cashbook_helpers import (
+    ledger_to_cashbook, recalculate_balances, sync_cashbook_source,
+    remove_cashbook_source, sync_cashbook_loan, remove_cashbook_loan
+)
+from kpi_rollup import mark_loan_kpi_days
+from arrears_report import arrears_page, arrears_totals
+from par_report import PAR_BUCKETS, PAR_THRESHOLDS, par_report, par_trend
+from loan_allocation import (
+    FIXED_KINDS, allocate_ledger, allocate_row, ledger_kind, loan_snapshot, state_from_row
+)
 
 loan_bp = Blueprint('loan', __name__)
 
+# Rows returned by the loan search boxes
+SEARCH_RESULTS_LIMIT = 20
+
 # View all approved loans
 from sqlalchemy import extract
 
@@ -55,30 +70,20 @@ def view_loans():
     year = request.args.get('year')
 
     if search:
-        query = query.filter(
-            (Loan.loan_id.ilike(f"%{search}%")) | 
-            (Loan.borrower_name.ilike(f"%{search}%"))
-        )
-
-    if month:
-        try:
-            month_int = int(month)
-            query = query.filter(extract('month', Loan.date) == month_int)
-        except ValueError:
-            pass
-
-    if year:
-        try:
-            year_int = int(year)
-            query = query.filter(extract('year', Loan.date) == year_int)
-        except ValueError:
-            pass
-
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-
-    pagination = query.order_by(Loan.date.desc()).paginate(page=page, per_page=per_page)
-    loans = pagination.items
+        # Trigram/FTS-backed match (see search_index)
+        condition, _ = loan_search(search)
+        query = query.filter(condition)
+
+    # Month/year as a date range so the (company, branch, date) index is used
+    query = filter_by_period(query, Loan.date, month=month, year=year)
+
+    # Keyset page on (date, id); the row count is the planner's estimate
+    page = keyset_page(
+        query, Loan.date, Loan.id,
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=20, count=True
+    )
+    loans = page.items
 
     totals_query = query.with_entities(
         func.coalesce(func.sum(Loan.amount_borrowed), 0),
@@ -96,7 +101,7 @@ def view_loans():
         'remaining_balance': totals_query[4],
     }
 
-    return render_template('loans/view_all_loans.html', loans=loans, totals=totals, pagination=pagination)
+    return render_template('loans/view_all_loans.html', loans=loans, totals=totals, page=page)
 
 @loan_bp.route('/loans/search', methods=['GET'])
 @login_required
@@ -107,145 +112,113 @@ def search_loans():
 
     try:
         if query:
-            # cast integer ID to string for ilike
-            results = Loan.query.join(Borrower).filter(
-                Loan.status == "Approved",
-                (db.cast(Loan.id, db.String).ilike(f"%{query}%")) |
-                (Borrower.name.ilike(f"%{query}%")) |
-                (Borrower.phone.ilike(f"%{query}%"))
-            ).all()
+            # Ranked and limited; matches loan number, borrower name/phone or loan id
+            company_id = None if current_user.is_superuser else current_user.company_id
+            branch_id = None if current_user.is_superuser else session.get('active_branch_id')
+            results = typeahead_loans(
+                company_id, query,
+                branch_id=branch_id, limit=SEARCH_RESULTS_LIMIT, approval_status='approved'
+            )
     except Exception as e:
         print("Loan search error:", e)
         return jsonify([])  # return empty JSON to prevent JS crash
 
     # return JSON
-    return jsonify([
-        {
-            "id": loan.id,
-            "borrower": loan.borrower.name,
-            "phone": loan.borrower.phone,
-            "amount": loan.amount_borrowed,
-            "due_date": loan.due_date.strftime("%Y-%m-%d") if loan.due_date else "N/A"
-        } for loan in results
-    ])
-
-from decimal import Decimal
-def recalc_repayment_balances(loan_id):
-    from decimal import Decimal
-    from models import Loan, LedgerEntry
-    from extensions import db
+    return jsonify(results)
 
+def recalc_repayment_balances(loan_id):
+    """
+    Re-run the repayment waterfall over a loan's whole ledger.
+    Only (id, date, particulars, payment) are read; allocation is done by the
+    pure loan_allocation engine and the results are written back in bulk.
+    """
     loan = Loan.query.get(loan_id)
     if not loan:
         return
 
-    # 🔹 INITIAL BALANCES
-    principal_balance = Decimal(loan.amount_borrowed or 0)
-    interest_balance = (
-        Decimal(loan.amount_borrowed or 0)
-        * Decimal(loan.interest_rate or 0)
-        / Decimal('100')
-    )
-    cumulative_interest_balance = Decimal('0.00')
-    total_paid = Decimal('0.00')
-
-    # 🔹 FETCH LEDGER IN ORDER
-    entries = (
-        LedgerEntry.query
-        .filter_by(loan_id=loan.id)
+    # 🔹 FETCH LEDGER IN ORDER (compact rows, no ORM objects)
+    ledger = (
+        db.session.query(LedgerEntry.id, LedgerEntry.date, LedgerEntry.particulars, LedgerEntry.payment)
+        .filter(LedgerEntry.loan_id == loan.id)
         .order_by(LedgerEntry.date.asc(), LedgerEntry.id.asc())
         .all()
     )
 
-    for entry in entries:
-        p = (entry.particulars or "").lower().strip()
-
-        # 🔒 IMMUTABLE ENTRIES
-        if p in ('loan application', 'loan approved', 'loan disbursed'):
-            entry.principal = Decimal(loan.amount_borrowed or 0)
-            entry.interest = (
-                Decimal(loan.amount_borrowed or 0)
-                * Decimal(loan.interest_rate or 0)
-                / Decimal('100')
-                if p != 'loan disbursed'
-                else Decimal('0.00')
-            )
-            entry.cumulative_interest = Decimal('0.00')
-
-            entry.principal_balance = principal_balance
-            entry.interest_balance = interest_balance
-            entry.cumulative_interest_balance = cumulative_interest_balance
-            entry.running_balance = (
-                principal_balance
-                + interest_balance
-                + cumulative_interest_balance
-            )
+    allocated, state = allocate_ledger(
+        loan.amount_borrowed,
+        loan.interest_rate,
+        [(row.date, ledger_kind(row.particulars), row.payment) for row in ledger]
+    )
 
-            db.session.add(entry)
-            continue
-
-        # 🔁 RESET ALLOCATIONS
-        entry.principal = Decimal('0.00')
-        entry.interest = Decimal('0.00')
-        entry.cumulative_interest = Decimal('0.00')
-
-        # 🔴 CUMULATIVE INTEREST ENTRY
-        if p == 'cumulative interest':
-            ci_amount = Decimal(entry.payment or 0)
-            cumulative_interest_balance += ci_amount
-            entry.cumulative_interest = ci_amount
-
-        # 🟢 LOAN REPAYMENT ENTRY
-        elif p == 'loan repayment':
-            payment = Decimal(entry.payment or 0)
-
-            # 1️⃣ Pay cumulative interest
-            ci_payment = min(payment, cumulative_interest_balance)
-            cumulative_interest_balance -= ci_payment
-            payment -= ci_payment
-            entry.cumulative_interest = ci_payment
-
-            # 2️⃣ Pay interest
-            interest_payment = min(payment, interest_balance)
-            interest_balance -= interest_payment
-            payment -= interest_payment
-            entry.interest = interest_payment
-
-            # 3️⃣ Pay principal
-            principal_payment = min(payment, principal_balance)
-            principal_balance -= principal_payment
-            payment -= principal_payment
-            entry.principal = principal_payment
-
-            total_paid += ci_payment + interest_payment + principal_payment
-
-        # 🔢 CLAMP & UPDATE BALANCES
-        principal_balance = max(principal_balance, Decimal('0.00'))
-        interest_balance = max(interest_balance, Decimal('0.00'))
-        cumulative_interest_balance = max(cumulative_interest_balance, Decimal('0.00'))
-
-        entry.principal_balance = principal_balance
-        entry.interest_balance = interest_balance
-        entry.cumulative_interest_balance = cumulative_interest_balance
-        entry.running_balance = (
-            principal_balance
-            + interest_balance
-            + cumulative_interest_balance
+    # 🔹 BULK WRITE ALLOCATION + BALANCE COLUMNS
+    if ledger:
+        db.session.execute(
+            db.update(LedgerEntry),
+            [dict(id=row.id, **result._asdict()) for row, result in zip(ledger, allocated)]
         )
 
-        db.session.add(entry)
-
     # 🔹 UPDATE LOAN SNAPSHOT
-    loan.amount_paid = total_paid
-    loan.remaining_balance = (
-        principal_balance
-        + interest_balance
-        + cumulative_interest_balance
+    apply_loan_snapshot(loan, state)
+
+    db.session.commit()
+
+def append_ledger_balances(loan_id, entry_id):
+    """
+    Fast path for a ledger row appended at the end of a loan's ledger: its
+    allocation is derived from the previous row's stored balances alone.
+    Back-dated rows, and loans whose previous row was never allocated by the
+    engine (only application/disbursement rows so far), get a full replay.
+    """
+    # 🔒 Serialize appends per loan so the previous row is final
+    loan = Loan.query.filter_by(id=loan_id).with_for_update().first()
+    entry = LedgerEntry.query.get(entry_id)
+    if not loan or not entry:
+        return
+
+    later = LedgerEntry.query.filter(
+        LedgerEntry.loan_id == loan.id,
+        db.or_(
+            LedgerEntry.date > entry.date,
+            db.and_(LedgerEntry.date == entry.date, LedgerEntry.id > entry.id)
+        )
+    ).first()
+
+    previous = (
+        LedgerEntry.query
+        .filter(
+            LedgerEntry.loan_id == loan.id,
+            db.or_(
+                LedgerEntry.date < entry.date,
+                db.and_(LedgerEntry.date == entry.date, LedgerEntry.id < entry.id)
+            )
+        )
+        .order_by(LedgerEntry.date.desc(), LedgerEntry.id.desc())
+        .first()
     )
-    loan.status = 'Paid' if loan.remaining_balance <= 0 else 'Partially Paid'
+
+    if later or previous is None or ledger_kind(previous.particulars) in FIXED_KINDS:
+        recalc_repayment_balances(loan.id)
+        return
+
+    result, state = allocate_row(
+        state_from_row(previous, loan.amount_paid),
+        ledger_kind(entry.particulars),
+        entry.payment
+    )
+    for column, value in result._asdict().items():
+        setattr(entry, column, value)
+
+    apply_loan_snapshot(loan, state)
 
     db.session.commit()
 
+def apply_loan_snapshot(loan, state):
+    """Copy the final allocation state onto the loan's summary columns."""
+    for column, value in loan_snapshot(state).items():
+        setattr(loan, column, value)
+
+    mark_loan_kpi_days(loan)
+
 @loan_bp.route('/loan/<int:loan_id>')
 @login_required
 @roles_required(
@@ -327,9 +300,11 @@ def add_cumulative_interest(loan_id):
     )
 
     db.session.add(entry)
+    db.session.flush()
+    sync_cashbook_source('ledger', entry)
     db.session.commit()
 
-    recalc_repayment_balances(loan.id)
+    append_ledger_balances(loan.id, entry.id)
 
     flash('Cumulative interest added.', 'success')
     return redirect(url_for('loan.loan_details', loan_id=loan.id))
@@ -348,15 +323,7 @@ def delete_ledger_entry(entry_id):
         return redirect(url_for('loan.loan_details', loan_id=loan_id))
 
     # Delete corresponding cashbook entry, if any
-    cb_entry = CashbookEntry.query.filter_by(
-        date=entry.date,
-        particulars=entry.particulars,
-        company_id=entry.loan.company_id if entry.loan else None,
-        branch_id=entry.loan.branch_id if entry.loan else None
-    ).first()
-
-    if cb_entry:
-        db.session.delete(cb_entry)
+    remove_cashbook_source('ledger', entry.id)
 
     # Delete the ledger entry
     db.session.delete(entry)
@@ -398,6 +365,7 @@ def edit_ledger_entry(entry_id):
 
     # 🔹 Update ledger
     entry.payment = payment
+    sync_cashbook_source('ledger', entry)
     db.session.commit()
 
     # 🔹 Recalculate ledger balances
@@ -476,19 +444,8 @@ def add_loan():
         total_due = amount_borrowed + (amount_borrowed * (interest_rate / 100))
         remaining_balance = total_due - amount_paid
 
-        # Generate unique loan_id
-        last_loan = Loan.query.filter_by(company_id=current_user.company_id).order_by(Loan.id.desc()).first()
-        last_number = 0
-        if last_loan and last_loan.loan_id:
-            try:
-                last_number = int(last_loan.loan_id.split("-")[-1][1:])
-            except (ValueError, IndexError):
-                pass
-
-        loan_id = f"C{current_user.company_id}-T{last_number + 1:05d}"
-
+        # loan_id is drawn from the company's counter on flush (see sequences.py)
         loan = Loan(
-            loan_id=loan_id,
             borrower_id=borrower.id,
             borrower_name=borrower.name,
             phone_number=borrower.phone,
@@ -527,17 +484,8 @@ def add_loan():
             db.session.add(collateral_entry)
 
         # Cashbook entries
-        if processing_fee > 0:
-            db.session.add(CashbookEntry(
-                date=loan_date,
-                particulars=f"Processing fee received from {borrower.name}",
-                debit=0.0,
-                credit=processing_fee,
-                balance=0.0,
-                company_id=current_user.company_id,
-                branch_id=branch_id,
-                created_by=current_user.id
-            ))
+        sync_cashbook_source('processing_fee', loan)
+        mark_loan_kpi_days(loan)
 
         # Ledger: Loan Application Submitted
         db.session.add(LedgerEntry(
@@ -580,7 +528,7 @@ def add_loan():
         db.session.commit()
 
         log_action(f"{current_user.full_name} created loan {loan.loan_id} for {borrower.name} (Amount: {amount_borrowed})")
-        flash(f'Loan {loan_id} added successfully.', 'success')
+        flash(f'Loan {loan.loan_id} added successfully.', 'success')
         return redirect(url_for('loan.pending_loans'))
 
     borrowers = Borrower.query.filter_by(company_id=current_user.company_id)
@@ -600,8 +548,11 @@ def pending_loans():
     if branch_id:
         query = query.filter_by(branch_id=branch_id)
 
-    loans = query.order_by(Loan.date.desc()).all()
-    return render_template('loans/pending_loans.html', loans=loans)
+    page = keyset_page(
+        query, Loan.date, Loan.id,
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return render_template('loans/pending_loans.html', loans=page.items, page=page)
 
 # Rejected loans
 @loan_bp.route('/rejected-loans')
@@ -687,10 +638,11 @@ def loan_revision_hub():
 @roles_required('Admin', 'Branch_Manager', 'Loans Supervisor')
 def search_loan_for_revision():
     query = request.args.get('query', '')
-    loans = Loan.query.filter(
-        (Loan.id.like(f'%{query}%')) |
-        (Loan.borrower_name.ilike(f'%{query}%'))
-    ).all()
+    loans = apply_search(
+        get_company_filter(Loan),
+        loan_search(query),
+        (Loan.date.desc(),)
+    ).limit(SEARCH_RESULTS_LIMIT).all()
     return render_template('loans/search_results.html', loans=loans, query=query)
 
 from math import ceil
@@ -701,84 +653,74 @@ def loans_in_arrears():
     """
     Display loans that are past due date and not yet fully paid.
     Uses same logic as loan_details page (Overdue = due_date < today and remaining_balance > 0).
+    Rows, last repayment dates and totals each come from a single query;
+    pages are keyset paginated with the `after` cursor.
     """
     branch_id = session.get('active_branch_id')
     today = datetime.utcnow().date()
 
-    # Base query
-    query = Loan.query.filter(
-        Loan.company_id == current_user.company_id,
-        Loan.remaining_balance > 0,
-        Loan.due_date < datetime.combine(today, datetime.min.time())
-    )
-
     # Apply branch restriction (if not superuser)
-    if branch_id and not current_user.is_superuser:
-        query = query.filter_by(branch_id=branch_id)
+    scope_branch_id = branch_id if branch_id and not current_user.is_superuser else None
 
-    # Fetch results
-    loans = query.order_by(Loan.due_date.asc()).all()
-
-    enriched_loans = []
-    total_amount_borrowed = Decimal('0')
-    total_balance = Decimal('0')
-    total_penalty = Decimal('0')
-    total_arrears = Decimal('0')
-
-    for loan in loans:
-        # Calculate penalty (same logic as your arrears route)
-        penalty = Decimal(loan.cumulative_interest or 0)
-        remaining_balance = Decimal(loan.remaining_balance or 0)
-        total_arrear = remaining_balance + penalty
-
-        # Days overdue
-        days_overdue = (today - loan.due_date.date()).days if loan.due_date else 0
-
-        # Last repayment date
-        last_repayment = (
-            db.session.query(LoanRepayment.date_paid)
-            .filter_by(loan_id=loan.id)
-            .order_by(LoanRepayment.date_paid.desc())
-            .first()
-        )
-        last_repayment_date = last_repayment[0] if last_repayment else None
-
-        enriched_loans.append({
-            'loan_code': loan.loan_id,
-            'name': loan.borrower_name,
-            'phone': loan.borrower.phone if loan.borrower else 'N/A',
-            'amount_borrowed': loan.amount_borrowed,
-            'disbursement_date': loan.date,
-            'balance': remaining_balance,
-            'penalty': penalty,
-            'total_arrears': total_arrear,
-            'days': days_overdue,
-            'last_repayment': last_repayment_date,
-            'due_date': loan.due_date,
-        })
-
-        total_amount_borrowed += Decimal(loan.amount_borrowed or 0)
-        total_balance += remaining_balance
-        total_penalty += penalty
-        total_arrears += total_arrear
-
-    # 🔽 Sort by fewest overdue days first
-    enriched_loans.sort(key=lambda x: x['days'])
-
-    totals = {
-        'amount': total_amount_borrowed,
-        'original_balance': total_balance,
-        'penalty': total_penalty,
-        'total_arrears': total_arrears
-    }
+    page = arrears_page(current_user.company_id, scope_branch_id, today, after=request.args.get('after'))
+    totals = arrears_totals(current_user.company_id, scope_branch_id, today)
 
     return render_template(
         'loans/loans_in_arrears.html',
-        loans=enriched_loans,
+        loans=page.items,
         totals=totals,
-        today=today
+        today=today,
+        next_cursor=page.next_cursor,
+        is_first_page=not page.has_prev
+    )
+
+def _par_scope():
+    """Company and branch the PAR report runs on (branch ignored for superusers)."""
+    branch_id = session.get('active_branch_id')
+    return current_user.company_id, branch_id if branch_id and not current_user.is_superuser else None
+
+def _json_ready(values):
+    return {
+        key: float(value) if isinstance(value, Decimal) else
+        value.isoformat() if isinstance(value, (date, datetime)) else value
+        for key, value in values.items()
+    }
+
+@loan_bp.route('/loans/par')
+@login_required
+@roles_required('Admin', 'Branch_Manager', 'Loans Supervisor', 'Accountant')
+def par_report_view():
+    """Portfolio-at-risk aging buckets per branch and loan officer."""
+    company_id, branch_id = _par_scope()
+    report = par_report(company_id, branch_id)
+    trend = par_trend(company_id, branch_id, since=date.today() - timedelta(days=365))
+
+    return render_template(
+        'loans/par_report.html',
+        report=report,
+        buckets=PAR_BUCKETS,
+        thresholds=PAR_THRESHOLDS,
+        trend=[_json_ready(point) for point in trend]
     )
 
+@loan_bp.route('/loans/par/data')
+@login_required
+@roles_required('Admin', 'Branch_Manager', 'Loans Supervisor', 'Accountant')
+def par_report_data():
+    company_id, branch_id = _par_scope()
+    report = par_report(company_id, branch_id)
+    trend_days = request.args.get('trend_days', 365, type=int)
+
+    return jsonify({
+        'as_of': report['as_of'].isoformat(),
+        'rows': [_json_ready(row) for row in report['rows']],
+        'totals': _json_ready(report['totals']),
+        'trend': [
+            _json_ready(point)
+            for point in par_trend(company_id, branch_id, since=date.today() - timedelta(days=trend_days))
+        ]
+    })
+
 @csrf.exempt
 @loan_bp.route('/loan/<int:loan_id>/approve', methods=['POST'])
 @login_required
@@ -824,17 +766,10 @@ def approve_loan(loan_id):
         running_balance=loan.amount_borrowed + total_interest
     )
     db.session.add(ledger_disbursed)
+    db.session.flush()
 
     # Cashbook Entry: Loan disbursement
-    add_cashbook_entry(
-        date=loan.date,
-        particulars=f"Loan disbursed to {loan.borrower.name}",
-        debit=Decimal(str(loan.amount_borrowed)),
-        credit=Decimal('0'),
-        company_id=loan.company_id,
-        branch_id=loan.branch_id,
-        created_by=current_user.id
-    )
+    sync_cashbook_source('ledger', ledger_disbursed)
 
     # Log action
     log_action(
@@ -878,6 +813,13 @@ def edit_loan(loan_id):
 
     if request.method == 'POST':
         try:
+            # Rollup days the loan currently feeds (date/due date may move)
+            mark_loan_kpi_days(loan)
+
+            # Approved loans take amount paid, balance and status from their ledger
+            approved = loan.approval_status == 'approved'
+            terms = (float(loan.amount_borrowed or 0), float(loan.interest_rate or 0))
+
             loan.borrower_name = request.form['borrower_name']
             loan.phone_number = request.form['phone_number']
             loan.amount_borrowed = float(request.form['amount_borrowed'])
@@ -887,8 +829,10 @@ def edit_loan(loan_id):
             # Total due recalculated
             loan.total_due = loan.amount_borrowed + (loan.amount_borrowed * (loan.interest_rate / 100))
 
-            loan.amount_paid = float(request.form['amount_paid'])
-            loan.remaining_balance = loan.total_due - loan.amount_paid
+            if not approved:
+                loan.amount_paid = float(request.form['amount_paid'])
+                loan.remaining_balance = loan.total_due - loan.amount_paid
+                loan.status = 'Paid' if loan.remaining_balance <= 0 else 'Pending'
             loan.date = datetime.strptime(request.form['date'], '%Y-%m-%d')
             loan.collateral = request.form['collateral']
 
@@ -896,10 +840,16 @@ def edit_loan(loan_id):
             loan.duration_value = int(request.form['loan_duration_value'])
             loan.duration_unit = request.form['loan_duration_unit']
 
-            # Update loan status
-            loan.status = 'Paid' if loan.remaining_balance <= 0 else 'Pending'
+            # Fee, date and borrower name feed the loan's cashbook rows
+            sync_cashbook_loan(loan)
+            mark_loan_kpi_days(loan)
 
-            db.session.commit()
+            if approved and terms != (loan.amount_borrowed, loan.interest_rate):
+                # New principal/rate: replay the ledger so stored row balances (which the
+                # append fast path builds on) match the new terms; commits the edit too
+                recalc_repayment_balances(loan.id)
+            else:
+                db.session.commit()
             log_action(f"{current_user.full_name} edited loan {loan.loan_id} for {loan.borrower_name}")
             flash('Loan updated successfully.', 'success')
             return redirect(url_for('loan.view_loans'))
@@ -924,6 +874,8 @@ def delete_loan(loan_id):
         flash("You are not allowed to delete loans from another branch.", "danger")
         return redirect(url_for('loan.view_loans'))
 
+    remove_cashbook_loan(loan)
+    mark_loan_kpi_days(loan)
     db.session.delete(loan)
     db.session.commit()
 
@@ -1024,14 +976,16 @@ def repay_loan(loan_id):
     )
 
     db.session.add(entry)
+    db.session.flush()
+    sync_cashbook_source('ledger', entry)
     db.session.commit()
 
     # 🔹 Create voucher from ledger entry
     from routes.voucher_routes import create_voucher_from_ledger
     create_voucher_from_ledger(entry)
 
-    # 🔁 Recalculate EVERYTHING from ledger
-    recalc_repayment_balances(loan.id)
+    # 🔁 Allocate from the previous row (full replay only if back-dated)
+    append_ledger_balances(loan.id, entry.id)
 
 
     flash('Repayment recorded successfully.', 'success')
@@ -1058,6 +1012,11 @@ def loan_ledger(loan_id):
         ledger_entries=ledger_entries
     )
 
+LEDGER_PDF_CSS = '''
+    .text-center { text-align: center; }
+    .logo { width: 80px; }
+'''
+
 @loan_bp.route('/loans/<loan_id>/ledger/pdf')
 @login_required
 def generate_ledger_pdf(loan_id):
@@ -1068,37 +1027,16 @@ def generate_ledger_pdf(loan_id):
     # Fetch company info for current user's company
     company = Company.query.get(current_user.company_id)
 
-    # Render HTML with company
-    rendered_html = render_template(
+    # Render HTML with company and generate PDF
+    pdf = render_pdf_template(
         'loans/ledger_pdf.html',
+        stylesheets=(BASE_CSS, LEDGER_PDF_CSS),
         loan=loan,
         ledger_entries=ledger_entries,
         company=company
     )
-    
-    # Generate PDF
-    pdf_io = BytesIO()
-    HTML(string=rendered_html, base_url='').write_pdf(
-        pdf_io,
-        stylesheets=[
-            CSS(string='''
-                @page { size: A4; margin: 1cm; }
-                body { font-family: Arial, sans-serif; font-size: 12px; }
-                .text-center { text-align: center; }
-                .logo { width: 80px; }
-                table { border-collapse: collapse; width: 100%; }
-                th, td { border: 1px solid #ccc; padding: 5px; }
-                th { background-color: #f2f2f2; }
-            ''')
-        ]
-    )
-    
-    # Send PDF as response
-    pdf_io.seek(0)
-    response = make_response(pdf_io.read())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'inline; filename=ledger_{loan.loan_id}.pdf'
-    return response
+
+    return pdf_response(pdf, f'ledger_{loan.loan_id}.pdf', inline=True)
 
 # View repayment history
 @csrf.exempt
@@ -1138,85 +1076,23 @@ def view_repayments(loan_id):
 @login_required
 @roles_required('Admin', 'Accountant', 'Branch_Manager' 'Loans_Officer', 'Loans Supervisor',)
 def export_loans(file_type):
-    query = get_company_filter(Loan).order_by(Loan.date.desc())
+    params = {
+        'search': request.args.get('search', '').strip(),
+        'month': request.args.get('month'),
+        'year': request.args.get('year'),
+    }
 
-    search = request.args.get('search', '').strip()
-    month = request.args.get('month')
-    year = request.args.get('year')
+    if file_type == 'csv':
+        # Streamed straight from the query, row by row
+        query = loans_export_query(None if current_user.is_superuser else current_user.company_id, params)
+        return csv_response('loans.csv', LOAN_COLUMNS, loans_export_rows(stream_rows(query)))
 
-    if search:
-        query = query.filter((Loan.loan_id.ilike(f"%{search}%")) | (Loan.borrower_name.ilike(f"%{search}%")))
-    if month:
-        query = query.filter(func.strftime('%m', Loan.date) == month)
-    if year:
-        query = query.filter(func.strftime('%Y', Loan.date) == year)
+    if file_type not in ('excel', 'pdf'):
+        return "Unsupported file type", 400
 
-    loans = query.all()
-
-    # Prepare data
-    data = [{
-        'Loan ID': loan.loan_id,
-        'Borrower': loan.borrower_name,
-        'Date': loan.date.strftime('%Y-%m-%d'),
-        'Amount Borrowed': loan.amount_borrowed,
-        'Processing Fee': loan.processing_fee,
-        'Total Due': loan.total_due,
-        'Amount Paid': loan.amount_paid,
-        'Remaining Balance': loan.remaining_balance,
-        'Status': loan.status
-    } for loan in loans]
-
-    # Add totals row
-    totals = {
-        'Loan ID': 'TOTAL',
-        'Borrower': '',
-        'Date': '',
-        'Amount Borrowed': sum(loan.amount_borrowed or 0 for loan in loans),
-        'Processing Fee': sum(loan.processing_fee or 0 for loan in loans),
-        'Total Due': sum(loan.total_due or 0 for loan in loans),
-        'Amount Paid': sum(loan.amount_paid or 0 for loan in loans),
-        'Remaining Balance': sum(loan.remaining_balance or 0 for loan in loans),
-        'Status': ''
-    }
-    data.append(totals)
-
-    df = pd.DataFrame(data)
-
-    if file_type == 'excel':
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Loans')
-        output.seek(0)
-        return send_file(output, download_name='loans.xlsx', as_attachment=True)
-
-    elif file_type == 'pdf':
-        from xhtml2pdf import pisa
-        from flask import render_template_string
-
-        html = render_template_string("""
-            <h2>Loan Export Report</h2>
-            <table border="1" cellspacing="0" cellpadding="5">
-                <tr>
-                    {% for column in df.columns %}
-                        <th>{{ column }}</th>
-                    {% endfor %}
-                </tr>
-                {% for row in df.values %}
-                    <tr>
-                        {% for cell in row %}
-                            <td>{{ cell }}</td>
-                        {% endfor %}
-                    </tr>
-                {% endfor %}
-            </table>
-        """, df=df)
-
-        pdf = io.BytesIO()
-        pisa.CreatePDF(io.StringIO(html), dest=pdf)
-        pdf.seek(0)
-        return send_file(pdf, download_name="loans.pdf", as_attachment=True)
-
-    return "Unsupported file type", 400
+    # Built by the export worker; the user waits on the job page
+    job = enqueue_export('loans', file_type, current_user, params=params)
+    return redirect(url_for('exports.job_status', job_id=job.id))
 
 @loan_bp.route('/loan/<int:loan_id>/export_pdf')
 @login_required
@@ -1239,32 +1115,8 @@ def export_loan_pdf(loan_id):
         if os.path.exists(logo_file_path):
             context['logo_path'] = company.logo_url
 
-    # Render HTML
-    html = render_template('loans/export_loan_pdf.html', **context)
-
-    # Create PDF
-    pdf = BytesIO()
-    pisa_status = pisa.CreatePDF(
-        src=html,
-        dest=pdf,
-        link_callback=link_callback
-    )
-
-    if pisa_status.err:
-        return "PDF generation failed", 500
+    # Render HTML and create PDF
+    pdf = render_pdf_template('loans/export_loan_pdf.html', **context)
 
-    pdf.seek(0)
-    return send_file(pdf, as_attachment=True,
-                     download_name=f"loan_{loan.loan_id}_details.pdf",
-                     mimetype='application/pdf')
+    return pdf_response(pdf, f"loan_{loan.loan_id}_details.pdf")
 
-# Helper function to resolve static files for xhtml2pdf
-def link_callback(uri, rel):
-    """Resolve static file paths for xhtml2pdf."""
-    if uri.startswith('/static/'):
-        path = os.path.join(current_app.root_path, uri.lstrip('/'))
-    else:
-        path = uri
-    if not os.path.isfile(path):
-        raise Exception(f'Missing file: {path}')
-    return path
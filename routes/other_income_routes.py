@@ -5,7 +5,8 @@ from models import OtherIncome
 from datetime import datetime
 from utils.decorators import roles_required
 from extensions import csrf
-from routes.cashbook_routes import add_cashbook_entry
+from decimal import Decimal
+from cashbook_helpers import sync_cashbook_source
 
 other_income_bp = Blueprint('other_income', __name__,)
 
@@ -65,18 +66,11 @@ def add_income():
         )
 
         db.session.add(new_income)
-        db.session.commit()
+        db.session.flush()
 
         # Add to cashbook
-        add_cashbook_entry(
-            date=income_date,
-            particulars=f"Other Income: {description}",
-            debit=Decimal('0.00'),
-            credit=amount,
-            company_id=current_user.company_id,
-            branch_id=session.get("active_branch_id"),
-            created_by=current_user.id
-        )
+        sync_cashbook_source('other_income', new_income)
+        db.session.commit()
 
         flash('Other income added successfully.', 'success')
         return redirect(url_for('other_income.view_other_income'))
@@ -101,14 +95,10 @@ def edit_income(income_id):
         request.form['income_date'], '%Y-%m-%d'
     ).date()
 
+    # 🔁 Update only this income's cashbook row
+    sync_cashbook_source('other_income', income)
     db.session.commit()
 
-    # 🔁 Rebuild cashbook safely
-    refresh_cashbook(
-        company_id=income.company_id,
-        branch_id=income.branch_id
-    )
-
     flash('Income updated successfully.', 'success')
     return redirect(url_for('other_income.view_income'))
 
@@ -126,13 +116,9 @@ def delete_income(income_id):
     # Soft delete (preferred)
     income.is_active = False
 
+    # 🔁 Inactive income drops its cashbook row
+    sync_cashbook_source('other_income', income)
     db.session.commit()
 
-    # 🔁 Rebuild cashbook
-    refresh_cashbook(
-        company_id=income.company_id,
-        branch_id=income.branch_id
-    )
-
     flash('Income deleted successfully.', 'success')
     return redirect(url_for('other_income.view_income'))
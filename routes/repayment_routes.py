@@ -1,17 +1,19 @@
-from flask import Blueprint, render_template, request, send_file, make_response, session, flash
+from flask import Blueprint, render_template, request, send_file, make_response, session, flash, redirect, url_for
 from flask_login import login_required, current_user
 from utils.decorators import superuser_required, roles_required, admin_or_superuser_required
 from datetime import datetime, timedelta
 from utils.logging import log_company_action, log_system_action, log_action
-from xhtml2pdf import pisa
 import io
 from models import Borrower, Loan, LoanRepayment, LedgerEntry
 from extensions import db
 from flask import session
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, contains_eager
 from io import BytesIO
 import calendar
 from sqlalchemy import func
+from utils.period_filter import filter_by_period
+from keyset import keyset_page
+from export_jobs import enqueue_export
 
 # Create the blueprint
 repayment_bp = Blueprint('repayments', __name__)
@@ -44,54 +46,29 @@ def all_repayments():
         repayments_query = repayments_query.filter(Loan.branch_id == branch_id)
 
     # 📅 DATE FILTERS
-    if filter_type == 'today':
-        repayments_query = repayments_query.filter(
-            LedgerEntry.date == today
-        )
-
-    elif filter_type == 'weekly':
-        start_week = today - timedelta(days=today.weekday())  # Monday
-        end_week = start_week + timedelta(days=7)
-        repayments_query = repayments_query.filter(
-            LedgerEntry.date >= start_week,
-            LedgerEntry.date < end_week
-        )
-
-    elif filter_type == 'monthly':
-        month = int(request.args.get('month', today.month))
-        year = int(request.args.get('year', today.year))
-        start_date = datetime(year, month, 1).date()
-        month_days = calendar.monthrange(year, month)[1]
-        end_date = start_date + timedelta(days=month_days)
-        repayments_query = repayments_query.filter(
-            LedgerEntry.date >= start_date,
-            LedgerEntry.date < end_date
-        )
-
-    elif filter_type == 'yearly':
-        year = int(request.args.get('year', today.year))
-        start_date = datetime(year, 1, 1).date()
-        end_date = datetime(year, 12, 31).date()
-        repayments_query = repayments_query.filter(
-            LedgerEntry.date >= start_date,
-            LedgerEntry.date <= end_date
-        )
-
-    # 🔽 ORDER & FETCH
-    repayments = (
-        repayments_query
-        .order_by(LedgerEntry.date.desc(), LedgerEntry.id.desc())
-        .all()
+    repayments_query = filter_by_period(
+        repayments_query, LedgerEntry.date, filter_type,
+        month=request.args.get('month'), year=request.args.get('year'), today=today
     )
 
-    # 💰 TOTAL COLLECTED (LEDGER-BASED)
-    total_collected = sum(
-        (r.payment or Decimal('0.00')) for r in repayments
+    # 💰 TOTAL COLLECTED (LEDGER-BASED) — one aggregate over the whole period
+    total_entries, total_collected = repayments_query.with_entities(
+        func.count(LedgerEntry.id),
+        func.coalesce(func.sum(LedgerEntry.payment), 0)
+    ).one()
+
+    # 🔽 ORDER & FETCH — keyset page on (date, id); loans come from the join
+    page = keyset_page(
+        repayments_query.options(contains_eager(LedgerEntry.loan)),
+        LedgerEntry.date, LedgerEntry.id,
+        after=request.args.get('after'), before=request.args.get('before')
     )
 
     return render_template(
         'repayments/view_repayments.html',
-        repayments=repayments,
+        repayments=page.items,
+        page=page,
+        total_entries=total_entries,
         total_collected=total_collected,
         filter=filter_type,
         months=[(i, calendar.month_name[i]) for i in range(1, 13)],
@@ -104,69 +81,13 @@ def all_repayments():
 @login_required
 @roles_required('Admin', 'Accountant', 'Branch_Manager', 'Loans_Officer', 'Loans Supervisor', 'Cashier')
 def export_pdf():
-    branch_id = session.get('active_branch_id')
-    filter_type = request.args.get('filter_type', 'all')  # default to all
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-
-    # Base query
-    repayments_query = LoanRepayment.query.join(Loan).join(Borrower)\
-        .options(joinedload(LoanRepayment.loan).joinedload(Loan.borrower))\
-        .filter(Loan.company_id == current_user.company_id)
-
-    # Filter by branch
-    if branch_id:
-        repayments_query = repayments_query.filter(Loan.branch_id == branch_id)
-
-    # Date filtering
-    today = datetime.today().date()
-    if filter_type == 'today':
-        repayments_query = repayments_query.filter(func.date(LoanRepayment.date_paid) == today)
-        filter_label = f"Today ({today.strftime('%Y-%m-%d')})"
-    elif filter_type == 'month':
-        repayments_query = repayments_query.filter(
-            extract('year', LoanRepayment.date_paid) == today.year,
-            extract('month', LoanRepayment.date_paid) == today.month
-        )
-        filter_label = f"This Month ({today.strftime('%B %Y')})"
-    elif filter_type == 'year':
-        repayments_query = repayments_query.filter(
-            extract('year', LoanRepayment.date_paid) == today.year
-        )
-        filter_label = f"This Year ({today.year})"
-    elif filter_type == 'custom' and start_date and end_date:
-        try:
-            start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            repayments_query = repayments_query.filter(
-                func.date(LoanRepayment.date_paid).between(start, end)
-            )
-            filter_label = f"Custom Range ({start.strftime('%Y-%m-%d')} to {end.strftime('%Y-%m-%d')})"
-        except ValueError:
-            filter_label = "All"
-    else:
-        filter_label = "All"
-
-    repayments = repayments_query.all()
-    total_collected = sum(r.amount_paid for r in repayments)
-
-    # Render HTML
-    html = render_template(
-        'repayments/pdf_template.html',
-        repayments=repayments,
-        total_collected=total_collected,
-        filter_label=filter_label
-    )
-
-    # Convert to PDF
-    pdf = BytesIO()
-    pisa.CreatePDF(BytesIO(html.encode('utf-8')), dest=pdf)
-
-    response = make_response(pdf.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=repayments_{today}.pdf'
-
-    return response
+    # Built by the export worker; the user waits on the job page
+    job = enqueue_export('repayments', 'pdf', current_user, branch_id=session.get('active_branch_id'), params={
+        'filter_type': request.args.get('filter_type', 'all'),
+        'start_date': request.args.get('start_date'),
+        'end_date': request.args.get('end_date'),
+    })
+    return redirect(url_for('exports.job_status', job_id=job.id))
 
 @repayment_bp.route('/repayments/charts')
 @login_required
@@ -185,15 +106,8 @@ def repayment_charts():
     if not current_user.is_superuser:
         query = query.join(Loan).filter(Loan.company_id == current_user.company_id)
 
-    today = datetime.today().date()
-    if filter_option == 'today':
-        query = query.filter(db.func.date(LoanRepayment.date_paid) == today)
-    elif filter_option == 'week':
-        start_of_week = today - timedelta(days=today.weekday())
-        query = query.filter(db.func.date(LoanRepayment.date_paid) >= start_of_week)
-    elif filter_option == 'month':
-        start_of_month = today.replace(day=1)
-        query = query.filter(db.func.date(LoanRepayment.date_paid) >= start_of_month)
+    if filter_option in ('today', 'week', 'month'):
+        query = filter_by_period(query, LoanRepayment.date_paid, filter_option)
 
     repayments = query.all()
     total_amount = sum(r.amount_paid for r in repayments)
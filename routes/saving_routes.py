@@ -7,11 +7,13 @@ from extensions import db
 from flask import session
 from utils import get_company_filter
 from utils.branch_filter import filter_by_active_branch
+from utils.period_filter import filter_by_period
+from keyset import keyset_page
 from extensions import csrf
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, timedelta
 from calendar import month_name
-from routes.cashbook_routes import add_cashbook_entry
+from cashbook_helpers import sync_cashbook_source, remove_cashbook_source
 
 savings_blueprint = Blueprint('savings', __name__)
 
@@ -38,42 +40,19 @@ def view_savings():
     if branch_id:
         query = query.filter_by(branch_id=branch_id)
 
-    # 🔎 FILTER LOGIC
-    if filter_type == 'today':
-        query = query.filter(
-            db.func.date(SavingAccount.date_opened) == today
-        )
-
-    elif filter_type == 'weekly':
-        start_week = today - timedelta(days=today.weekday())
-        query = query.filter(
-            SavingAccount.date_opened >= start_week
-        )
+    # 🔎 FILTER LOGIC (date_opened range, not func.date())
+    query = filter_by_period(query, SavingAccount.date_opened, filter_type, today=today)
 
-    elif filter_type == 'monthly':
-        start_month = today.replace(day=1)
-        end_month = today.replace(
-            day=monthrange(today.year, today.month)[1]
-        )
-        query = query.filter(
-            SavingAccount.date_opened.between(start_month, end_month)
-        )
-
-    elif filter_type == 'yearly':
-        start_year = today.replace(month=1, day=1)
-        query = query.filter(
-            SavingAccount.date_opened >= start_year
-        )
-
-    accounts = (
-        query
-        .order_by(desc(SavingAccount.date_opened))
-        .all()
+    page = keyset_page(
+        query, SavingAccount.date_opened, SavingAccount.id,
+        after=request.args.get('after'), before=request.args.get('before')
     )
+    accounts = page.items
 
     return render_template(
         'savings/view_savings.html',
         accounts=accounts,
+        page=page,
         filter=filter_type
     )
 
@@ -167,21 +146,9 @@ def view_transactions(saving_id):
 
     today = datetime.today().date()
 
-    if filter_type == 'today':
-        transactions_query = transactions_query.filter(SavingTransaction.date >= today)
-    elif filter_type == 'weekly':
-        week_start = today - timedelta(days=today.weekday())  # Monday
-        transactions_query = transactions_query.filter(SavingTransaction.date >= week_start)
-    elif filter_type == 'monthly' and month and year:
-        transactions_query = transactions_query.filter(
-            SavingTransaction.date >= datetime(year, month, 1),
-            SavingTransaction.date < datetime(year, month % 12 + 1, 1)
-        )
-    elif filter_type == 'yearly' and year:
-        transactions_query = transactions_query.filter(
-            SavingTransaction.date >= datetime(year, 1, 1),
-            SavingTransaction.date < datetime(year + 1, 1, 1)
-        )
+    transactions_query = filter_by_period(
+        transactions_query, SavingTransaction.date, filter_type, month=month, year=year, today=today
+    )
 
     transactions = transactions_query.order_by(SavingTransaction.date).all()
 
@@ -242,18 +209,11 @@ def deposit(saving_id):
     # Create transaction
     tx = SavingTransaction(account_id=saving.id, transaction_type='deposit', amount=amount)
     db.session.add(tx)
-    db.session.commit()
+    db.session.flush()
 
     # Add to cashbook
-    add_cashbook_entry(
-        date=datetime.utcnow().date(),
-        particulars=f"Savings deposit by {saving.borrower.name}",
-        debit=Decimal('0.00'),
-        credit=amount,
-        company_id=current_user.company_id,
-        branch_id=branch_id,
-        created_by=current_user.id
-    )
+    sync_cashbook_source('saving_transaction', tx)
+    db.session.commit()
 
     flash('Deposit successful.', 'success')
     return redirect(url_for('savings.view_transactions', saving_id=saving.id))
@@ -286,18 +246,11 @@ def withdraw(saving_id):
     # Create transaction
     tx = SavingTransaction(account_id=saving.id, transaction_type='withdrawal', amount=amount)
     db.session.add(tx)
-    db.session.commit()
+    db.session.flush()
 
     # Add to cashbook
-    add_cashbook_entry(
-        date=datetime.utcnow().date(),
-        particulars=f"Savings withdrawal by {saving.borrower.name}",
-        debit=amount,
-        credit=Decimal('0.00'),
-        company_id=current_user.company_id,
-        branch_id=branch_id,
-        created_by=current_user.id
-    )
+    sync_cashbook_source('saving_transaction', tx)
+    db.session.commit()
 
     flash('Withdrawal successful.', 'success')
     return redirect(url_for('savings.view_transactions', saving_id=saving.id))
@@ -338,24 +291,10 @@ def edit_transaction(tx_id):
     # Update transaction
     tx.amount = new_amount
     tx.date = datetime.utcnow().date()
-    db.session.commit()
-
-    # Update cashbook
-    cb_entry = CashbookEntry.query.filter_by(
-        date=tx.date,
-        particulars=f"Savings {tx.transaction_type} by {saving.borrower.name}",
-        branch_id=branch_id,
-        company_id=current_user.company_id
-    ).first()
 
-    if cb_entry:
-        if tx.transaction_type == 'deposit':
-            cb_entry.credit = new_amount
-            cb_entry.debit = Decimal('0.00')
-        else:
-            cb_entry.debit = new_amount
-            cb_entry.credit = Decimal('0.00')
-        db.session.commit()
+    # Update cashbook (keyed lookup, survives borrower renames)
+    sync_cashbook_source('saving_transaction', tx)
+    db.session.commit()
 
     flash('Transaction updated successfully.', 'success')
     return redirect(url_for('savings.view_transactions', saving_id=saving.id))
@@ -380,15 +319,7 @@ def delete_transaction(tx_id):
         saving.balance += tx.amount
 
     # Delete cashbook entry
-    cb_entry = CashbookEntry.query.filter_by(
-        date=tx.date,
-        particulars=f"Savings {tx.transaction_type} by {saving.borrower.name}",
-        branch_id=branch_id,
-        company_id=current_user.company_id
-    ).first()
-
-    if cb_entry:
-        db.session.delete(cb_entry)
+    remove_cashbook_source('saving_transaction', tx.id)
 
     # Delete transaction
     db.session.delete(tx)
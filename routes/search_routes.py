@@ -0,0 +1,41 @@
+from flask import Blueprint, request, jsonify, session
+from flask_login import login_required, current_user
+from utils.decorators import roles_required
+from search_index import DEFAULT_LIMIT, typeahead_borrowers, typeahead_loans
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+
+TYPEAHEAD_SOURCES = {
+    'borrowers': typeahead_borrowers,
+    'loans': typeahead_loans,
+}
+
+
+@search_bp.route('/typeahead')
+@login_required
+@roles_required('Admin', 'Accountant', 'Branch_Manager', 'Loans_Officer', 'Loans Supervisor', 'Loans_Supervisor', 'Cashier')
+def typeahead():
+    """
+    Ranked matches for a search box: ?q=<text>&type=loans|borrowers&limit=N.
+    Scoped to the user's company and active branch (superusers search all
+    companies); at most MAX_LIMIT rows.
+    """
+    text = request.args.get('q', '').strip()
+    source = TYPEAHEAD_SOURCES.get(request.args.get('type', 'loans'))
+    if source is None:
+        return jsonify({'error': 'Unknown search type'}), 400
+
+    # One character matches too much to be useful
+    if len(text) < 2:
+        return jsonify([])
+
+    # ✅ Company/branch scope as on the list pages
+    company_id = None if current_user.is_superuser else current_user.company_id
+    branch_id = None if current_user.is_superuser else session.get('active_branch_id')
+
+    results = source(
+        company_id, text,
+        branch_id=branch_id,
+        limit=request.args.get('limit', DEFAULT_LIMIT)
+    )
+    return jsonify(results)
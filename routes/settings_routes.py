@@ -8,6 +8,7 @@ from flask import send_file
 from werkzeug.utils import secure_filename
 from werkzeug.security import check_password_hash, generate_password_hash
 from forms import ChangePasswordForm
+from session_principal import bump_principal_version
 from extensions import csrf
 
 settings_bp = Blueprint('settings', __name__, url_prefix='/settings')
@@ -25,6 +26,7 @@ def profile():
         else:
             current_user.set_password(form.new_password.data)
             db.session.commit()
+            bump_principal_version(current_user.id)
             flash('Password updated successfully.', 'success')
             return redirect(url_for('settings.profile'))
 
@@ -44,6 +46,7 @@ def system_preferences():
         current_user.timezone = timezone
         current_user.language = language
         db.session.commit()
+        bump_principal_version(current_user.id)
 
         flash("Preferences saved successfully.", "success")
 
@@ -3,15 +3,11 @@ from flask_login import login_required, current_user
 from utils.decorators import roles_required
 from extensions import db
 from models import Voucher, Loan, Borrower, Branch, Company, LedgerEntry, LoanRepayment, User
-from num2words import num2words
 from datetime import datetime, timedelta, date
 from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import mm
 from extensions import csrf
+from pdf_service import render_pdf_template, pdf_response
+from keyset import keyset_page
 
 voucher_bp = Blueprint('voucher_bp', __name__, url_prefix='/vouchers')
 
@@ -24,10 +20,13 @@ def vouchers():
     company_id = current_user.company_id
     branch_id = current_user.branch_id
 
-    vouchers = Voucher.query.filter_by(company_id=company_id, branch_id=branch_id)\
-                            .order_by(Voucher.date.desc()).all()
+    query = Voucher.query.filter_by(company_id=company_id, branch_id=branch_id)
+    page = keyset_page(
+        query, Voucher.date, Voucher.id,
+        after=request.args.get('after'), before=request.args.get('before')
+    )
 
-    return render_template('vouchers/vouchers.html', vouchers=vouchers)
+    return render_template('vouchers/vouchers.html', vouchers=page.items, page=page)
 
 def create_voucher_from_ledger(entry: LedgerEntry):
     """
@@ -58,6 +57,8 @@ def create_voucher_from_ledger(entry: LedgerEntry):
 @voucher_bp.route('/view/<int:voucher_id>')
 @login_required
 def view_voucher(voucher_id):
+    from num2words import num2words
+
     voucher = Voucher.query.get_or_404(voucher_id)
 
     # Ledger-safe allocations
@@ -125,6 +126,8 @@ def clear_old_vouchers():
 @voucher_bp.route('/<int:voucher_id>/receipt')
 @login_required
 def view_receipt(voucher_id):
+    from num2words import num2words
+
     voucher = Voucher.query.get_or_404(voucher_id)
 
     # Fetch related objects safely
@@ -172,6 +175,8 @@ def view_receipt(voucher_id):
 @voucher_bp.route('/<int:voucher_id>/download_pdf')
 @login_required
 def download_voucher_pdf(voucher_id):
+    from num2words import num2words
+
     # Fetch voucher
     voucher = Voucher.query.get_or_404(voucher_id)
 
@@ -198,93 +203,22 @@ def download_voucher_pdf(voucher_id):
     # Amount in words
     amount_words = num2words(voucher.amount, to='currency', lang='en').replace('euro','shillings').title()
 
-    # Create PDF buffer
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        rightMargin=10*mm,
-        leftMargin=10*mm,
-        topMargin=15*mm,
-        bottomMargin=15*mm
+    # Render receipt and build PDF
+    pdf = render_pdf_template(
+        'vouchers/receipt_pdf.html',
+        voucher=voucher,
+        company=company,
+        branch=branch,
+        borrower=borrower,
+        loan=loan,
+        user=user,
+        amount_words=amount_words,
+        principal_paid=principal_paid,
+        interest_paid=interest_paid,
+        cumulative_interest=cumulative_interest
     )
 
-    # Styles
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='TitleCenter', parent=styles['Title'], alignment=1, fontSize=18, spaceAfter=10))
-    styles.add(ParagraphStyle(name='HeadingCenter', parent=styles['Heading2'], alignment=1, fontSize=14, spaceAfter=10))
-    styles.add(ParagraphStyle(name='NormalLeft', parent=styles['Normal'], alignment=0, fontSize=11, spaceAfter=6))
-    styles.add(ParagraphStyle(name='ItalicLeft', parent=styles['Italic'], alignment=0, fontSize=10, spaceAfter=6))
-
-    elements = []
-
-    # Header
-    elements.append(Paragraph(company.name if company else 'Company', styles['TitleCenter']))
-    elements.append(Paragraph(
-        f"Branch: {branch.name if branch else ''} | Contact: {branch.phone_number if branch else ''}", 
-        styles['HeadingCenter']
-    ))
-    elements.append(Spacer(1, 10))
-    elements.append(Paragraph(f"Payment Receipt (Voucher #: {voucher.voucher_number})", styles['HeadingCenter']))
-    elements.append(Spacer(1, 10))
-
-    # Payment acknowledgment
-    elements.append(Paragraph(f"Received from: {borrower.name if borrower else 'N/A'}", styles['NormalLeft']))
-    elements.append(Paragraph(f"Loan ID: {loan.loan_id if loan else 'N/A'}", styles['NormalLeft']))
-    elements.append(Paragraph(f"Date: {voucher.date.strftime('%Y-%m-%d')}", styles['NormalLeft']))
-    elements.append(Paragraph(f"Amount Paid: {voucher.amount:,.2f} ({amount_words})", styles['NormalLeft']))
-    elements.append(Spacer(1, 10))
-
-    # Allocation table
-    data = [
-        ['Allocation', 'Amount'],
-        ['Principal', f"{principal_paid:,.2f}"],
-        ['Interest', f"{interest_paid:,.2f}"],
-        ['Cumulative Interest', f"{cumulative_interest:,.2f}"],
-        ['Total', f"{voucher.amount:,.2f}"]
-    ]
-
-    page_width, _ = A4
-    usable_width = page_width - 20*mm  # left + right margins
-
-    table = Table(data, colWidths=[usable_width*0.7, usable_width*0.3], hAlign='CENTER')
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.grey),
-        ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
-        ('ALIGN',(0,0),(-1,-1),'CENTER'),
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('FONTSIZE', (0,0), (-1,-1), 11),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-        ('TOPPADDING', (0,0), (-1,-1), 6),
-    ]))
-    elements.append(table)
-    elements.append(Spacer(1, 24))
-
-    # Footer note
-    elements.append(Paragraph("Note: This receipt is not valid without the company stamp/seal.", styles['ItalicLeft']))
-    elements.append(Spacer(1, 36))
-
-    # Signature blocks
-    signature_table = Table([
-        ['Client Signature: ____________________', f"Served By: {user.full_name if user else 'System'} ____________________"]
-    ], colWidths=[usable_width/2, usable_width/2], hAlign='CENTER')
-    signature_table.setStyle(TableStyle([
-        ('ALIGN',(0,0),(-1,-1),'CENTER'),
-        ('FONTSIZE', (0,0), (-1,-1), 11),
-        ('TOPPADDING',(0,0),(-1,-1),20)
-    ]))
-    elements.append(signature_table)
-
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-
-    return send_file(
-        buffer, 
-        as_attachment=True, 
-        download_name=f"Receipt_{voucher.voucher_number}.pdf", 
-        mimetype='application/pdf'
-    )
+    return pdf_response(pdf, f"Receipt_{voucher.voucher_number}.pdf")
 
 @voucher_bp.route('/vouchers/json', methods=['GET'])
 @login_required
@@ -4,6 +4,7 @@ import sqlite3
 from extensions import db
 from app import create_app
 from models import User, Company, Loan
+from sequences import SequenceBlock
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 
@@ -50,14 +51,19 @@ def migrate_loans():
     columns = [desc[0] for desc in cursor.description]
     rows = cursor.fetchall()
 
+    user = User.query.first()
+    if not user:
+        print("❌ No user found. Cannot migrate loans without users.")
+        return
+
+    # Reserve loan numbers a block at a time instead of one upsert per row
+    loan_ids = SequenceBlock.for_loans(user.company_id, size=max(len(rows), 1))
+
     for row in rows:
         data = dict(zip(columns, row))
-        user = User.query.first()
-        if not user:
-            print("❌ No user found. Cannot migrate loans without users.")
-            return
 
         loan = Loan(
+            loan_id=next(loan_ids),
             borrower_name=data['borrower_name'],
             phone_number=data['phone_number'],
             amount_borrowed=data['amount_borrowed'],
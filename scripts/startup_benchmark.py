@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Measure worker startup: wall time and peak RSS of importing app and calling
+create_app(), in fresh interpreters, plus which heavy PDF/data libraries got
+imported along the way (they should load on first use, not at startup).
+
+    python scripts/startup_benchmark.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+HEAVY_MODULES = (
+    'pandas', 'numpy', 'xhtml2pdf', 'weasyprint', 'reportlab',
+    'num2words', 'googleapiclient', 'google_auth_oauthlib',
+)
+
+# Runs in a child process so every sample starts from an empty module cache
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_mb': rss_kb / 1024,
+    'heavy': sorted(m for m in %r if m in sys.modules),
+}))
+""" % (HEAVY_MODULES,)
+
+
+def sample():
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=ROOT, check=True,
+        capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    samples = [sample() for _ in range(args.runs)]
+    seconds = [s['seconds'] for s in samples]
+    rss = [s['rss_mb'] for s in samples]
+
+    print(f"create_app() over {args.runs} runs:")
+    print(f"  time   median {statistics.median(seconds):.3f}s  min {min(seconds):.3f}s  max {max(seconds):.3f}s")
+    print(f"  rss    median {statistics.median(rss):.1f} MB  max {max(rss):.1f} MB")
+
+    heavy = samples[-1]['heavy']
+    if heavy:
+        print(f"  heavy modules imported at startup: {', '.join(heavy)}")
+        sys.exit(1)
+    print("  no heavy modules imported at startup")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Borrower and loan lookup.
+
+A "contains" search (`ilike('%q%')`) cannot use a b-tree index. On
+PostgreSQL the searched columns carry pg_trgm GIN indexes, which do serve
+ILIKE '%q%', and matches are ranked by similarity(). On SQLite the same
+columns are mirrored into FTS5 tables with the trigram tokenizer
+(borrowers_fts, loans_fts; kept current by triggers) and ranked by bm25.
+Both are created by migration a7d3e9f1b2c4. Without them (an older SQLite,
+a database built with create_all) the search falls back to plain ILIKE.
+
+Trigram indexes need at least MIN_CHARS characters; shorter input is
+matched as a prefix.
+"""
+from sqlalchemy import func, literal_column, or_, select
+from sqlalchemy.sql import column, table
+
+from extensions import db
+from models import Borrower, Loan
+
+MIN_CHARS = 3
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Searched columns per model, as (model column, FTS5 column)
+BORROWER_FIELDS = ((Borrower.name, 'name'), (Borrower.phone, 'phone'))
+LOAN_FIELDS = ((Loan.loan_id, 'loan_id'), (Loan.borrower_name, 'borrower_name'), (Loan.phone_number, 'phone_number'))
+
+_FTS_TABLES = {Borrower: 'borrowers_fts', Loan: 'loans_fts'}
+_fts_present = {}
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fts_table(model):
+    """The model's FTS5 table on SQLite, or None if it isn't there."""
+    name = _FTS_TABLES[model]
+    if name not in _fts_present:
+        found = db.session.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': name}
+        ).first()
+        _fts_present[name] = found is not None
+    if not _fts_present[name]:
+        return None
+    return table(name, column('rowid'), column('rank'))
+
+
+def _fts_phrase(text):
+    # One quoted phrase: with the trigram tokenizer this is a substring match
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _like_condition(fields, text):
+    pattern = f"%{_escape_like(text)}%" if len(text) >= MIN_CHARS else f"{_escape_like(text)}%"
+    return or_(*(field.ilike(pattern, escape='\\') for field, _ in fields))
+
+
+def _search(model, fields, text):
+    """
+    (condition, rank) for rows of `model` matching `text`; order by rank
+    descending. rank is None when the backend cannot rank.
+    """
+    text = (text or '').strip()
+    dialect = _dialect()
+
+    if len(text) >= MIN_CHARS and dialect == 'sqlite':
+        fts = _fts_table(model)
+        if fts is not None:
+            matches = select(fts.c.rowid, fts.c.rank)\
+                .where(literal_column(fts.name).op('MATCH')(_fts_phrase(text)))\
+                .subquery()
+            condition = model.id.in_(select(matches.c.rowid))
+            # FTS5 rank is bm25(), where lower is better
+            rank = select(-matches.c.rank).where(matches.c.rowid == model.id).scalar_subquery()
+            return condition, rank
+
+    condition = _like_condition(fields, text)
+    if len(text) >= MIN_CHARS and dialect == 'postgresql':
+        rank = func.greatest(*(func.similarity(func.coalesce(field, ''), text) for field, _ in fields))
+        return condition, rank
+    return condition, None
+
+
+def borrower_search(text):
+    """(condition, rank) for borrowers whose name or phone contains `text`."""
+    return _search(Borrower, BORROWER_FIELDS, text)
+
+
+def loan_search(text):
+    """
+    (condition, rank) for loans whose loan_id, borrower name or phone
+    contains `text`; a number also matches the loan's database id.
+    """
+    condition, rank = _search(Loan, LOAN_FIELDS, text)
+    text = (text or '').strip()
+    if text.isdigit():
+        condition = or_(condition, Loan.id == int(text))
+    return condition, rank
+
+
+def apply_search(query, search, default_order):
+    """Filter `query` by a (condition, rank) pair and order best match first."""
+    condition, rank = search
+    query = query.filter(condition)
+    if rank is None:
+        return query.order_by(*default_order)
+    return query.order_by(rank.desc(), *default_order)
+
+
+def _limit(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def typeahead_borrowers(company_id, text, branch_id=None, limit=DEFAULT_LIMIT):
+    """Ranked borrower matches (company_id None = all companies)."""
+    query = db.session.query(Borrower.id, Borrower.borrower_id, Borrower.name, Borrower.phone)
+    if company_id is not None:
+        query = query.filter(Borrower.company_id == company_id)
+    if branch_id:
+        query = query.filter(Borrower.branch_id == branch_id)
+    query = apply_search(query, borrower_search(text), (Borrower.name, Borrower.id))
+
+    return [
+        {'id': row.id, 'borrower_id': row.borrower_id, 'name': row.name, 'phone': row.phone}
+        for row in query.limit(_limit(limit))
+    ]
+
+
+def typeahead_loans(company_id, text, branch_id=None, limit=DEFAULT_LIMIT, approval_status=None):
+    """Ranked unarchived loan matches (company_id None = all companies)."""
+    query = db.session.query(
+        Loan.id, Loan.loan_id, Loan.borrower_name, Loan.phone_number,
+        Loan.amount_borrowed, Loan.remaining_balance, Loan.due_date, Loan.status
+    ).filter(Loan.is_archived.is_(False))
+    if company_id is not None:
+        query = query.filter(Loan.company_id == company_id)
+    if branch_id:
+        query = query.filter(Loan.branch_id == branch_id)
+    if approval_status:
+        query = query.filter(Loan.approval_status == approval_status)
+    query = apply_search(query, loan_search(text), (Loan.date.desc(), Loan.id.desc()))
+
+    return [
+        {
+            'id': row.id,
+            'loan_id': row.loan_id,
+            'borrower': row.borrower_name,
+            'phone': row.phone_number,
+            'amount': row.amount_borrowed,
+            'balance': row.remaining_balance,
+            'due_date': row.due_date.strftime('%Y-%m-%d') if row.due_date else 'N/A',
+            'status': row.status,
+        }
+        for row in query.limit(_limit(limit))
+    ]
@@ -0,0 +1,94 @@
+"""
+Per-company document numbers (loan_id, voucher_number).
+
+The last number issued for each (company, prefix) is kept in one
+sequence_counters row. Taking a number is a single statement that creates
+or increments that row and returns the new value (INSERT ... ON CONFLICT
+DO UPDATE ... RETURNING, on PostgreSQL and SQLite 3.35+). Two cashiers can
+therefore never draw the same number: the second waits on the first's row
+lock until its transaction ends. Nothing scans loans or vouchers.
+
+Numbers are drawn on the caller's connection, inside its transaction, so
+a rolled-back insert hands its number back. Bulk imports reserve a block
+in one increment (SequenceBlock); numbers left in a block are skipped.
+"""
+from datetime import datetime
+
+from extensions import db
+from models import SequenceCounter
+from upserts import dialect_insert
+
+LOAN_ID_WIDTH = 5
+VOUCHER_NUMBER_WIDTH = 4
+
+
+def reserve(company_id, prefix, count=1, connection=None):
+    """Reserve `count` consecutive numbers for (company, prefix); returns the first."""
+    connection = connection or db.session.connection()
+    counters = SequenceCounter.__table__
+    now = datetime.utcnow()
+
+    insert = dialect_insert(connection.dialect.name)
+    statement = insert(counters).values(company_id=company_id, prefix=prefix, value=count, updated_at=now)
+    statement = statement.on_conflict_do_update(
+        index_elements=[counters.c.company_id, counters.c.prefix],
+        set_={'value': counters.c.value + count, 'updated_at': now}
+    ).returning(counters.c.value)
+
+    last = connection.execute(statement).scalar_one()
+    return last - count + 1
+
+
+def loan_id_prefix(company_id):
+    return f"C{company_id}-T"
+
+
+def voucher_number_prefix(company_id, year=None):
+    return f"VCH-{year or datetime.utcnow().year}-C{company_id}-"
+
+
+def next_loan_id(company_id, connection=None):
+    prefix = loan_id_prefix(company_id)
+    return f"{prefix}{reserve(company_id, prefix, connection=connection):0{LOAN_ID_WIDTH}d}"
+
+
+def next_voucher_number(company_id, year=None, connection=None):
+    prefix = voucher_number_prefix(company_id, year)
+    return f"{prefix}{reserve(company_id, prefix, connection=connection):0{VOUCHER_NUMBER_WIDTH}d}"
+
+
+class SequenceBlock:
+    """
+    Codes for a bulk import: `size` numbers are reserved per round trip
+    instead of one per row.
+
+        loan_ids = SequenceBlock.for_loans(company_id)
+        loan.loan_id = next(loan_ids)
+    """
+
+    def __init__(self, company_id, prefix, width, size=100, connection=None):
+        self.company_id = company_id
+        self.prefix = prefix
+        self.width = width
+        self.size = size
+        self.connection = connection
+        self._next = self._end = 0
+
+    @classmethod
+    def for_loans(cls, company_id, size=100, connection=None):
+        return cls(company_id, loan_id_prefix(company_id), LOAN_ID_WIDTH, size, connection)
+
+    @classmethod
+    def for_vouchers(cls, company_id, year=None, size=100, connection=None):
+        return cls(company_id, voucher_number_prefix(company_id, year), VOUCHER_NUMBER_WIDTH, size, connection)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._next >= self._end:
+            self._next = reserve(self.company_id, self.prefix, self.size, self.connection)
+            self._end = self._next + self.size
+        number = self._next
+        self._next += 1
+        return f"{self.prefix}{number:0{self.width}d}"
@@ -0,0 +1,150 @@
+"""
+Session-cached login principal.
+
+With SESSION_PRINCIPAL_CACHE on, a snapshot of the logged-in user's hot
+fields (id, company, branch, roles, preferences) is kept in the session,
+signed with its own salt and a max age of SESSION_PRINCIPAL_TTL. The user
+loader trusts it while the user's version counter is unchanged, so most
+requests never read the users table. Anything not in the snapshot loads
+the real User on first access. Counters live in the dashboard cache
+backend; use a shared (Redis) backend when running several workers.
+"""
+from flask import current_app, session
+from flask_login import UserMixin
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
+
+from extensions import db
+from dashboard_cache import get_backend
+from models import User
+
+SESSION_KEY = '_principal'
+DEFAULT_TTL = 300
+
+# Session.info key holding the users whose version is bumped when the transaction commits
+_PENDING_USERS = 'principal_version_users'
+
+SNAPSHOT_FIELDS = (
+    'id', 'username', 'email', 'full_name', 'company_id', 'branch_id',
+    'is_active', 'is_superuser', 'theme', 'timezone', 'language',
+)
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='session-principal')
+
+
+def _version_key(user_id):
+    return f"principal:v:{user_id}"
+
+
+def principal_version(user_id):
+    return get_backend().get(_version_key(user_id)) or 0
+
+
+def bump_principal_version(user_id):
+    """Call after a user's roles, branch, password or preferences change."""
+    if user_id is not None:
+        get_backend().incr(_version_key(user_id))
+
+
+def bump_principal_version_on_commit(user_id):
+    """
+    Bump once the current transaction commits; a rollback forgets it. Bumping
+    earlier would let a request in between snapshot the old roles under the
+    new version.
+    """
+    if user_id is not None:
+        db.session.info.setdefault(_PENDING_USERS, set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed_users(session):
+    for user_id in session.info.pop(_PENDING_USERS, ()):
+        bump_principal_version(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back_users(session, previous_transaction):
+    # A savepoint rollback leaves the outer transaction's changes pending
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_USERS, None)
+
+
+def load_full_user(user_id):
+    return db.session.get(
+        User, int(user_id),
+        options=[joinedload(User.roles), joinedload(User.company)]
+    )
+
+
+class SessionPrincipal(UserMixin):
+    """Stands in for current_user; falls back to the User row for anything else."""
+
+    def __init__(self, snapshot):
+        self.__dict__['_snapshot'] = snapshot
+        self.__dict__['_user'] = None
+        self.__dict__['role_set'] = frozenset(snapshot['roles'])
+
+    def _load(self):
+        if self._user is None:
+            self.__dict__['_user'] = load_full_user(self._snapshot['id'])
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        snapshot = self.__dict__['_snapshot']
+        if name in snapshot:
+            return snapshot[name]
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        # Writes go to the real row; the snapshot is rebuilt next request
+        setattr(self._load(), name, value)
+        if name in self._snapshot:
+            self._snapshot[name] = value
+            session.pop(SESSION_KEY, None)
+
+    @property
+    def is_active(self):
+        return self._snapshot['is_active']
+
+    # Role checks read role_set, same as on User
+    role_names = User.role_names
+    is_admin = User.is_admin
+    is_company_admin = User.is_company_admin
+    has_role = User.has_role
+
+    def __repr__(self):
+        return f"<SessionPrincipal {self._snapshot['username']}>"
+
+
+def store_principal(user):
+    """Write the signed snapshot of `user` into the session."""
+    snapshot = {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+    snapshot['roles'] = sorted(user.role_set)
+    snapshot['version'] = principal_version(user.id)
+    session[SESSION_KEY] = _serializer().dumps(snapshot)
+
+
+def clear_principal():
+    session.pop(SESSION_KEY, None)
+
+
+def load_principal(user_id):
+    """The session snapshot for user_id if it is authentic, fresh and current; else None."""
+    token = session.get(SESSION_KEY)
+    if not token:
+        return None
+    try:
+        snapshot = _serializer().loads(
+            token, max_age=current_app.config.get('SESSION_PRINCIPAL_TTL', DEFAULT_TTL)
+        )
+    except (BadSignature, SignatureExpired):
+        return None
+
+    if str(snapshot.get('id')) != str(user_id) or snapshot.get('version') != principal_version(user_id):
+        return None
+    return SessionPrincipal(snapshot)
@@ -0,0 +1,16 @@
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+
+def test_app_imports_with_cli_commands():
+    import config
+    # No DATABASE_URL here; keep create_app() off the production URL
+    config.Config.SQLALCHEMY_DATABASE_URI = "sqlite://"
+
+    import app as app_module
+
+    commands = app_module.app.cli.commands
+    for name in ("create-superuser", "seed-roles", "cashbook-sync", "ledger-rebuild",
+                 "kpi-rollup", "par-snapshot", "export-worker"):
+        assert name in commands
@@ -0,0 +1,43 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from extensions import db
+
+
+def _book(branch_id=None):
+    from models import CashbookEntry
+    query = CashbookEntry.query.filter_by(company_id=1)
+    if branch_id:
+        query = query.filter_by(branch_id=branch_id)
+    return query.order_by(CashbookEntry.date, CashbookEntry.id).all()
+
+
+def test_two_branches_viewed_per_branch_and_company_wide(app):
+    from cashbook_helpers import flush_cashbook_balances, mark_cashbook_dirty, recalculate_balances, window_balances
+    from models import CashbookEntry
+
+    # Branch 1 takes in 100 then 10; branch 2 takes in 50 between them
+    for day, branch_id, credit in ((1, 1, 100), (2, 2, 50), (3, 1, 10)):
+        db.session.add(CashbookEntry(company_id=1, branch_id=branch_id, date=date(2026, 1, day),
+                                     particulars="in", debit=0, credit=credit, created_by=1))
+    db.session.commit()
+    recalculate_balances(1)
+
+    # A company-wide marker must not rewrite the branch books with company totals
+    mark_cashbook_dirty(1, None, date(2026, 1, 1))
+    db.session.commit()
+    flush_cashbook_balances(1)
+
+    for branch_id, expected in ((1, [100, 110]), (2, [50])):
+        entries = _book(branch_id)
+        assert [e.balance for e in entries] == [Decimal(v) for v in expected]
+        balances = window_balances(entries, 1, branch_id)
+        assert [balances[e.id] for e in entries] == [Decimal(v) for v in expected]
+
+    entries = _book()
+    balances = window_balances(entries, 1)
+    assert [balances[e.id] for e in entries] == [Decimal(100), Decimal(150), Decimal(160)]
@@ -0,0 +1,20 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from extensions import db
+
+
+@pytest.mark.parametrize("branch_id", [None, 3])
+def test_one_marker_per_scope_keeps_earliest_date(app, branch_id):
+    from cashbook_helpers import mark_cashbook_dirty
+    from models import CashbookDirtyMarker
+
+    for day in (10, 4, 7):
+        mark_cashbook_dirty(1, branch_id, date(2026, 1, day))
+        db.session.commit()
+
+    markers = CashbookDirtyMarker.query.filter_by(company_id=1, branch_id=branch_id).all()
+    assert [marker.dirty_from for marker in markers] == [date(2026, 1, 4)]
@@ -0,0 +1,76 @@
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from extensions import db
+from keyset import decode_cursor, encode_cursor, keyset_page
+
+
+@pytest.fixture(scope="module")
+def app(module_app):
+    from models import CashbookEntry
+    # Two rows share a date so the id tiebreak is exercised
+    for day in (1, 2, 2, 3, 4):
+        db.session.add(CashbookEntry(company_id=1, date=date(2026, 1, day), particulars=f"d{day}", created_by=1))
+    db.session.commit()
+    return module_app
+
+
+def _ids(page):
+    return [entry.id for entry in page.items]
+
+
+def test_pages_forward_and_back(app):
+    from models import CashbookEntry
+    query = CashbookEntry.query.filter_by(company_id=1)
+    page = lambda **kw: keyset_page(query, CashbookEntry.date, CashbookEntry.id, per_page=2, **kw)
+
+    first = page(count=True)
+    assert _ids(first) == [5, 4] and first.total == 5 and not first.has_prev
+
+    second = page(after=first.next_cursor)
+    assert _ids(second) == [3, 2] and second.has_prev
+
+    last = page(after=second.next_cursor)
+    assert _ids(last) == [1] and not last.has_next
+
+    back = page(before=last.prev_cursor)
+    assert _ids(back) == [3, 2] and back.has_prev and back.has_next
+
+    assert _ids(page(before=back.prev_cursor)) == [5, 4]
+
+
+def test_null_sort_values_are_paged(app):
+    from models import Expense
+    rows = [Expense(description="e", amount=1, company_id=7, created_by_id=1, date=datetime(2026, 1, day))
+            for day in (1, 1, 2, 2)]
+    db.session.add_all(rows)
+    db.session.commit()
+    null_low, jan1, null_high, jan2 = rows[0].id, rows[1].id, rows[2].id, rows[3].id
+    Expense.query.filter(Expense.id.in_([null_low, null_high])).update({'date': None}, synchronize_session=False)
+    db.session.commit()
+
+    # NULL ranks above every date, so undated rows lead the newest-first list
+    query = Expense.query.filter_by(company_id=7)
+    page = lambda **kw: keyset_page(query, Expense.date, Expense.id, per_page=1, **kw)
+
+    seen, cursor = [], None
+    for _ in range(4):
+        current = page(after=cursor)
+        seen += _ids(current)
+        cursor = current.next_cursor
+    assert seen == [null_high, null_low, jan2, jan1] and cursor is None
+
+    second = page(after=page().next_cursor)
+    assert _ids(second) == [null_low] and _ids(page(before=second.prev_cursor)) == [null_high]
+    assert _ids(page(before=encode_cursor((datetime(2026, 1, 2), jan2)))) == [null_low]
+
+
+def test_cursor_round_trip(app):
+    from models import CashbookEntry, Loan
+    assert decode_cursor(encode_cursor((date(2026, 1, 2), 7)), CashbookEntry.date) == (date(2026, 1, 2), 7)
+    assert decode_cursor('2026-01-02T10:30:00_7', Loan.date)[1] == 7
+    assert decode_cursor('garbage', CashbookEntry.date) is None
+    assert decode_cursor(encode_cursor((None, 7)), Loan.date) == (None, 7)
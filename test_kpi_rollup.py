@@ -0,0 +1,42 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from extensions import db
+
+
+@pytest.mark.parametrize("branch_id", [None, 3])
+def test_marking_a_day_twice_keeps_one_row(app, branch_id):
+    from kpi_rollup import mark_kpi_day_stale
+    from models import DailyKpiRollup
+
+    mark_kpi_day_stale(1, branch_id, date(2026, 1, 5))
+    db.session.commit()
+    DailyKpiRollup.query.update({'stale': False})
+    mark_kpi_day_stale(1, branch_id, date(2026, 1, 5))
+    db.session.commit()
+
+    rows = DailyKpiRollup.query.filter_by(company_id=1, branch_id=branch_id).all()
+    assert len(rows) == 1 and rows[0].stale
+
+
+def test_dashboard_cache_is_invalidated_on_commit_only(app):
+    from dashboard_cache import LRUCacheBackend, _version_key, set_backend
+    from kpi_rollup import mark_kpi_day_stale
+
+    backend = LRUCacheBackend()
+    set_backend(backend)
+    try:
+        mark_kpi_day_stale(1, 3, date(2026, 1, 5))
+        assert backend.get(_version_key(1, 3)) is None
+        db.session.commit()
+        assert backend.get(_version_key(1, 3)) == 1
+
+        mark_kpi_day_stale(1, 3, date(2026, 1, 6))
+        db.session.rollback()
+        db.session.commit()
+        assert backend.get(_version_key(1, 3)) == 1
+    finally:
+        set_backend(None)
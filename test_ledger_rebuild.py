@@ -0,0 +1,29 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from extensions import db
+
+
+def test_rebuild_shard_commits_batches_on_sqlite(file_app):
+    from ledger_rebuild import rebuild_shard
+    from models import LedgerEntry, Loan
+
+    # Core inserts: skip the loan number hooks
+    db.session.execute(db.insert(Loan.__table__).values(
+        id=1, borrower_id=1, borrower_name="A", amount_borrowed=100, interest_rate=10,
+        total_due=110, remaining_balance=110, company_id=1
+    ))
+    rows = [("Loan Disbursed", 0)] + [("Loan Repayment", 10)] * 4
+    db.session.execute(db.insert(LedgerEntry.__table__), [
+        {'loan_id': 1, 'date': date(2026, 1, day + 1), 'particulars': particulars, 'payment': payment}
+        for day, (particulars, payment) in enumerate(rows)
+    ])
+    db.session.commit()
+
+    stats = rebuild_shard(0, 1, None, batch_size=2)
+
+    assert stats['loans'] == 1 and stats['rows'] == 5
+    assert db.session.get(Loan, 1).amount_paid == 40
@@ -0,0 +1,46 @@
+from datetime import date
+from decimal import Decimal
+
+from loan_allocation import (
+    KIND_APPLICATION, KIND_DISBURSED, KIND_CUMULATIVE, KIND_REPAYMENT,
+    allocate_ledger, ledger_kind
+)
+
+
+def test_ledger_kind():
+    assert ledger_kind('Loan Application') == KIND_APPLICATION
+    assert ledger_kind(' loan disbursed ') == KIND_DISBURSED
+    assert ledger_kind('Cumulative Interest') == KIND_CUMULATIVE
+    assert ledger_kind('Loan Repayment') == KIND_REPAYMENT
+    assert ledger_kind(None) == 'other'
+
+
+def test_waterfall_pays_cumulative_then_interest_then_principal():
+    rows = [
+        (date(2025, 1, 1), KIND_APPLICATION, Decimal('0')),
+        (date(2025, 1, 2), KIND_DISBURSED, Decimal('0')),
+        (date(2025, 2, 1), KIND_CUMULATIVE, Decimal('50')),
+        (date(2025, 2, 5), KIND_REPAYMENT, Decimal('300')),
+    ]
+    allocated, state = allocate_ledger(Decimal('1000'), Decimal('20'), rows)
+
+    assert allocated[0].interest == Decimal('200')
+    assert allocated[1].interest == Decimal('0.00')
+    assert allocated[2].running_balance == Decimal('1250')
+
+    repayment = allocated[3]
+    assert repayment.cumulative_interest == Decimal('50')
+    assert repayment.interest == Decimal('200')
+    assert repayment.principal == Decimal('50')
+    assert repayment.running_balance == Decimal('950')
+
+    assert state.total_paid == Decimal('300')
+    assert state.principal_balance == Decimal('950')
+
+
+def test_overpayment_clamps_at_zero():
+    rows = [(date(2025, 1, 1), KIND_REPAYMENT, Decimal('5000'))]
+    allocated, state = allocate_ledger(Decimal('1000'), Decimal('10'), rows)
+
+    assert allocated[0].running_balance == Decimal('0')
+    assert state.total_paid == Decimal('1100')
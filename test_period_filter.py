@@ -0,0 +1,29 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from utils.period_filter import period_range
+
+TODAY = date(2026, 12, 17)
+
+
+def test_named_periods_are_half_open():
+    assert period_range('today', today=TODAY) == (date(2026, 12, 17), date(2026, 12, 18))
+    assert period_range('weekly', today=TODAY) == (date(2026, 12, 14), date(2026, 12, 21))
+    assert period_range('month', today=TODAY) == (date(2026, 12, 1), date(2027, 1, 1))
+    assert period_range('yearly', year=2025, today=TODAY) == (date(2025, 1, 1), date(2026, 1, 1))
+
+
+def test_partial_selection_is_completed_from_today():
+    assert period_range(month='2', today=TODAY) == (date(2026, 2, 1), date(2026, 3, 1))
+    assert period_range(day=5, today=TODAY) == (date(2026, 12, 5), date(2026, 12, 6))
+    assert period_range(month=12, year=2025, today=TODAY) == (date(2025, 12, 1), date(2026, 1, 1))
+
+
+def test_no_or_invalid_selection_means_no_filter():
+    assert period_range(today=TODAY) is None
+    assert period_range('all', today=TODAY) is None
+    assert period_range(day=31, month=2, year=2025, today=TODAY) is None
+    assert period_range(month='abc', today=TODAY) is None
@@ -0,0 +1,76 @@
+"""
+EXPLAIN-based checks that the hot list/report queries hit the composite
+indexes declared in models.py, and that sorted lists are read in index
+order rather than through a temporary sort.
+"""
+from datetime import date
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from extensions import db
+
+
+def query_plan(query):
+    sql = query.statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    rows = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def assert_uses(query, index, sorted_by_index=True):
+    plan = query_plan(query)
+    assert index in plan, plan
+    if sorted_by_index:
+        assert "TEMP B-TREE" not in plan, plan
+
+
+def test_loan_list_by_branch(module_app):
+    from models import Loan
+    query = Loan.query.filter(Loan.company_id == 1, Loan.branch_id == 2).order_by(Loan.date.desc())
+    assert_uses(query, "ix_loans_company_branch_date")
+
+
+def test_loans_in_arrears(module_app):
+    from models import Loan
+    query = Loan.query.filter(Loan.company_id == 1, Loan.due_date < date(2026, 1, 1))
+    assert_uses(query, "ix_loans_company_due_date", sorted_by_index=False)
+
+
+def test_loans_of_borrower(module_app):
+    from models import Loan
+    assert_uses(Loan.query.filter(Loan.borrower_id == 7), "ix_loans_borrower_id", sorted_by_index=False)
+
+
+def test_loan_ledger_order(module_app):
+    from models import LedgerEntry
+    query = LedgerEntry.query.filter(LedgerEntry.loan_id == 3).order_by(LedgerEntry.date, LedgerEntry.id)
+    assert_uses(query, "ix_ledger_entries_loan_date")
+
+
+def test_loan_repayments_order(module_app):
+    from models import LoanRepayment
+    query = LoanRepayment.query.filter(LoanRepayment.loan_id == 3).order_by(LoanRepayment.date_paid)
+    assert_uses(query, "ix_loan_repayments_loan_date_paid")
+
+
+def test_cashbook_by_branch(module_app):
+    from models import CashbookEntry
+    query = CashbookEntry.query.filter(CashbookEntry.company_id == 1, CashbookEntry.branch_id == 2)\
+        .order_by(CashbookEntry.date, CashbookEntry.id)
+    assert_uses(query, "ix_cashbook_entries_company_branch_date")
+
+
+def test_expenses_in_period(module_app):
+    from models import Expense
+    query = Expense.query.filter(
+        Expense.company_id == 1, Expense.branch_id == 2,
+        Expense.date >= date(2026, 1, 1), Expense.date < date(2026, 2, 1)
+    ).order_by(Expense.date)
+    assert_uses(query, "ix_expenses_company_branch_date")
+
+
+def test_vouchers_by_branch(module_app):
+    from models import Voucher
+    query = Voucher.query.filter(Voucher.company_id == 1, Voucher.branch_id == 2).order_by(Voucher.date.desc())
+    assert_uses(query, "ix_vouchers_company_branch_date")
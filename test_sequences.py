@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from extensions import db
+from sequences import SequenceBlock, next_loan_id, next_voucher_number, reserve
+
+
+def test_numbers_are_per_company_and_prefix(app):
+    assert next_loan_id(1) == "C1-T00001"
+    assert next_loan_id(1) == "C1-T00002"
+    assert next_loan_id(2) == "C2-T00001"
+    assert next_voucher_number(1, year=2026) == "VCH-2026-C1-0001"
+    assert next_voucher_number(1, year=2027) == "VCH-2027-C1-0001"
+
+
+def test_block_reserves_once_per_block(app):
+    block = SequenceBlock.for_loans(3, size=3)
+    assert [next(block) for _ in range(4)] == ["C3-T00001", "C3-T00002", "C3-T00003", "C3-T00004"]
+    # Second block took 4..6; single allocations continue after it
+    assert reserve(3, "C3-T") == 7
+
+
+def test_rollback_returns_the_number(app):
+    next_loan_id(4)
+    db.session.commit()
+    next_loan_id(4)
+    db.session.rollback()
+    assert next_loan_id(4) == "C4-T00002"
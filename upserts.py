@@ -0,0 +1,43 @@
+"""
+INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and SQLite (3.24+).
+
+Per company/branch rows (branch NULL = company-wide) are kept unique by
+two partial indexes, one over rows with a branch and one over rows
+without: a plain UNIQUE constraint never matches two NULL branches.
+upsert_scope() targets whichever index covers the row being written.
+"""
+from extensions import db
+
+
+def dialect_insert(dialect_name):
+    """The dialect's insert(), which carries on_conflict_do_update()."""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def upsert_scope(table, values, keys, set_, connection=None):
+    """
+    Insert `values` into `table`, or apply `set_` to the row already held for
+    the same company, branch and `keys` columns. `set_` may be a callable
+    taking the statement's `excluded` row and returning the update dict.
+    """
+    connection = connection or db.session.connection()
+    statement = dialect_insert(connection.dialect.name)(table).values(**values)
+    if callable(set_):
+        set_ = set_(statement.excluded)
+
+    key_columns = [table.c[key] for key in keys]
+    if values.get('branch_id') is None:
+        target = {
+            'index_elements': [table.c.company_id, *key_columns],
+            'index_where': table.c.branch_id.is_(None),
+        }
+    else:
+        target = {
+            'index_elements': [table.c.company_id, table.c.branch_id, *key_columns],
+            'index_where': table.c.branch_id.isnot(None),
+        }
+    connection.execute(statement.on_conflict_do_update(set_=set_, **target))
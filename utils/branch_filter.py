@@ -1,8 +1,60 @@
 # utils/branch_filter.py
+import time
 from flask_login import current_user
-from flask import session
+from flask import session, g
+from extensions import db
 from models import Borrower, Branch
 
+# Seconds a validated active branch is trusted from the session
+BRANCH_CACHE_TTL = 60
+
+def _branch_cache_key(company_id):
+    return f"branches:v:{company_id}"
+
+def branch_cache_version(company_id):
+    from dashboard_cache import get_backend
+    return get_backend().get(_branch_cache_key(company_id)) or 0
+
+def invalidate_branch_cache(company_id):
+    """Call after a branch is deleted, toggled or renamed; every session re-validates."""
+    from dashboard_cache import get_backend
+    get_backend().incr(_branch_cache_key(company_id))
+
+def validated_branch(branch_id):
+    """
+    Return {'id', 'name'} if branch_id is a non-deleted branch of the current
+    user's company, else None. Cached for the request in g and for
+    BRANCH_CACHE_TTL seconds in the session, so the hot path needs no query.
+    """
+    if not branch_id:
+        return None
+
+    per_request = g.setdefault('_validated_branches', {})
+    if branch_id in per_request:
+        return per_request[branch_id]
+
+    company_id = current_user.company_id
+    version = branch_cache_version(company_id)
+    cached = session.get('_active_branch_check')
+
+    if (
+        cached
+        and cached['id'] == branch_id
+        and cached['company_id'] == company_id
+        and cached['version'] == version
+        and time.time() - cached['at'] < BRANCH_CACHE_TTL
+    ):
+        branch = {'id': cached['id'], 'name': cached['name']}
+    else:
+        row = db.session.query(Branch.id, Branch.name).filter_by(id=branch_id, company_id=company_id)\
+            .filter(Branch.deleted_at.is_(None)).first()
+        branch = {'id': row.id, 'name': row.name} if row else None
+        if branch:
+            session['_active_branch_check'] = dict(branch, company_id=company_id, version=version, at=time.time())
+
+    per_request[branch_id] = branch
+    return branch
+
 def filter_by_active_branch(query, model=None, borrower_join=False):
     # If superuser, no filtering needed — they can see all data
     if 'superuser' in getattr(current_user, 'roles', []):
@@ -13,18 +65,18 @@ def filter_by_active_branch(query, model=None, borrower_join=False):
         # No active branch selected — return empty result safely
         return query.filter(False)
 
-    # Verify the branch is valid, belongs to current user's company, and not deleted
-    branch = Branch.query.filter_by(id=branch_id, company_id=current_user.company_id).filter(Branch.deleted_at.is_(None)).first()
+    # Verify the branch is valid, belongs to current user's company, and not deleted (cached)
+    branch = validated_branch(branch_id)
     if not branch:
         # Invalid branch in session — return empty result safely
         return query.filter(False)
 
     if borrower_join:
         # Join Borrower and filter by borrower's branch
-        return query.join(Borrower).filter(Borrower.branch_id == branch.id)
+        return query.join(Borrower).filter(Borrower.branch_id == branch['id'])
     elif model and hasattr(model, 'branch_id'):
         # Filter by model's branch_id
-        return query.filter(model.branch_id == branch.id)
+        return query.filter(model.branch_id == branch['id'])
 
     # Fallback: return unfiltered query if conditions don't apply
     return query
@@ -24,7 +24,7 @@ def roles_required(*required_roles):
                 flash("Please log in to continue.", "warning")
                 return redirect(url_for('auth.login'))
 
-            user_roles = [r.name.lower() for r in current_user.roles]
+            user_roles = current_user.role_set
             if not current_user.is_superuser and not any(r in user_roles for r in normalized_required):
                 flash("Access denied: You do not have the required role.", "danger")
                 return redirect(url_for('dashboard.index'))
@@ -41,7 +41,7 @@ def admin_or_superuser_required(func):
             flash("Please log in to continue.", "warning")
             return redirect(url_for('auth.login'))
 
-        user_roles = [role.name.lower() for role in current_user.roles]
+        user_roles = current_user.role_set
 
         if not (current_user.is_superuser or 'admin' in user_roles):
             flash("Access denied: Admins or Superuser only.", "danger")
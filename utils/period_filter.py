@@ -0,0 +1,95 @@
+# utils/period_filter.py
+"""
+Date filters as half-open [start, end) ranges.
+
+extract('month', col), func.date(col) and strftime() wrap the column, so the
+database has to evaluate them row by row; a plain range on the bare column
+is an index range scan on both PostgreSQL and SQLite.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import DateTime, and_
+
+# Spellings the filter forms and export params use for the same period
+PERIOD_ALIASES = {
+    'today': 'today',
+    'week': 'week', 'weekly': 'week',
+    'month': 'month', 'monthly': 'month',
+    'year': 'year', 'yearly': 'year',
+}
+
+
+def _as_int(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _next_month(year, month):
+    return date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+
+
+def period_range(period=None, day=None, month=None, year=None, today=None):
+    """
+    [start, end) dates for a named period ('today', 'week(ly)', 'month(ly)',
+    'year(ly)') or for a day/month/year selection, else None.
+
+    A named period uses the selected month/year when given, otherwise the
+    one containing today. A partial selection is completed from today: a
+    month alone is that month of the current year, a day alone is that day
+    of the current month.
+    """
+    today = today or date.today()
+    day, month, year = _as_int(day), _as_int(month), _as_int(year)
+    period = PERIOD_ALIASES.get(period)
+
+    try:
+        if period == 'today':
+            return today, today + timedelta(days=1)
+        if period == 'week':
+            start = today - timedelta(days=today.weekday())
+            return start, start + timedelta(days=7)
+        if period == 'month':
+            year, month = year or today.year, month or today.month
+            return date(year, month, 1), _next_month(year, month)
+        if period == 'year':
+            year = year or today.year
+            return date(year, 1, 1), date(year + 1, 1, 1)
+
+        if day:
+            year, month = year or today.year, month or today.month
+            start = date(year, month, day)
+            return start, start + timedelta(days=1)
+        if month:
+            year = year or today.year
+            return date(year, month, 1), _next_month(year, month)
+        if year:
+            return date(year, 1, 1), date(year + 1, 1, 1)
+    except ValueError:
+        # Out-of-range selection (month 13, 31 February) is ignored
+        return None
+    return None
+
+
+def range_filter(column, start=None, end=None):
+    """start <= column < end on the bare column; either bound may be None."""
+    if isinstance(column.type, DateTime):
+        # Compare timestamps with timestamps (SQLite stores them as text)
+        start = datetime.combine(start, datetime.min.time()) if start else None
+        end = datetime.combine(end, datetime.min.time()) if end else None
+
+    conditions = []
+    if start is not None:
+        conditions.append(column >= start)
+    if end is not None:
+        conditions.append(column < end)
+    return and_(*conditions)
+
+
+def filter_by_period(query, column, period=None, day=None, month=None, year=None, today=None):
+    """Apply period_range() to `query` on `column`; unchanged if nothing was selected."""
+    bounds = period_range(period, day=day, month=month, year=year, today=today)
+    if bounds is None:
+        return query
+    return query.filter(range_filter(column, *bounds))